@@ -0,0 +1,385 @@
+import os
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from auth_svc import async_access, token_verifier
+from marketplace_svc import async_marketplace as marketplace, pagination
+from marketplace_svc.response_cache import response_cache
+from matrix_com.async_matrix_com import init_router
+from nats_client.nats_client import NATSClient, dispatcher, message_handler
+from upstream import async_upstream
+
+# Async serving mode of the gateway (SERVER_MODE=asgi). The routes and the
+# responses are the same as in server.py, but every upstream call and every
+# NATS publish runs on one event loop.
+
+load_dotenv()
+# Get NATS server URL from environment variables
+nats_server_url = os.getenv("NATS_SERVER_URL", "nats://localhost:4222")  # Default to localhost if not set
+
+# Instantiate NATS client
+nats_client = NATSClient()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup logic
+    print("Starting ASGI API gateway...")
+    token_verifier.start_revocation_listener()
+    await async_upstream.start_all()
+
+    print("Starting NATS client...")
+    await nats_client.connect_async(servers=[nats_server_url])
+    await nats_client.subscribe_async("send.matrix.message", message_handler)
+
+    # Yield control to the application
+    yield
+
+    # Shutdown logic
+    print("Shutting down ASGI API gateway...")
+    await nats_client.close_async()
+    await dispatcher.close()
+    await async_access.batch_verifier.close()
+    await async_upstream.close_all()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.include_router(init_router(nats_client), prefix="/bots")
+
+
+def handle_error_response(error):
+    if error:
+        error_message, status_code = error
+        return JSONResponse({"error": error_message}, status_code=status_code)
+    return None
+
+
+async def get_json_body(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def list_response(items, params):
+    page, next_cursor = pagination.paginate(items, params)
+    headers = {pagination.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return JSONResponse(page, status_code=200, headers=headers)
+
+
+async def stream_response(path, key):
+    """Pass the list under key of the upstream body through, without decoding its items."""
+    upstream_response = await marketplace.stream_collection(path)
+    # Error bodies go through as they are
+    unwrapper = pagination.EnvelopeUnwrapper(key) if upstream_response.status == 200 else None
+
+    async def generate():
+        try:
+            async for chunk in upstream_response.content.iter_chunked(pagination.STREAM_CHUNK_SIZE):
+                data = unwrapper.feed(chunk) if unwrapper else chunk
+                if data:
+                    yield data
+            tail = unwrapper.close() if unwrapper else b""
+            if tail:
+                yield tail
+        finally:
+            upstream_response.release()
+
+    return StreamingResponse(
+        generate(),
+        status_code=upstream_response.status,
+        media_type=upstream_response.headers.get("Content-Type", "application/json"),
+    )
+
+
+# Login route
+@app.post("/api/v1/login")
+async def login(request: Request):
+    token, err = await async_access.login(request.headers.get("Authorization"))
+
+    if not err:
+        return JSONResponse({"access_token": token}, status_code=200)
+    else:
+        return JSONResponse({"error": err}, status_code=401)
+
+
+# Register route
+@app.post("/api/v1/register")
+async def register(request: Request):
+    success, err = await async_access.register(await get_json_body(request))
+
+    if not err:
+        return JSONResponse(success, status_code=201)
+    else:
+        return JSONResponse({"error": err}, status_code=400)
+
+
+# Example of protected route
+@app.get("/api/v1/protected")
+async def protected(request: Request):
+    token = request.headers.get("Authorization", None)
+
+    if not token:
+        return JSONResponse({"error": "Missing Authorization Header"}, status_code=401)
+
+    verified_user, err = await async_access.verify_token(token)
+
+    if verified_user:
+        return JSONResponse({
+            "message": "Access granted",
+            "user": verified_user
+        }, status_code=200)
+    else:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+
+async def verify_request(request: Request):
+    """Return the token of the request, or the 401 response to send back."""
+    token = request.headers.get("Authorization", None)
+
+    if not token:
+        return None, JSONResponse({"error": "Missing Authorization Header"}, status_code=401)
+
+    verified_user, err = await async_access.verify_token(token)
+
+    if not verified_user:
+        return None, JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    return token, None
+
+
+# Forward request to user-service
+@app.get("/api/v1/user/{user_id:int}")
+async def get_user(user_id: int, request: Request):
+    token, error_response = await verify_request(request)
+    if error_response:
+        return error_response
+
+    try:
+        headers = {"Authorization": token}
+        response = await async_upstream.user.get(f"/user/{user_id}", headers=headers)
+        return JSONResponse(response.json(), status_code=response.status_code)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# Forward request to user-service
+@app.put("/api/v1/user/{user_id:int}")
+async def update_user(user_id: int, request: Request):
+    token, error_response = await verify_request(request)
+    if error_response:
+        return error_response
+
+    # Get the data to update from the request body
+    update_data = await get_json_body(request)
+    if not update_data:
+        return JSONResponse({"error": "No data provided"}, status_code=400)
+
+    try:
+        headers = {"Authorization": token, "Content-Type": "application/json"}
+        response = await async_upstream.user.put(
+            f"/user/{user_id}", headers=headers, json=update_data
+        )
+
+        # Return the response from the user-service
+        return JSONResponse(response.json())
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# Forward request to user-service
+@app.delete("/api/v1/user/{user_id:int}")
+async def delete_user(user_id: int, request: Request):
+    token, error_response = await verify_request(request)
+    if error_response:
+        return error_response
+
+    try:
+        headers = {"Authorization": token}
+        response = await async_upstream.user.delete(f"/user/{user_id}", headers=headers)
+
+        # Return the response from the user-service
+        return JSONResponse(response.json())
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ------- User Routes -------
+
+@app.post("/api/v1/users/")
+async def add_user(request: Request):
+    user, error = await marketplace.add_user(await get_json_body(request))
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(user, status_code=201)
+
+
+@app.get("/api/v1/users/")
+async def get_users(request: Request):
+    params, error = pagination.parse_list_params(request.query_params)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return await stream_response("/users/", "users")
+
+    users, error = await marketplace.get_users()
+    if error_response := handle_error_response(error):
+        return error_response
+    return list_response(users, params)
+
+
+@app.get("/api/v1/users/{username}")
+async def get_user_by_username(username: str):
+    user, error = await marketplace.get_user_by_username(username)
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(user, status_code=200)
+
+
+@app.delete("/api/v1/users/{username}")
+async def delete_user_by_username(username: str):
+    _, error = await marketplace.delete_user(username)
+    if error_response := handle_error_response(error):
+        return error_response
+    return Response(status_code=204)
+
+
+# ------- Product Routes -------
+
+@app.post("/api/v1/products/")
+async def add_product(request: Request):
+    product, error = await marketplace.add_product(await get_json_body(request))
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(product, status_code=201)
+
+
+@app.get("/api/v1/products/")
+async def get_products(request: Request):
+    params, error = pagination.parse_list_params(request.query_params)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return await stream_response("/products/", "products")
+
+    products, error = await marketplace.get_products()
+    if error_response := handle_error_response(error):
+        return error_response
+    return list_response(products, params)
+
+
+@app.get("/api/v1/products/{product_id:int}")
+async def get_product_by_id(product_id: int):
+    product, error = await marketplace.get_product_by_id(product_id)
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(product, status_code=200)
+
+
+@app.post("/api/v1/products/{product_id:int}/review/")
+async def update_product_rating(product_id: int, request: Request):
+    product, error = await marketplace.update_product_rating(await get_json_body(request), product_id)
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(product, status_code=200)
+
+
+@app.delete("/api/v1/products/{product_id:int}")
+async def delete_product(product_id: int):
+    _, error = await marketplace.delete_product(product_id)
+    if error_response := handle_error_response(error):
+        return error_response
+    return Response(status_code=204)
+
+
+# ------- Review Routes -------
+
+@app.post("/api/v1/reviews/")
+async def add_review(request: Request):
+    review, error = await marketplace.add_review(await get_json_body(request))
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(review, status_code=201)
+
+
+@app.get("/api/v1/reviews/")
+async def get_reviews(request: Request):
+    params, error = pagination.parse_list_params(request.query_params)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return await stream_response("/reviews/", "reviews")
+
+    reviews, error = await marketplace.get_reviews()
+    if error_response := handle_error_response(error):
+        return error_response
+    return list_response(reviews, params)
+
+
+@app.get("/api/v1/reviews/{product_id:int}")
+async def get_reviews_per_product(product_id: int):
+    reviews, error = await marketplace.get_reviews_per_product(product_id)
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(reviews, status_code=200)
+
+
+# ------- Transaction Routes -------
+
+@app.post("/api/v1/transactions/")
+async def add_transaction(request: Request):
+    transaction, error = await marketplace.add_transaction(await get_json_body(request))
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(transaction, status_code=201)
+
+
+@app.get("/api/v1/transactions/")
+async def get_all_transactions(request: Request):
+    params, error = pagination.parse_list_params(request.query_params)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return await stream_response("/transactions/", "transactions")
+
+    transactions, error = await marketplace.get_all_transactions()
+    if error_response := handle_error_response(error):
+        return error_response
+    return list_response(transactions, params)
+
+
+@app.get("/api/v1/transactions/{user_id:int}")
+async def get_user_transactions(user_id: int):
+    transactions, error = await marketplace.get_user_transactions(user_id)
+    if error_response := handle_error_response(error):
+        return error_response
+    return JSONResponse(transactions, status_code=200)
+
+
+# ------- Metrics Routes -------
+
+@app.get("/metrics/upstreams")
+async def upstream_metrics():
+    return JSONResponse(async_upstream.get_stats(), status_code=200)
+
+
+@app.get("/metrics/verify")
+async def verify_metrics():
+    return JSONResponse(async_access.batch_verifier.get_stats(), status_code=200)
+
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return JSONResponse(response_cache.get_stats(), status_code=200)
+
+
+@app.get("/metrics/nats")
+async def nats_metrics():
+    return JSONResponse(nats_client.get_publish_stats(), status_code=200)
+
+
+@app.get("/metrics/dispatcher")
+async def dispatcher_metrics():
+    return JSONResponse(dispatcher.get_stats(), status_code=200)
@@ -1,6 +1,17 @@
 import os
-import requests
+import queue
+import threading
+import time
 from flask import Request
+from auth_svc import token_verifier
+from upstream import upstream
+
+# Verify tokens with auth-service /verify/batch instead of one /verify per
+# request, only used when the gateway does not verify tokens locally
+VERIFY_BATCHING = os.getenv("AUTH_VERIFY_BATCHING", "false").lower() in ("1", "true", "yes")
+VERIFY_BATCH_MAX = int(os.getenv("AUTH_VERIFY_BATCH_MAX", 100))
+VERIFY_BATCH_WAIT = float(os.getenv("AUTH_VERIFY_BATCH_WAIT_MS", 0)) / 1000
+VERIFY_BATCH_WORKERS = int(os.getenv("AUTH_VERIFY_BATCH_WORKERS", 2))
 
 
 def login(request: Request):
@@ -10,8 +21,8 @@ def login(request: Request):
 
     basicAuth = (auth.username, auth.password)
 
-    response = requests.post(
-        f"http://{os.environ.get('AUTH_SVC_ADDRESS')}/login",
+    response = upstream.auth.post(
+        "/login",
         auth=basicAuth,
     )
 
@@ -29,8 +40,8 @@ def register(request: Request):
     if data is None or 'username' not in data or 'password' not in data:
         return None, ('Username and password are required.', 400)
 
-    response = requests.post(
-        f"http://{os.environ.get('AUTH_SVC_ADDRESS')}/register",
+    response = upstream.auth.post(
+        "/register",
         json=data
     )
 
@@ -49,8 +60,8 @@ def protected(request: Request):
     if not token.startswith("Bearer "):
         token = f"Bearer {token}"  # Ensure the token starts with 'Bearer'
 
-    response = requests.get(
-        f"http://{os.environ.get('AUTH_SVC_ADDRESS')}/protected",
+    response = upstream.auth.get(
+        "/protected",
         headers={"Authorization": token},
     )
 
@@ -60,16 +71,151 @@ def protected(request: Request):
         return None, (response.text, response.status_code)
 
 
-def verify_token(token):
-    """Verify the JWT token by calling the auth-service."""
+def _verify_with_auth_service(token):
     headers = {
         "Authorization": token
     }
-    response = requests.post(
-        f"http://{os.environ.get('AUTH_SVC_ADDRESS')}/verify",
+    response = upstream.auth.post(
+        "/verify",
         headers=headers
     )
     if response.status_code == 200:
         return response.json(), None  # Return the verified user info
     else:
         return None, ("Token verification failed", response.status_code)
+
+
+def batch_results(tokens, body):
+    """Map each token to (user, err) from the answer of /verify/batch."""
+    results = {}
+    for token, result in zip(tokens, body["results"]):
+        if "identity" in result:
+            results[token] = (result["identity"], None)
+        else:
+            results[token] = (None, (result.get("msg", "Token verification failed"), result.get("status", 401)))
+    return results
+
+
+class _PendingVerification:
+    def __init__(self, token):
+        self.token = token
+        self.done = threading.Event()
+        self.result = None  # (user, err), None falls back to /verify
+
+
+class BatchVerifier:
+    """
+    Verifies the tokens of concurrent request threads together, with one
+    auth-service /verify/batch call per micro-batch.
+
+    A request thread queues its token and waits. Each of the workers
+    threads takes what is queued, at most max_batch tokens after waiting up
+    to max_wait seconds for more, and sends it in one call. A lone request
+    goes out right away, while all workers are busy the next tokens pile up
+    into the next batch. A token queued twice is sent once. When the batch
+    call fails (or auth-service has no /verify/batch yet) the waiting
+    threads fall back to /verify.
+    """
+
+    def __init__(self, max_batch=VERIFY_BATCH_MAX, max_wait=VERIFY_BATCH_WAIT,
+                 workers=VERIFY_BATCH_WORKERS, timeout=None):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        # Long enough for a batch call, retries aside
+        self.timeout = timeout or sum(upstream.auth.timeout) + max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self.batches = 0
+        self.verified = 0
+        self.largest_batch = 0
+        self.fallbacks = 0
+
+    def _start(self):
+        with self._lock:
+            if not self._threads:
+                for number in range(self.workers):
+                    thread = threading.Thread(target=self._run, daemon=True, name=f"verify-batch-{number}")
+                    thread.start()
+                    self._threads.append(thread)
+
+    def verify(self, token):
+        """Same result as verify_token, (user, None) or (None, (message, status))."""
+        self._start()
+        pending = _PendingVerification(token)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout) or pending.result is None:
+            with self._lock:
+                self.fallbacks += 1
+            return _verify_with_auth_service(token)
+        return pending.result
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        tokens = list(dict.fromkeys(pending.token for pending in batch))
+        response = upstream.auth.post("/verify/batch", json={"tokens": tokens})
+        if response.status_code != 200:
+            print(f"Batch verification failed with {response.status_code}, falling back to /verify")
+            return {}
+
+        results = batch_results(tokens, response.json())
+        with self._lock:
+            self.batches += 1
+            self.verified += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                results = self._send(batch)
+            except Exception as e:
+                print(f"Batch verification failed, falling back to /verify: {e}")
+                results = {}
+            for pending in batch:
+                pending.result = results.get(pending.token)
+                pending.done.set()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "enabled": VERIFY_BATCHING,
+                "batches": self.batches,
+                "verified": self.verified,
+                "average_batch": round(self.verified / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "fallbacks": self.fallbacks,
+                "queued": self._queue.qsize(),
+            }
+
+
+batch_verifier = BatchVerifier()
+
+
+def verify_token(token):
+    """
+    Verify the JWT token.
+
+    When the gateway shares the signing key with auth-service the token is
+    checked locally against the revocation cache; otherwise the
+    auth-service is asked to verify it, batched with the verifications of
+    other requests when AUTH_VERIFY_BATCHING is set.
+    """
+    if token_verifier.local_verification_enabled():
+        return token_verifier.verify_token_locally(token)
+
+    if VERIFY_BATCHING:
+        return batch_verifier.verify(token)
+    return _verify_with_auth_service(token)
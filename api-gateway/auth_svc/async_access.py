@@ -0,0 +1,170 @@
+import asyncio
+from auth_svc import access, token_verifier
+from upstream import async_upstream
+
+
+async def login(authorization):
+    if not authorization or not authorization.lower().startswith("basic "):
+        return None, ("missing credentials, 401")
+
+    # Forward the Basic credentials unchanged
+    response = await async_upstream.auth.post(
+        "/login",
+        headers={"Authorization": authorization},
+    )
+
+    if response.status_code == 200:
+        # Extract token from JSON response
+        access_token = response.json().get('access_token')
+        return access_token, None
+    else:
+        return None, (response.text, response.status_code)
+
+
+async def register(data):
+    if data is None or 'username' not in data or 'password' not in data:
+        return None, ('Username and password are required.', 400)
+
+    response = await async_upstream.auth.post(
+        "/register",
+        json=data
+    )
+
+    if response.status_code == 201:
+        return response.text, None
+    else:
+        return None, (response.text, response.status_code)
+
+
+async def _verify_with_auth_service(token):
+    headers = {
+        "Authorization": token
+    }
+    response = await async_upstream.auth.post(
+        "/verify",
+        headers=headers
+    )
+    if response.status_code == 200:
+        return response.json(), None  # Return the verified user info
+    else:
+        return None, ("Token verification failed", response.status_code)
+
+
+class AsyncBatchVerifier:
+    """
+    Async version of access.BatchVerifier, for the requests on the loop of
+    the ASGI server.
+
+    A request queues its token and awaits the result. Each of the workers
+    tasks takes what is queued, at most max_batch tokens after waiting up to
+    max_wait seconds for more, and sends it in one /verify/batch call. When
+    the batch call fails the waiting requests fall back to /verify.
+    """
+
+    def __init__(self, max_batch=access.VERIFY_BATCH_MAX, max_wait=access.VERIFY_BATCH_WAIT,
+                 workers=access.VERIFY_BATCH_WORKERS, timeout=None):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        # Long enough for a batch call, retries aside
+        auth_timeout = async_upstream.auth.timeout
+        self.timeout = timeout or (auth_timeout.sock_connect or 0) + (auth_timeout.sock_read or 0) + max_wait
+        self.loop = None
+        self._queue = None
+        self._tasks = []
+        self.batches = 0
+        self.verified = 0
+        self.largest_batch = 0
+        self.fallbacks = 0
+
+    def _start(self):
+        # Workers of another loop (an earlier test client) cannot be awaited here
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self._queue = asyncio.Queue()
+            self._tasks = [loop.create_task(self._run()) for _ in range(self.workers)]
+
+    async def verify(self, token):
+        """Same result as verify_token, (user, None) or (None, (message, status))."""
+        self._start()
+        future = self.loop.create_future()
+        self._queue.put_nowait((token, future))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            result = None
+        if result is None:
+            self.fallbacks += 1
+            return await _verify_with_auth_service(token)
+        return result
+
+    async def _take_batch(self):
+        batch = [await self._queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - self.loop.time()
+                if remaining > 0:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+        return batch
+
+    async def _send(self, batch):
+        tokens = list(dict.fromkeys(token for token, _ in batch))
+        response = await async_upstream.auth.post("/verify/batch", json={"tokens": tokens})
+        if response.status_code != 200:
+            print(f"Batch verification failed with {response.status_code}, falling back to /verify")
+            return {}
+
+        results = access.batch_results(tokens, response.json())
+        self.batches += 1
+        self.verified += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        return results
+
+    async def _run(self):
+        while True:
+            batch = await self._take_batch()
+            try:
+                results = await self._send(batch)
+            except Exception as e:
+                print(f"Batch verification failed, falling back to /verify: {e}")
+                results = {}
+            for token, future in batch:
+                if not future.done():
+                    future.set_result(results.get(token))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.loop = None
+
+    def get_stats(self):
+        return {
+            "enabled": access.VERIFY_BATCHING,
+            "batches": self.batches,
+            "verified": self.verified,
+            "average_batch": round(self.verified / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "fallbacks": self.fallbacks,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+batch_verifier = AsyncBatchVerifier()
+
+
+async def verify_token(token):
+    """Async version of access.verify_token, local verification stays in-process."""
+    if token_verifier.local_verification_enabled():
+        return token_verifier.verify_token_locally(token)
+
+    if access.VERIFY_BATCHING:
+        return await batch_verifier.verify(token)
+    return await _verify_with_auth_service(token)
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+import jwt
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shared with auth-service: tokens are signed there and verified here
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+
+# Redis holds the shared revocation set that auth-service /logout pushes to
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+
+REVOCATION_CHANNEL = "auth:revocations"
+REVOKED_KEY_PREFIX = "auth:revoked:"
+
+
+class RevocationCache:
+    """
+    In-memory set of revoked token ids (jti).
+
+    Every entry is kept only until the revoked token would have expired on
+    its own, after which the signature check rejects it anyway.
+    """
+
+    def __init__(self):
+        self._revoked = {}  # jti -> expiry as epoch seconds
+        self._lock = threading.Lock()
+
+    def add(self, jti, expires_at):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def is_revoked(self, jti):
+        expires_at = self._revoked.get(jti)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            with self._lock:
+                self._revoked.pop(jti, None)
+            return False
+        return True
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [jti for jti, exp in self._revoked.items() if exp <= now]
+            for jti in expired:
+                del self._revoked[jti]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._revoked.clear()
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+revocation_cache = RevocationCache()
+
+
+def local_verification_enabled():
+    return bool(JWT_SECRET_KEY)
+
+
+def verify_token_locally(token):
+    """Verify the JWT signature, expiry and revocation without calling auth-service."""
+    if token.startswith("Bearer "):
+        token = token.split(" ", 1)[1]
+
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        return None, ("Token expired", 401)
+    except jwt.InvalidTokenError:
+        return None, ("Token verification failed", 401)
+
+    if claims.get("type", "access") != "access":
+        return None, ("Token verification failed", 401)
+
+    jti = claims.get("jti")
+    if not jti or revocation_cache.is_revoked(jti):
+        return None, ("Token invalid or revoked", 401)
+
+    # Same shape as auth-service /verify, which returns the JWT identity
+    return claims.get("sub"), None
+
+
+def _parse_revocation(message):
+    """Revocation messages look like '<jti>:<expires_at>'."""
+    if isinstance(message, bytes):
+        message = message.decode()
+    jti, _, expires_at = message.rpartition(":")
+    return jti, float(expires_at)
+
+
+class RevocationListener(threading.Thread):
+    """
+    Keeps the local revocation cache in sync with the shared Redis set.
+
+    On (re)connect the existing revocations are loaded with SCAN, after which
+    new ones arrive over pub/sub, so a lookup never has to leave the process.
+    """
+
+    def __init__(self, cache=revocation_cache, retry_interval=5):
+        super().__init__(daemon=True, name="revocation-listener")
+        self.cache = cache
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+
+    def _connect(self):
+        return redis.StrictRedis(
+            host=REDIS_URL,
+            port=REDIS_PORT,
+            password=REDIS_PASSWORD,
+            decode_responses=True
+        )
+
+    def _bootstrap(self, client):
+        now = time.time()
+        for key in client.scan_iter(match=f"{REVOKED_KEY_PREFIX}*", count=500):
+            ttl = client.ttl(key)
+            if ttl and ttl > 0:
+                self.cache.add(key[len(REVOKED_KEY_PREFIX):], now + ttl)
+        self.cache.purge_expired()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                client = self._connect()
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                # Subscribe before the bootstrap so nothing slips in between
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                self._bootstrap(client)
+                print(f"Revocation cache loaded with {len(self.cache)} entries.")
+
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        self.cache.add(*_parse_revocation(message["data"]))
+                pubsub.close()
+            except Exception as e:
+                print(f"Revocation listener error, retrying: {e}")
+                self._stop_event.wait(self.retry_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_listener = None
+
+
+def start_revocation_listener():
+    global _listener
+    if not local_verification_enabled():
+        print("JWT_SECRET_KEY not set, verifying tokens through auth-service.")
+        return None
+    if not REDIS_URL:
+        print("REDIS_URL not set, revocations will not reach this gateway!")
+        return None
+    if _listener is None:
+        _listener = RevocationListener()
+        _listener.start()
+    return _listener
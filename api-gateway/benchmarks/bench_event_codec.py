@@ -0,0 +1,72 @@
+"""
+Compare the NATS event encodings: the old str(dict) + quote replacement
+round trip against the JSON and msgpack encodings of event_codec.
+
+    python benchmarks/bench_event_codec.py [iterations]
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_codec import event_codec
+
+EVENT = {
+    "event_id": "123e4567-e89b-12d3-a456-426614174000",
+    "timestamp": "2024-11-13T12:34:56Z",
+    "platform": "Matrix",
+    "service": "matrix-message",
+    "event_type": "post",
+    "actor": "Chat Assistance",
+    "payload": {
+        "username": "dverse-chat-assistant",
+        "room_id": "!abcdefghijklmnop:matrix.org",
+        "message": "Hello, the product you asked about is back in stock.",
+    },
+}
+
+
+def legacy_round_trip(event):
+    data = str(event).encode()
+    return json.loads(data.decode().replace("'", '"'))
+
+
+def codec_round_trip(event, encoding):
+    data = event_codec.encode("send.matrix.message", event, encoding=encoding)
+    return event_codec.decode("send.matrix.message", data)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    runs = {
+        "str(dict) + replace": lambda: legacy_round_trip(EVENT),
+        "codec json": lambda: codec_round_trip(EVENT, "json"),
+        "codec msgpack": lambda: codec_round_trip(EVENT, "msgpack"),
+    }
+    for name, run in runs.items():
+        seconds = min(timeit.repeat(run, number=iterations, repeat=3))
+        print(f"{name:<22} {seconds / iterations * 1e6:8.2f} us/event  {iterations / seconds:10.0f} events/s")
+
+    sizes = {
+        "str(dict)": len(str(EVENT).encode()),
+        "json": len(event_codec.encode("send.matrix.message", EVENT, encoding="json")),
+        "msgpack": len(event_codec.encode("send.matrix.message", EVENT, encoding="msgpack")),
+    }
+    print("bytes per event:", ", ".join(f"{name}={size}" for name, size in sizes.items()))
+
+    # The old format breaks as soon as a value contains a quote
+    apostrophe = dict(EVENT, payload=dict(EVENT["payload"], message="It's back in stock"))
+    try:
+        legacy_round_trip(apostrophe)
+        print("str(dict) + replace: message with an apostrophe decoded")
+    except json.JSONDecodeError:
+        print("str(dict) + replace: message with an apostrophe FAILED to decode")
+    assert codec_round_trip(apostrophe, "json") == apostrophe
+    assert codec_round_trip(apostrophe, "msgpack") == apostrophe
+
+
+if __name__ == "__main__":
+    main()
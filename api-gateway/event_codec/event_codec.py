@@ -0,0 +1,162 @@
+"""
+Encoding of the events published on NATS, see docs/event_schema.md.
+
+The same file is shipped in every service that talks to NATS
+(api-gateway/event_codec/event_codec.py, chat-assistant/event_codec.py,
+matrix-gateway/app/utils/event_codec.py), keep the copies identical.
+api-gateway/intergration_test/test_event_codec.py fails when they differ.
+"""
+import ast
+import json
+import os
+import msgpack
+
+# "json" or "msgpack", decoding always accepts both
+NATS_EVENT_ENCODING = os.getenv("NATS_EVENT_ENCODING", "json")
+
+
+# Built once, json.dumps() with non-default arguments creates an encoder per call
+_json_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+class EventValidationError(ValueError):
+    pass
+
+
+_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+}
+
+
+def compile_schema(schema, path="event"):
+    """
+    Turn a JSON schema into a single validation function.
+
+    Only the parts our schemas use are supported: type, required and
+    properties. Compiling happens once at import, error paths included, so
+    validating an event is a few isinstance checks and set operations.
+    """
+    type_names = schema.get("type")
+    if isinstance(type_names, str):
+        type_names = [type_names]
+    expected = tuple(python_type for name in (type_names or []) for python_type in _TYPES[name])
+    required = frozenset(schema.get("required", ()))
+    properties = tuple(
+        (name, compile_schema(sub_schema, f"{path}.{name}"))
+        for name, sub_schema in schema.get("properties", {}).items()
+    )
+
+    def validate(value):
+        if expected and not isinstance(value, expected):
+            raise EventValidationError(f"{path} must be of type {'/'.join(type_names)}")
+        if required and not required <= value.keys():
+            missing = sorted(required - value.keys())
+            raise EventValidationError(f"{path} is missing {', '.join(missing)}")
+        for name, check in properties:
+            if name in value:
+                check(value[name])
+
+    return validate
+
+
+# Envelope of the events on bots.connection and send.matrix.message. Unlike
+# the generic schema, the actor may be a plain name and the data is carried
+# in "payload" instead of "object".
+EVENT_SCHEMA = {
+    "type": "object",
+    "required": ["event_id", "timestamp", "platform", "service", "event_type", "actor"],
+    "properties": {
+        "event_id": {"type": "string"},
+        "timestamp": {"type": "string"},
+        "platform": {"type": "string"},
+        "service": {"type": "string"},
+        "event_type": {"type": "string"},
+        "actor": {"type": ["string", "object"]},
+        "object": {"type": "object"},
+        "payload": {"type": ["string", "object", "array"]},
+    },
+}
+
+# Messages received by the Matrix bots, published on chat.messages
+CHAT_MESSAGE_SCHEMA = {
+    "type": "object",
+    "required": ["room_id", "room_name", "sender", "receiver", "message", "timestamp"],
+    "properties": {
+        "room_id": {"type": "string"},
+        "sender": {"type": "string"},
+        "receiver": {"type": "string"},
+        "message": {"type": "string"},
+        "timestamp": {"type": ["string", "integer"]},
+        "event_id": {"type": "string"},
+    },
+}
+
+validate_event = compile_schema(EVENT_SCHEMA)
+validate_chat_message = compile_schema(CHAT_MESSAGE_SCHEMA)
+
+SUBJECT_VALIDATORS = {
+    "chat.messages": validate_chat_message,
+}
+
+
+def validator_for(subject):
+    return SUBJECT_VALIDATORS.get(subject, validate_event)
+
+
+def encode(subject, event, encoding=None):
+    """Validate an event and encode it once, ready to publish on NATS."""
+    validator_for(subject)(event)
+    if (encoding or NATS_EVENT_ENCODING) == "msgpack":
+        return msgpack.packb(event, use_bin_type=True)
+    return _json_encoder.encode(event).encode()
+
+
+def _is_msgpack_map(first_byte):
+    # fixmap, map16 and map32
+    return 0x80 <= first_byte <= 0x8f or first_byte in (0xde, 0xdf)
+
+
+def decode(subject, data, validate=True):
+    """Decode an event received from NATS, whichever encoding it was sent with."""
+    if isinstance(data, str):
+        data = data.encode()
+    if not data:
+        raise EventValidationError("empty message")
+
+    if _is_msgpack_map(data[0]):
+        event = msgpack.unpackb(data, raw=False)
+    else:
+        try:
+            event = json.loads(data)
+        except ValueError:
+            # Publishers that still send str(dict), only during rolling upgrades
+            try:
+                event = ast.literal_eval(data.decode())
+            except (ValueError, SyntaxError, UnicodeDecodeError):
+                raise EventValidationError("message is neither JSON nor msgpack")
+
+    if not isinstance(event, dict):
+        raise EventValidationError("event must be an object")
+    if validate:
+        validator_for(subject)(event)
+    return event
+
+
+def parse_payload(payload):
+    """Return the payload of an event as a dict, also when it was sent as a string."""
+    if not isinstance(payload, str):
+        return payload
+    try:
+        return json.loads(payload)
+    except ValueError:
+        pass
+    try:
+        parsed = ast.literal_eval(payload)
+    except (ValueError, SyntaxError):
+        return payload
+    return parsed if isinstance(parsed, dict) else payload
@@ -0,0 +1,56 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    failures_left = 0
+    hits = []
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        FakeServiceHandler.hits.append(("GET", self.path))
+        if self.path == "/flaky" and FakeServiceHandler.failures_left > 0:
+            FakeServiceHandler.failures_left -= 1
+            return self._reply(503, {"error": "unavailable"})
+        if self.path == "/large":
+            # Too big to be buffered whole by the client
+            return self._reply(200, {"path": self.path, "data": "x" * 2 ** 22})
+        self._reply(200, {"path": self.path})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        FakeServiceHandler.hits.append(("POST", self.path))
+        self._reply(503, {"error": "unavailable"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_service():
+    FakeServiceHandler.hits = []
+    FakeServiceHandler.failures_left = 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeServiceHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def fake_handler():
+    """The handler class of fake_service, for its hits and to change its answers."""
+    return FakeServiceHandler
+
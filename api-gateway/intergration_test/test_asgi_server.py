@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import pytest
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asgi_server
+from auth_svc import access, async_access, token_verifier
+from marketplace_svc.response_cache import response_cache
+from matrix_com.async_matrix_com import init_router
+from upstream import async_upstream
+from upstream.async_upstream import UpstreamResponse
+
+
+class FakeUpstream:
+    """Replaces AsyncUpstreamClient.request and records the calls."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.calls = []
+
+    async def request(self, method, path, **kwargs):
+        self.calls.append((method, path, kwargs))
+        status, body = self.routes[(method, path)]
+        content = b"" if body is None else json.dumps(body).encode()
+        return UpstreamResponse(status, content, {})
+
+
+class MockNATSClient:
+    def __init__(self):
+        self.connected = True
+        self.published_messages = []
+
+    async def publish_async(self, subject, message):
+        self.published_messages.append({
+            'subject': subject,
+            'message': message
+        })
+
+    async def publish_many_async(self, messages):
+        for subject, message in messages:
+            await self.publish_async(subject, message)
+
+
+@pytest.fixture
+def marketplace(monkeypatch):
+    response_cache.clear()
+    fake = FakeUpstream({
+        ("GET", "/products/"): (200, {"products": [{"id": 1, "name": "Lamp"}]}),
+        ("GET", "/products/1"): (200, {"product": {"id": 1, "name": "Lamp"}}),
+        ("GET", "/products/2"): (404, {"detail": "Not found"}),
+        ("POST", "/products/"): (201, {"product": {"id": 2, "name": "Desk"}}),
+        ("DELETE", "/products/1"): (204, None),
+    })
+    monkeypatch.setattr(async_upstream.marketplace, "request", fake.request)
+    return fake
+
+
+@pytest.fixture
+def client():
+    # No lifespan, so nothing connects to NATS or the upstreams
+    return TestClient(asgi_server.app)
+
+
+def test_get_products(client, marketplace):
+    response = client.get("/api/v1/products/")
+
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "name": "Lamp"}]
+
+
+class FakeStreamedResponse:
+    """aiohttp response of an upstream list, read in chunks."""
+
+    def __init__(self, status, body):
+        self.status = status
+        self.headers = {"Content-Type": "application/json"}
+        self.content = self
+        self.body = body
+        self.released = False
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.body), 5):
+            yield self.body[i:i + 5]
+
+    def release(self):
+        self.released = True
+
+
+def test_streamed_products_have_the_shape_of_the_list(client, monkeypatch):
+    upstream_response = FakeStreamedResponse(200, json.dumps({"products": [{"id": 1, "name": "Lamp"}]}).encode())
+
+    async def stream_collection(path):
+        return upstream_response
+
+    monkeypatch.setattr(asgi_server.marketplace, "stream_collection", stream_collection)
+
+    response = client.get("/api/v1/products/?stream=1")
+
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "name": "Lamp"}]
+    assert upstream_response.released
+
+
+def test_streamed_errors_are_passed_through(client, monkeypatch):
+    async def stream_collection(path):
+        return FakeStreamedResponse(502, b'{"detail": "Bad gateway"}')
+
+    monkeypatch.setattr(asgi_server.marketplace, "stream_collection", stream_collection)
+
+    response = client.get("/api/v1/products/?stream=1")
+
+    assert response.status_code == 502
+    assert response.json() == {"detail": "Bad gateway"}
+
+
+def test_get_products_page_with_projection(client, marketplace):
+    response = client.get("/api/v1/products/?limit=1&fields=name")
+
+    assert response.status_code == 200
+    assert response.json() == [{"name": "Lamp"}]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_product_by_id_not_found(client, marketplace):
+    response = client.get("/api/v1/products/2")
+
+    assert response.status_code == 404
+    assert "error" in response.json()
+
+
+def test_non_integer_product_id_is_not_routed(client, marketplace):
+    response = client.get("/api/v1/products/abc")
+
+    assert response.status_code == 404
+    assert marketplace.calls == []
+
+
+def test_add_product_forwards_body(client, marketplace):
+    response = client.post("/api/v1/products/", json={"name": "Desk"})
+
+    assert response.status_code == 201
+    assert response.json() == {"id": 2, "name": "Desk"}
+    assert marketplace.calls[0][2]["json"] == {"name": "Desk"}
+
+
+def test_delete_product_returns_no_content(client, marketplace):
+    response = client.delete("/api/v1/products/1")
+
+    assert response.status_code == 204
+    assert response.content == b""
+
+
+def test_login_without_credentials(client):
+    response = client.post("/api/v1/login")
+
+    assert response.status_code == 401
+    assert response.json() == {"error": "missing credentials, 401"}
+
+
+def test_protected_route_with_local_verification(client, monkeypatch):
+    from intergration_test.test_token_verifier import SECRET, make_token
+
+    monkeypatch.setattr(token_verifier, "JWT_SECRET_KEY", SECRET)
+    token, payload = make_token()
+
+    response = client.get("/api/v1/protected", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Access granted", "user": payload["sub"]}
+
+
+def test_protected_route_with_batched_verification(client, monkeypatch):
+    monkeypatch.setattr(token_verifier, "JWT_SECRET_KEY", None)
+    monkeypatch.setattr(access, "VERIFY_BATCHING", True)
+    monkeypatch.setattr(async_access, "batch_verifier", async_access.AsyncBatchVerifier(workers=1, timeout=5))
+    fake = FakeUpstream({
+        ("POST", "/verify/batch"): (200, {"results": [{"identity": {"username": "alice"}}]}),
+    })
+    monkeypatch.setattr(async_upstream.auth, "request", fake.request)
+
+    response = client.get("/api/v1/protected", headers={"Authorization": "Bearer token"})
+
+    assert response.status_code == 200
+    assert response.json()["user"] == {"username": "alice"}
+    assert fake.calls[0][2]["json"] == {"tokens": ["Bearer token"]}
+    stats = client.get("/metrics/verify").json()
+    assert (stats["enabled"], stats["batches"], stats["verified"]) == (True, 1, 1)
+
+
+def test_nats_metrics(client):
+    response = client.get("/metrics/nats")
+
+    assert response.status_code == 200
+    assert set(response.json()) >= {"pending", "batches_published", "messages_published"}
+
+
+def test_protected_route_without_header(client):
+    response = client.get("/api/v1/protected")
+
+    assert response.status_code == 401
+    assert response.json() == {"error": "Missing Authorization Header"}
+
+
+def test_chat_message_is_published_on_the_loop(client):
+    mock_nats = MockNATSClient()
+    init_router(mock_nats)
+    payload = {
+        "room_id": "test_room",
+        "room_name": "Test Room",
+        "sender": "test_sender",
+        "receiver": "test_receiver",
+        "message": "Hello, world!",
+        "timestamp": "2024-01-08T12:00:00Z"
+    }
+
+    response = client.post("/bots/chat_message", json=payload)
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Chat message sent successfully"}
+    assert mock_nats.published_messages[0]["subject"] == "chat.messages"
+    init_router(asgi_server.nats_client)
+
+
+def test_chat_message_batch_is_published_on_the_loop(client):
+    mock_nats = MockNATSClient()
+    init_router(mock_nats)
+    payload = {
+        "room_id": "test_room",
+        "room_name": "Test Room",
+        "sender": "test_sender",
+        "receiver": "test_receiver",
+        "message": "Hello, world!",
+        "timestamp": "2024-01-08T12:00:00Z"
+    }
+
+    response = client.post("/bots/chat_message/batch", json={"messages": [payload, {"sender": "x"}]})
+
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 1, "rejected": [{"index": 1, "error": "Missing required fields"}]}
+    assert len(mock_nats.published_messages) == 1
+    init_router(asgi_server.nats_client)
+
+
+def test_ask_connection_without_nats(client):
+    init_router(None)
+
+    response = client.post("/bots/ask_connection")
+
+    assert response.status_code == 500
+    assert "NATS client is not connected" in response.json()["error"]
+    init_router(asgi_server.nats_client)
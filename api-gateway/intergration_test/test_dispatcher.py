@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import asyncio
+import aiohttp
+from types import SimpleNamespace
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_codec import event_codec
+from nats_client import nats_client
+from nats_client.dispatcher import MessageDispatcher, PermanentError
+
+
+def make_msg(service, payload=None, subject="send.matrix.message"):
+    event = {
+        "event_id": "1",
+        "timestamp": "2024-11-13T12:34:56Z",
+        "platform": "Matrix",
+        "service": service,
+        "event_type": "post",
+        "actor": "Chat Assistance",
+        "payload": payload or {},
+    }
+    return SimpleNamespace(subject=subject, data=event_codec.encode(subject, event))
+
+
+def test_handlers_are_bounded_by_the_workers():
+    running = 0
+    max_running = 0
+
+    async def slow_handler(data):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    dispatcher = MessageDispatcher({"slow": slow_handler}, workers=3, queue_size=100)
+
+    async def run():
+        for _ in range(20):
+            await dispatcher.submit(make_msg("slow"))
+        await dispatcher.join()
+        await dispatcher.close()
+
+    asyncio.run(run())
+
+    assert max_running == 3
+    stats = dispatcher.get_stats()
+    assert stats["received"] == 20
+    assert stats["handlers"]["slow"]["handled"] == 20
+    assert stats["handlers"]["slow"]["avg_ms"] >= 10
+
+
+def test_full_queue_holds_back_the_subscription():
+    release = None
+
+    async def blocked_handler(data):
+        await release.wait()
+
+    dispatcher = MessageDispatcher({"blocked": blocked_handler}, workers=1, queue_size=2)
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        # One message in the worker and two queued, the fourth has to wait
+        for _ in range(3):
+            await dispatcher.submit(make_msg("blocked"))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(dispatcher.submit(make_msg("blocked")), timeout=0.05)
+        release.set()
+        await dispatcher.join()
+        await dispatcher.close()
+
+    asyncio.run(run())
+
+    assert dispatcher.get_stats()["max_queue_depth"] == 2
+
+
+def test_unknown_invalid_and_failing_messages_are_counted():
+    async def failing_handler(data):
+        raise RuntimeError("boom")
+
+    dispatcher = MessageDispatcher({"failing": failing_handler}, workers=2)
+
+    async def run():
+        await dispatcher.submit(make_msg("failing"))
+        await dispatcher.submit(make_msg("unknown"))
+        await dispatcher.submit(SimpleNamespace(subject="send.matrix.message", data=b"not an event"))
+        await dispatcher.join()
+        await dispatcher.close()
+
+    asyncio.run(run())
+
+    stats = dispatcher.get_stats()
+    assert stats["handlers"]["failing"]["handled"] == 1
+    assert stats["handlers"]["failing"]["failed"] == 1
+    assert stats["unhandled"] == 1
+    assert stats["invalid"] == 1
+
+
+def fake_ok_post(self):
+    length = int(self.headers.get("Content-Length", 0))
+    json.loads(self.rfile.read(length))
+    type(self).hits.append(("POST", self.path))
+    self._reply(200, {"message": "ok"})
+
+
+def test_messages_are_forwarded_over_one_session(fake_service, fake_handler, monkeypatch):
+    monkeypatch.setattr(nats_client, "matrix_gateway_url", fake_service)
+    monkeypatch.setattr(nats_client, "dispatcher", MessageDispatcher(nats_client.HANDLERS, workers=1))
+    # Answer the POSTs with 200 instead of 503
+    monkeypatch.setattr(fake_handler, "do_POST", fake_ok_post)
+    sessions = []
+    posts = []
+    create_session = aiohttp.ClientSession
+
+    def recording_session(*args, **kwargs):
+        session = create_session(*args, **kwargs)
+        sessions.append(session)
+        post = session.post
+
+        def recording_post(url, **kwargs):
+            posts.append((session, url))
+            return post(url, **kwargs)
+
+        session.post = recording_post
+        return session
+
+    monkeypatch.setattr(aiohttp, "ClientSession", recording_session)
+    message = {"username": "bot", "room_id": "!room:matrix.org", "message": "It's here"}
+
+    async def run():
+        await nats_client.message_handler(make_msg("matrix-message", message))
+        await nats_client.message_handler(make_msg("matrix-login", {"username": "bot", "password": "secret"}))
+        await nats_client.dispatcher.join()
+        await nats_client.dispatcher.close()
+
+    asyncio.run(run())
+
+    assert ("POST", "/messages/send") in fake_handler.hits
+    assert ("POST", "/bots/add") in fake_handler.hits
+    # Both handlers post through the one session of the dispatcher
+    assert len(sessions) == 1
+    assert [session for session, _ in posts] == [sessions[0], sessions[0]]
+    assert nats_client.dispatcher.get_stats()["handlers"]["matrix-message"]["failed"] == 0
+
+
+def make_jetstream_msg(service):
+    msg = make_msg(service)
+    msg.settled = []
+
+    async def settle(outcome):
+        msg.settled.append(outcome)
+
+    for outcome in ("ack", "nak", "term", "in_progress"):
+        setattr(msg, outcome, lambda outcome=outcome: settle(outcome))
+    return msg
+
+
+def test_rejected_messages_are_terminated_instead_of_redelivered():
+    async def rejecting_handler(data):
+        raise PermanentError("400 - unknown room")
+
+    async def failing_handler(data):
+        raise RuntimeError("503 - unavailable")
+
+    async def ok_handler(data):
+        pass
+
+    dispatcher = MessageDispatcher(
+        {"rejecting": rejecting_handler, "failing": failing_handler, "ok": ok_handler},
+        workers=1, manual_ack=True,
+    )
+    messages = [make_jetstream_msg(service) for service in ("rejecting", "failing", "ok")]
+
+    async def run():
+        for msg in messages:
+            await dispatcher.submit(msg)
+        await dispatcher.join()
+        await dispatcher.close()
+
+    asyncio.run(run())
+
+    assert [msg.settled for msg in messages] == [["term"], ["nak"], ["ack"]]
+    stats = dispatcher.get_stats()["handlers"]
+    assert (stats["rejecting"]["failed"], stats["rejecting"]["rejected"]) == (1, 1)
+    assert (stats["failing"]["failed"], stats["failing"]["rejected"]) == (1, 0)
+
+
+def reply_with(status):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        type(self).hits.append(("POST", self.path))
+        self._reply(status, {"error": "no"})
+    return do_POST
+
+
+@pytest.mark.parametrize("status, error", [
+    (400, PermanentError),
+    (404, PermanentError),
+    (429, RuntimeError),
+    (503, RuntimeError),
+])
+def test_only_client_errors_are_permanent(fake_service, fake_handler, monkeypatch, status, error):
+    monkeypatch.setattr(nats_client, "dispatcher", MessageDispatcher(nats_client.HANDLERS, workers=1))
+    monkeypatch.setattr(fake_handler, "do_POST", reply_with(status))
+
+    async def run():
+        await nats_client.dispatcher.start()
+        try:
+            with pytest.raises(error):
+                await nats_client.send_api_request(f"{fake_service}/messages/send", {})
+        finally:
+            await nats_client.dispatcher.close()
+
+    asyncio.run(run())
+    assert fake_handler.hits == [("POST", "/messages/send")]
+
+
+def test_connection_errors_are_redelivered(monkeypatch):
+    monkeypatch.setattr(nats_client, "dispatcher", MessageDispatcher(nats_client.HANDLERS, workers=1))
+
+    async def run():
+        await nats_client.dispatcher.start()
+        try:
+            with pytest.raises(aiohttp.ClientError):
+                # Nothing listens on port 1
+                await nats_client.send_api_request("http://127.0.0.1:1/messages/send", {})
+        finally:
+            await nats_client.dispatcher.close()
+
+    asyncio.run(run())
+
+
+def test_waiting_messages_are_reported_in_progress():
+    release = None
+
+    async def blocked_handler(data):
+        await release.wait()
+
+    dispatcher = MessageDispatcher(
+        {"blocked": blocked_handler}, workers=1, manual_ack=True, progress_interval=0.02,
+    )
+    messages = [make_jetstream_msg("blocked") for _ in range(3)]
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        for msg in messages:
+            await dispatcher.submit(msg)
+        await asyncio.sleep(0.1)
+        release.set()
+        await dispatcher.join()
+        settled = [list(msg.settled) for msg in messages]
+        # Acked messages are no longer reported
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+        return settled
+
+    settled = asyncio.run(run())
+
+    # One handled and two queued, all kept in progress until acked
+    assert [outcome.count("in_progress") >= 2 for outcome in settled] == [True, True, True]
+    assert [msg.settled[-1] for msg in messages] == ["ack", "ack", "ack"]
+    assert settled == [msg.settled for msg in messages]
+    assert dispatcher.get_stats()["unsettled"] == 0
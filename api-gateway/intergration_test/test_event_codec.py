@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_codec import event_codec
+from event_codec.event_codec import EventValidationError
+
+EVENT = {
+    "event_id": "123e4567-e89b-12d3-a456-426614174000",
+    "timestamp": "2024-11-13T12:34:56Z",
+    "platform": "Matrix",
+    "service": "matrix-message",
+    "event_type": "post",
+    "actor": "Chat Assistance",
+    "payload": {"username": "bot", "room_id": "!room:matrix.org", "message": "It's \"quoted\""},
+}
+
+CHAT_MESSAGE = {
+    "room_id": "!room:matrix.org",
+    "room_name": "Test Room",
+    "sender": "@user1:matrix.org",
+    "receiver": "@bot:matrix.org",
+    "message": "Don't break",
+    "timestamp": 1736683200000,
+}
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+def test_round_trip(encoding):
+    data = event_codec.encode("send.matrix.message", EVENT, encoding=encoding)
+
+    assert isinstance(data, bytes)
+    assert event_codec.decode("send.matrix.message", data) == EVENT
+
+
+def test_json_is_the_default():
+    data = event_codec.encode("chat.messages", CHAT_MESSAGE)
+
+    assert json.loads(data) == CHAT_MESSAGE
+
+
+def test_legacy_str_dict_is_still_decoded():
+    assert event_codec.decode("chat.messages", str(CHAT_MESSAGE).encode()) == CHAT_MESSAGE
+
+
+def test_missing_fields_are_rejected():
+    event = dict(EVENT)
+    del event["actor"]
+
+    with pytest.raises(EventValidationError, match="actor"):
+        event_codec.encode("bots.connection", event)
+
+
+def test_wrong_types_are_rejected():
+    with pytest.raises(EventValidationError, match="event.message"):
+        event_codec.decode("chat.messages", json.dumps(dict(CHAT_MESSAGE, message=42)))
+
+
+def test_garbage_is_rejected():
+    with pytest.raises(EventValidationError):
+        event_codec.decode("chat.messages", b"not an event")
+    with pytest.raises(EventValidationError):
+        event_codec.decode("chat.messages", b"[1, 2]")
+
+
+def test_parse_payload():
+    payload = {"username": "bot", "password": "secret"}
+
+    assert event_codec.parse_payload(payload) == payload
+    assert event_codec.parse_payload(json.dumps(payload)) == payload
+    assert event_codec.parse_payload(str(payload)) == payload
+    assert event_codec.parse_payload("A new Matrix-Gateway service is running") == "A new Matrix-Gateway service is running"
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Each service ships its own copy of these modules, they have to stay the same
+SHARED_COPIES = [
+    ("api-gateway/event_codec/event_codec.py", "chat-assistant/event_codec.py"),
+    ("api-gateway/event_codec/event_codec.py", "matrix-gateway/app/utils/event_codec.py"),
+    ("api-gateway/nats_client/jetstream.py", "chat-assistant/jetstream.py"),
+]
+
+
+@pytest.mark.parametrize("ours, copy", SHARED_COPIES)
+def test_shared_modules_are_identical(ours, copy):
+    path = os.path.join(REPO_ROOT, copy)
+    if not os.path.exists(path):
+        pytest.skip(f"{copy} is not checked out")
+    with open(os.path.join(REPO_ROOT, ours), "rb") as original, open(path, "rb") as theirs:
+        assert original.read() == theirs.read(), f"{copy} differs from {ours}"
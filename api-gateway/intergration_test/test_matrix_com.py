@@ -1,13 +1,14 @@
 import os
 import sys
-import ast
 import pytest
 from flask import Flask
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from matrix_com import matrix_com
 from matrix_com.matrix_com import init_blueprint, bots_blueprint
+from event_codec import event_codec
 
 class MockNATSClient:
     def __init__(self):
@@ -20,6 +21,10 @@ class MockNATSClient:
             'message': message
         })
 
+    def publish_many(self, messages):
+        for subject, message in messages:
+            self.publish(subject, message)
+
 @pytest.fixture
 def mock_nats():
     return MockNATSClient()
@@ -50,8 +55,8 @@ def test_ask_connection_endpoint(client, app):
     published = mock_nats.published_messages[0]
     assert published['subject'] == 'bots.connection'
     
-    # Parse the message string back to dict for verification
-    message = ast.literal_eval(published['message'])  # Using eval since the message is stringified dict
+    # Decode the published event for verification
+    message = event_codec.decode('bots.connection', published['message'])
     assert isinstance(message['event_id'], str)
     assert isinstance(message['timestamp'], str)
     assert message['platform'] == 'Matrix'
@@ -84,6 +89,7 @@ def test_chat_message_endpoint_success(client, app):
     assert len(mock_nats.published_messages) == 1
     published = mock_nats.published_messages[0]
     assert published['subject'] == 'chat.messages'
+    assert event_codec.decode('chat.messages', published['message']) == test_payload
 
 def test_chat_message_endpoint_missing_fields(client, app):
     incomplete_payload = {
@@ -136,4 +142,40 @@ def test_nats_connection_failure(app):
                               content_type='application/json')
     assert response.status_code == 500
     assert 'error' in response.json
-    assert "NATS client is not connected" in response.json['error']
\ No newline at end of file
+    assert "NATS client is not connected" in response.json['error']
+
+def chat_payload(message):
+    return {
+        "room_id": "test_room",
+        "room_name": "Test Room",
+        "sender": "test_sender",
+        "receiver": "test_receiver",
+        "message": message,
+        "timestamp": "2024-01-08T12:00:00Z"
+    }
+
+def test_chat_message_batch_publishes_valid_messages(client, app):
+    messages = [chat_payload("first"), {"room_id": "test_room"}, chat_payload("third")]
+
+    response = client.post('/bots/chat_message/batch', json={"messages": messages})
+
+    assert response.status_code == 200
+    assert response.json['accepted'] == 2
+    assert response.json['rejected'] == [{"index": 1, "error": "Missing required fields"}]
+    published = app.mock_nats.published_messages
+    assert [message['subject'] for message in published] == ['chat.messages', 'chat.messages']
+    assert [event_codec.decode('chat.messages', message['message'])['message'] for message in published] == ["first", "third"]
+
+def test_chat_message_batch_rejects_malformed_body(client, app):
+    response = client.post('/bots/chat_message/batch', json={"message": chat_payload("first")})
+
+    assert response.status_code == 400
+    assert app.mock_nats.published_messages == []
+
+def test_chat_message_batch_too_large(client, app, monkeypatch):
+    monkeypatch.setattr(matrix_com, "CHAT_BATCH_MAX", 2)
+
+    response = client.post('/bots/chat_message/batch', json={"messages": [chat_payload(str(i)) for i in range(3)]})
+
+    assert response.status_code == 413
+    assert app.mock_nats.published_messages == []
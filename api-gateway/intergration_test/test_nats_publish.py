@@ -0,0 +1,125 @@
+import os
+import sys
+import asyncio
+import threading
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nats_client.nats_client import NATSClient
+
+
+class FakeNATS:
+    """Stands in for nats.aio.client.Client, records what reaches the server."""
+
+    def __init__(self):
+        self.published = []
+        self.flushes = 0
+        self.fail_subjects = set()
+        self.release = None
+
+    async def publish(self, subject, data):
+        if subject in self.fail_subjects:
+            raise ConnectionError("connection closed")
+        self.published.append((subject, data))
+
+    async def flush(self, timeout=None):
+        if self.release is not None:
+            await self.release.wait()
+        self.flushes += 1
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def make(**kwargs):
+        client = NATSClient(**kwargs)
+        client.nc = FakeNATS()
+        client.connected = True
+        thread = threading.Thread(target=client.start_event_loop, daemon=True)
+        thread.start()
+        clients.append(client)
+        return client
+
+    yield make
+
+    for client in clients:
+        client.loop.call_soon_threadsafe(client.loop.stop)
+
+
+def test_publish_many_is_one_batch(make_client):
+    client = make_client(batch_size=100, flush_interval=0.01)
+
+    futures = client.publish_many([("chat.messages", f"message {i}") for i in range(10)])
+    for future in futures:
+        assert future.result(timeout=2) is None
+
+    assert client.nc.published == [("chat.messages", f"message {i}".encode()) for i in range(10)]
+    assert client.nc.flushes == 1
+    assert client.get_publish_stats()["batches_published"] == 1
+    assert client.get_publish_stats()["pending"] == 0
+
+
+def test_full_batch_is_flushed_without_waiting(make_client):
+    client = make_client(batch_size=3, flush_interval=60)
+
+    futures = client.publish_many([("chat.messages", b"a"), ("chat.messages", b"b"), ("chat.messages", b"c")])
+
+    futures[-1].result(timeout=2)
+    assert len(client.nc.published) == 3
+
+
+def test_publish_from_many_threads_is_coalesced(make_client):
+    client = make_client(batch_size=1000, flush_interval=0.05)
+    futures = []
+
+    def publish():
+        futures.append(client.publish("chat.messages", b"hello"))
+
+    threads = [threading.Thread(target=publish) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result(timeout=2)
+
+    assert len(client.nc.published) == 20
+    assert client.nc.flushes < 20
+
+
+def test_errors_are_reported_on_the_future(make_client):
+    client = make_client(batch_size=2, flush_interval=0.01)
+    client.nc.fail_subjects.add("broken")
+
+    ok, failed = client.publish_many([("chat.messages", b"a"), ("broken", b"b")])
+
+    assert ok.result(timeout=2) is None
+    with pytest.raises(RuntimeError, match="broken"):
+        failed.result(timeout=2)
+    assert client.get_publish_stats()["messages_published"] == 1
+
+
+def test_back_pressure(make_client):
+    client = make_client(batch_size=1, flush_interval=0.01, max_pending=2)
+    client.nc.release = asyncio.Event()
+
+    client.publish_many([("chat.messages", b"a"), ("chat.messages", b"b")])
+    with pytest.raises(RuntimeError, match="buffer is full"):
+        client.publish("chat.messages", b"c", timeout=0.1)
+
+    client.loop.call_soon_threadsafe(client.nc.release.set)
+    client.publish("chat.messages", b"c", timeout=2).result(timeout=2)
+    assert len(client.nc.published) == 3
+
+
+def test_publish_requires_connection():
+    client = NATSClient()
+
+    with pytest.raises(RuntimeError, match="not connected"):
+        client.publish("chat.messages", b"a")
@@ -0,0 +1,158 @@
+import os
+import sys
+import uuid
+import socket
+import asyncio
+from urllib.parse import urlparse
+import pytest
+from nats.aio.client import Client as NATS
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nats_client import nats_client
+from nats_client.nats_client import NATSClient
+from nats_client.dispatcher import MessageDispatcher
+from intergration_test.test_dispatcher import make_msg
+
+# Needs a local server with JetStream enabled: nats-server -js
+NATS_SERVER_URL = os.getenv("NATS_SERVER_URL", "nats://localhost:4222")
+
+
+def nats_server_running():
+    url = urlparse(NATS_SERVER_URL)
+    try:
+        socket.create_connection((url.hostname, url.port or 4222), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not nats_server_running(), reason=f"No NATS server at {NATS_SERVER_URL}")
+
+
+async def connect(jetstream=False):
+    client = NATSClient(jetstream=jetstream)
+    await client.connect_async(servers=[NATS_SERVER_URL])
+    return client
+
+
+async def publish(subject, count, prefix="message"):
+    nc = NATS()
+    await nc.connect(servers=[NATS_SERVER_URL])
+    for i in range(count):
+        await nc.publish(subject, f"{prefix} {i}".encode())
+    await nc.flush()
+    await nc.close()
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """A stream of its own per test, deleted afterwards."""
+    name = f"TEST_{uuid.uuid4().hex[:8]}"
+    subject = f"test.{name.lower()}"
+    monkeypatch.setattr(nats_client, "STREAM_NAME", name)
+    monkeypatch.setattr(nats_client, "STREAM_SUBJECTS", [subject])
+    yield subject
+
+    async def delete():
+        nc = NATS()
+        await nc.connect(servers=[NATS_SERVER_URL])
+        await nc.jetstream().delete_stream(name)
+        await nc.close()
+
+    asyncio.run(delete())
+
+
+def test_queue_group_shares_the_messages():
+    subject = f"test.queue.{uuid.uuid4().hex[:8]}"
+    received = {"first": [], "second": [], "everything": []}
+
+    def collect(name):
+        async def callback(msg):
+            received[name].append(msg.data)
+        return callback
+
+    async def run():
+        clients = [await connect() for _ in range(3)]
+        await clients[0].subscribe_async(subject, collect("first"), queue="workers")
+        await clients[1].subscribe_async(subject, collect("second"), queue="workers")
+        await clients[2].subscribe_async(subject, collect("everything"), queue="")
+        for client in clients:
+            await client.nc.flush()
+
+        await publish(subject, 20)
+        await wait_for(lambda: len(received["everything"]) == 20
+                       and len(received["first"]) + len(received["second"]) == 20)
+        for client in clients:
+            await client.close_async()
+
+    asyncio.run(run())
+
+    assert len(received["first"]) + len(received["second"]) == 20
+    assert set(received["first"]).isdisjoint(received["second"])
+    assert len(received["everything"]) == 20
+
+
+def test_durable_consumer_resumes_after_restart(stream):
+    received = []
+
+    async def ack(msg):
+        received.append(msg.data)
+        await msg.ack()
+
+    async def consume_until(count):
+        client = await connect(jetstream=True)
+        await client.subscribe_async(stream, ack, queue="workers")
+        await wait_for(lambda: len(received) >= count)
+        await asyncio.sleep(0.1)  # Nothing else should arrive
+        await client.close_async()
+
+    async def run():
+        # Create the stream, then publish while no consumer is running
+        client = await connect(jetstream=True)
+        await nats_client.ensure_stream(client.nc.jetstream())
+        await client.close_async()
+
+        await publish(stream, 3, prefix="before")
+        await consume_until(3)
+        await publish(stream, 2, prefix="while down")
+        await consume_until(5)
+
+    asyncio.run(run())
+
+    assert received == [b"before 0", b"before 1", b"before 2", b"while down 0", b"while down 1"]
+
+
+def test_failed_messages_are_redelivered(stream):
+    attempts = []
+
+    async def flaky_handler(data):
+        attempts.append(data["event_id"])
+        if len(attempts) == 1:
+            raise RuntimeError("matrix-gateway unavailable")
+
+    dispatcher = MessageDispatcher({"flaky": flaky_handler}, workers=1, manual_ack=True)
+
+    async def run():
+        client = await connect(jetstream=True)
+        await client.subscribe_async(stream, dispatcher.submit, queue="workers")
+        await client.publish_async(stream, make_msg("flaky", subject=stream).data)
+        await wait_for(lambda: len(attempts) == 2)
+        await asyncio.sleep(0.1)
+        await dispatcher.close()
+        await client.close_async()
+
+    asyncio.run(run())
+
+    assert len(attempts) == 2
+    stats = dispatcher.get_stats()["handlers"]["flaky"]
+    assert stats["handled"] == 2
+    assert stats["failed"] == 1
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import pytest
+from werkzeug.datastructures import MultiDict
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from marketplace_svc import pagination
+from marketplace_svc.pagination import EnvelopeUnwrapper, ListParams, decode_cursor, encode_cursor
+
+PRODUCTS = [{"id": i, "name": f"product-{i}", "price": i * 10} for i in range(1, 6)]
+
+
+class FakeStreamedResponse:
+    status_code = 200
+    headers = {"Content-Type": "application/json"}
+
+    def __init__(self, body):
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server.marketplace, "get_products", lambda: (PRODUCTS, None))
+    return server.server.test_client()
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(40)) == 40
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_parse_list_params_defaults():
+    params, error = pagination.parse_list_params(MultiDict())
+
+    assert error is None
+    assert params == ListParams(None, 0, None, False)
+
+
+@pytest.mark.parametrize("query", [
+    {"limit": "0"},
+    {"limit": "abc"},
+    {"limit": str(pagination.MAX_PAGE_SIZE + 1)},
+    {"cursor": "%%%"},
+    {"stream": "1", "limit": "5"},
+])
+def test_parse_list_params_rejects_bad_input(query):
+    params, error = pagination.parse_list_params(MultiDict(query))
+
+    assert params is None
+    assert error[1] == 400
+
+
+def test_without_params_the_whole_collection_is_returned(client):
+    response = client.get("/api/v1/products/")
+
+    assert response.status_code == 200
+    assert response.json == PRODUCTS
+    assert pagination.NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_pages_are_walked_with_the_next_cursor(client):
+    first = client.get("/api/v1/products/?limit=2")
+    cursor = first.headers[pagination.NEXT_CURSOR_HEADER]
+    second = client.get(f"/api/v1/products/?limit=2&cursor={cursor}")
+    cursor = second.headers[pagination.NEXT_CURSOR_HEADER]
+    last = client.get(f"/api/v1/products/?limit=2&cursor={cursor}")
+
+    assert [p["id"] for p in first.json] == [1, 2]
+    assert [p["id"] for p in second.json] == [3, 4]
+    assert [p["id"] for p in last.json] == [5]
+    assert pagination.NEXT_CURSOR_HEADER not in last.headers
+
+
+def test_fields_projection(client):
+    response = client.get("/api/v1/products/?limit=2&fields=id,price")
+
+    assert response.json == [{"id": 1, "price": 10}, {"id": 2, "price": 20}]
+
+
+def test_invalid_limit_returns_400(client):
+    response = client.get("/api/v1/products/?limit=-1")
+
+    assert response.status_code == 400
+    assert "error" in response.json
+
+
+def unwrap(body, key, chunk_size):
+    unwrapper = EnvelopeUnwrapper(key)
+    out = b"".join(unwrapper.feed(body[i:i + chunk_size]) for i in range(0, len(body), chunk_size))
+    return out + unwrapper.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64])
+def test_unwrapper_cuts_the_list_out_of_the_envelope(chunk_size):
+    items = [{"id": 1, "name": 'a "quoted" [name] {with}: , \\ in it', "tags": [1, [2]]}, {"id": 2}]
+    body = json.dumps({"count": 2, "other": {"products": [9]}, "note": "products", "products": items, "tail": [1]})
+
+    assert unwrap(body.encode(), "products", chunk_size) == json.dumps(items).encode()
+
+
+@pytest.mark.parametrize("body", [
+    json.dumps(PRODUCTS).encode(),
+    b'{"detail": "Not found"}',
+    b'{"products": null}',
+])
+def test_unwrapper_passes_other_bodies_through(body):
+    assert unwrap(body, "products", 3) == body
+
+
+def test_stream_has_the_shape_of_the_list(monkeypatch, client):
+    body = json.dumps({"products": PRODUCTS}).encode()
+    upstream_response = FakeStreamedResponse(body)
+    monkeypatch.setattr(server.marketplace, "stream_collection", lambda path: upstream_response)
+    monkeypatch.setattr(pagination, "STREAM_CHUNK_SIZE", 16)
+
+    response = client.get("/api/v1/products/?stream=1")
+
+    assert response.status_code == 200
+    assert response.data == json.dumps(PRODUCTS).encode()
+    assert response.json == client.get("/api/v1/products/").json
+    assert upstream_response.closed
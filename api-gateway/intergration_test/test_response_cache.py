@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marketplace_svc import async_marketplace, marketplace
+from marketplace_svc.response_cache import ResponseCache, response_cache
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class FakeRequest:
+    def __init__(self, body):
+        self.body = body
+
+    def get_json(self):
+        return self.body
+
+
+@pytest.fixture
+def upstream_calls(monkeypatch):
+    calls = []
+    products = [{"id": 1, "name": "Lamp"}]
+
+    def fake_get(path, **kwargs):
+        calls.append(("GET", path))
+        if path == "/products/":
+            return FakeResponse(200, {"products": list(products)})
+        return FakeResponse(500, "boom")
+
+    def fake_post(path, **kwargs):
+        calls.append(("POST", path))
+        products.append(kwargs["json"])
+        return FakeResponse(201, {"product": kwargs["json"]})
+
+    monkeypatch.setattr(marketplace.marketplace_svc, "get", fake_get)
+    monkeypatch.setattr(marketplace.marketplace_svc, "post", fake_post)
+    response_cache.clear()
+    yield calls
+    response_cache.clear()
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(max_entries=10, ttl=0.01)
+    cache.set(("get_products",), [1])
+
+    assert cache.get(("get_products",)) == (True, [1])
+    time.sleep(0.02)
+    assert cache.get(("get_products",)) == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.set(("get_product_by_id", 1), "a")
+    cache.set(("get_product_by_id", 2), "b")
+    cache.get(("get_product_by_id", 1))
+    cache.set(("get_product_by_id", 3), "c")
+
+    assert cache.get(("get_product_by_id", 2)) == (False, None)
+    assert cache.get(("get_product_by_id", 1)) == (True, "a")
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_invalidate_drops_every_key_of_a_route():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.set(("get_product_by_id", 1), "a")
+    cache.set(("get_product_by_id", 2), "b")
+    cache.set(("get_users",), "users")
+
+    cache.invalidate("get_product_by_id")
+
+    assert cache.get(("get_product_by_id", 1)) == (False, None)
+    assert cache.get(("get_product_by_id", 2)) == (False, None)
+    assert cache.get(("get_users",)) == (True, "users")
+
+
+def test_hit_and_miss_ratios():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.get(("get_users",))
+    cache.set(("get_users",), [])
+    cache.get(("get_users",))
+    cache.get(("get_users",))
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == pytest.approx(2 / 3)
+    assert stats["miss_ratio"] == pytest.approx(1 / 3)
+
+
+def test_reads_are_served_from_cache(upstream_calls):
+    first, _ = marketplace.get_products()
+    second, _ = marketplace.get_products()
+
+    assert first == second == [{"id": 1, "name": "Lamp"}]
+    assert upstream_calls.count(("GET", "/products/")) == 1
+
+
+def test_write_invalidates_the_read_route(upstream_calls):
+    marketplace.get_products()
+    marketplace.add_product(FakeRequest({"id": 2, "name": "Desk"}))
+    products, _ = marketplace.get_products()
+
+    assert products == [{"id": 1, "name": "Lamp"}, {"id": 2, "name": "Desk"}]
+    assert upstream_calls.count(("GET", "/products/")) == 2
+
+
+def test_errors_are_not_cached(upstream_calls):
+    _, error = marketplace.get_product_by_id(5)
+    _, error = marketplace.get_product_by_id(5)
+
+    assert error == ("boom", 500)
+    assert upstream_calls.count(("GET", "/products/5")) == 2
+
+
+def test_set_is_skipped_after_the_route_was_invalidated():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    generation = cache.generation("get_products")
+    cache.invalidate("get_products")
+    cache.set(("get_products",), "stale", generation)
+
+    assert cache.get(("get_products",)) == (False, None)
+    assert cache.get_stats()["stale_fills"] == 1
+
+
+def test_read_racing_a_write_does_not_cache_the_old_result(upstream_calls, monkeypatch):
+    fake_get = marketplace.marketplace_svc.get
+
+    def get_then_write(path, **kwargs):
+        # The write lands after the read got its answer, before it is cached
+        response = fake_get(path, **kwargs)
+        if len(upstream_calls) == 1:
+            marketplace.add_product(FakeRequest({"id": 2, "name": "Desk"}))
+        return response
+
+    monkeypatch.setattr(marketplace.marketplace_svc, "get", get_then_write)
+    raced, _ = marketplace.get_products()
+    products, _ = marketplace.get_products()
+
+    assert raced == [{"id": 1, "name": "Lamp"}]
+    assert products == [{"id": 1, "name": "Lamp"}, {"id": 2, "name": "Desk"}]
+    assert upstream_calls.count(("GET", "/products/")) == 2
+
+
+def test_async_read_racing_a_write_does_not_cache_the_old_result(monkeypatch):
+    products = [{"id": 1, "name": "Lamp"}]
+
+    async def run():
+        answered = asyncio.Event()
+        written = asyncio.Event()
+
+        async def fake_get(path, **kwargs):
+            response = FakeResponse(200, {"products": list(products)})
+            answered.set()
+            await written.wait()
+            return response
+
+        async def fake_post(path, **kwargs):
+            products.append(kwargs["json"])
+            return FakeResponse(201, {"product": kwargs["json"]})
+
+        async def write():
+            await answered.wait()
+            await async_marketplace.add_product({"id": 2, "name": "Desk"})
+            written.set()
+
+        monkeypatch.setattr(async_marketplace.marketplace_svc, "get", fake_get)
+        monkeypatch.setattr(async_marketplace.marketplace_svc, "post", fake_post)
+        (raced, _), _ = await asyncio.gather(async_marketplace.get_products(), write())
+        written.set()
+        return raced, (await async_marketplace.get_products())[0]
+
+    response_cache.clear()
+    try:
+        raced, after = asyncio.run(run())
+    finally:
+        response_cache.clear()
+
+    assert raced == [{"id": 1, "name": "Lamp"}]
+    assert after == [{"id": 1, "name": "Lamp"}, {"id": 2, "name": "Desk"}]
@@ -0,0 +1,300 @@
+import os
+import sys
+import asyncio
+import threading
+import time
+import uuid
+import jwt
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth_svc import access, async_access, token_verifier
+from auth_svc.token_verifier import RevocationCache, _parse_revocation
+
+SECRET = "test-secret"
+
+
+def make_token(identity=None, expires_in=60, secret=SECRET, **claims):
+    now = int(time.time())
+    payload = {
+        "sub": identity or {"username": "alice", "user_id": 1},
+        "jti": str(uuid.uuid4()),
+        "type": "access",
+        "fresh": False,
+        "iat": now,
+        "nbf": now,
+        "exp": now + expires_in,
+    }
+    payload.update(claims)
+    return jwt.encode(payload, secret, algorithm="HS256"), payload
+
+
+@pytest.fixture(autouse=True)
+def local_verification(monkeypatch):
+    monkeypatch.setattr(token_verifier, "JWT_SECRET_KEY", SECRET)
+    token_verifier.revocation_cache.clear()
+    yield
+    token_verifier.revocation_cache.clear()
+
+
+def test_valid_token_returns_identity():
+    token, payload = make_token()
+
+    user, err = access.verify_token(f"Bearer {token}")
+
+    assert err is None
+    assert user == payload["sub"]
+
+
+def test_token_without_bearer_prefix():
+    token, payload = make_token()
+
+    user, err = access.verify_token(token)
+
+    assert err is None
+    assert user == payload["sub"]
+
+
+def test_expired_token_is_rejected():
+    token, _ = make_token(expires_in=-10)
+
+    user, err = access.verify_token(f"Bearer {token}")
+
+    assert user is None
+    assert err == ("Token expired", 401)
+
+
+def test_bad_signature_is_rejected():
+    token, _ = make_token(secret="another-secret")
+
+    user, err = access.verify_token(f"Bearer {token}")
+
+    assert user is None
+    assert err[1] == 401
+
+
+def test_refresh_token_is_rejected():
+    token, _ = make_token(type="refresh")
+
+    user, err = access.verify_token(f"Bearer {token}")
+
+    assert user is None
+    assert err[1] == 401
+
+
+def test_revoked_token_is_rejected():
+    token, payload = make_token()
+    token_verifier.revocation_cache.add(payload["jti"], payload["exp"])
+
+    user, err = access.verify_token(f"Bearer {token}")
+
+    assert user is None
+    assert err == ("Token invalid or revoked", 401)
+
+
+def test_verify_falls_back_to_auth_service(monkeypatch):
+    monkeypatch.setattr(token_verifier, "JWT_SECRET_KEY", None)
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def json(self):
+            return {"username": "alice", "user_id": 1}
+
+    def fake_post(path, headers):
+        calls.append(path)
+        return FakeResponse()
+
+    monkeypatch.setattr(access.upstream.auth, "post", fake_post)
+
+    user, err = access.verify_token("Bearer whatever")
+
+    assert err is None
+    assert user == {"username": "alice", "user_id": 1}
+    assert len(calls) == 1
+
+
+def test_revocation_cache_entries_expire():
+    cache = RevocationCache()
+    cache.add("live", time.time() + 60)
+    cache.add("stale", time.time() + 0.01)
+    cache.add("already-expired", time.time() - 1)
+
+    assert cache.is_revoked("live")
+    assert not cache.is_revoked("already-expired")
+
+    time.sleep(0.02)
+    assert cache.purge_expired() == 1
+    assert not cache.is_revoked("stale")
+    assert len(cache) == 1
+
+
+def test_parse_revocation_message():
+    assert _parse_revocation(b"abc-123:1700000000") == ("abc-123", 1700000000.0)
+
+
+class FakeBatchAuth:
+    """Stands in for auth-service /verify and /verify/batch."""
+
+    def __init__(self, delay=0.0, batch_status=200):
+        self.delay = delay
+        self.batch_status = batch_status
+        self.batches = []
+        self.single_calls = 0
+
+    def post(self, path, headers=None, json=None):
+        time.sleep(self.delay)
+        if path == "/verify":
+            self.single_calls += 1
+            return FakeBatchResponse(200, {"username": "single"})
+        self.batches.append(json["tokens"])
+        results = [
+            {"identity": {"username": token}} if token.startswith("good")
+            else {"msg": "Token invalid or revoked", "status": 401}
+            for token in json["tokens"]
+        ]
+        return FakeBatchResponse(self.batch_status, {"results": results})
+
+
+class FakeBatchResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def verify_concurrently(verifier, tokens):
+    results = [None] * len(tokens)
+
+    def verify(index):
+        results[index] = verifier.verify(tokens[index])
+
+    threads = [threading.Thread(target=verify, args=(index,)) for index in range(len(tokens))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batch_verifier_coalesces_concurrent_requests(monkeypatch):
+    auth = FakeBatchAuth(delay=0.05)
+    monkeypatch.setattr(access.upstream.auth, "post", auth.post)
+    verifier = access.BatchVerifier(max_batch=100, workers=1, timeout=5)
+    tokens = [f"good-{index}" for index in range(20)]
+
+    results = verify_concurrently(verifier, tokens)
+
+    assert results == [({"username": token}, None) for token in tokens]
+    # The first token goes out alone, the rest queue up behind it
+    assert len(auth.batches) < len(tokens)
+    assert verifier.get_stats()["verified"] == len(tokens)
+
+
+def test_batch_verifier_returns_errors_per_token(monkeypatch):
+    auth = FakeBatchAuth()
+    monkeypatch.setattr(access.upstream.auth, "post", auth.post)
+    verifier = access.BatchVerifier(max_batch=10, max_wait=0.05, workers=1, timeout=5)
+
+    results = verify_concurrently(verifier, ["good-a", "revoked", "good-a"])
+
+    assert results == [
+        ({"username": "good-a"}, None),
+        (None, ("Token invalid or revoked", 401)),
+        ({"username": "good-a"}, None),
+    ]
+    # The same token is only sent once
+    assert sorted(auth.batches[0]) == ["good-a", "revoked"]
+
+
+def test_batch_verifier_respects_max_batch(monkeypatch):
+    auth = FakeBatchAuth()
+    monkeypatch.setattr(access.upstream.auth, "post", auth.post)
+    verifier = access.BatchVerifier(max_batch=3, max_wait=0.05, workers=1, timeout=5)
+
+    verify_concurrently(verifier, [f"good-{index}" for index in range(7)])
+
+    assert all(len(batch) <= 3 for batch in auth.batches)
+    assert sum(len(batch) for batch in auth.batches) == 7
+
+
+def test_batch_verifier_falls_back_to_single_verify(monkeypatch):
+    auth = FakeBatchAuth(batch_status=404)
+    monkeypatch.setattr(access.upstream.auth, "post", auth.post)
+    verifier = access.BatchVerifier(workers=1, timeout=5)
+
+    user, err = verifier.verify("good-a")
+
+    assert (user, err) == ({"username": "single"}, None)
+    assert auth.single_calls == 1
+    assert verifier.get_stats()["fallbacks"] == 1
+
+
+def test_verify_token_uses_batches_when_enabled(monkeypatch):
+    monkeypatch.setattr(token_verifier, "JWT_SECRET_KEY", None)
+    monkeypatch.setattr(access, "VERIFY_BATCHING", True)
+    monkeypatch.setattr(access, "batch_verifier", access.BatchVerifier(workers=1, timeout=5))
+    auth = FakeBatchAuth()
+    monkeypatch.setattr(access.upstream.auth, "post", auth.post)
+
+    user, err = access.verify_token("good-a")
+
+    assert (user, err) == ({"username": "good-a"}, None)
+    assert auth.batches == [["good-a"]]
+
+
+class FakeAsyncBatchAuth(FakeBatchAuth):
+    async def post(self, path, headers=None, json=None):
+        await asyncio.sleep(self.delay)
+        return FakeBatchAuth.post(self, path, headers=headers, json=json)
+
+
+def verify_on_one_loop(verifier, tokens):
+    async def run():
+        try:
+            return await asyncio.gather(*(verifier.verify(token) for token in tokens))
+        finally:
+            await verifier.close()
+    return asyncio.run(run())
+
+
+def test_async_batch_verifier_coalesces_concurrent_requests(monkeypatch):
+    auth = FakeAsyncBatchAuth(delay=0.05)
+    monkeypatch.setattr(async_access.async_upstream.auth, "post", auth.post)
+    verifier = async_access.AsyncBatchVerifier(max_batch=100, workers=1, timeout=5)
+    tokens = [f"good-{index}" for index in range(20)] + ["revoked"]
+
+    results = verify_on_one_loop(verifier, tokens)
+
+    assert results[:-1] == [({"username": token}, None) for token in tokens[:-1]]
+    assert results[-1] == (None, ("Token invalid or revoked", 401))
+    # Queued before the worker ran, so they all go out in one call
+    assert len(auth.batches) == 1
+    assert verifier.get_stats()["verified"] == len(tokens)
+
+
+def test_async_batch_verifier_respects_max_batch(monkeypatch):
+    auth = FakeAsyncBatchAuth()
+    monkeypatch.setattr(async_access.async_upstream.auth, "post", auth.post)
+    verifier = async_access.AsyncBatchVerifier(max_batch=3, max_wait=0.05, workers=1, timeout=5)
+
+    verify_on_one_loop(verifier, [f"good-{index}" for index in range(7)])
+
+    assert [len(batch) for batch in auth.batches] == [3, 3, 1]
+
+
+def test_async_batch_verifier_falls_back_to_single_verify(monkeypatch):
+    auth = FakeAsyncBatchAuth(batch_status=404)
+    monkeypatch.setattr(async_access.async_upstream.auth, "post", auth.post)
+    verifier = async_access.AsyncBatchVerifier(workers=1, timeout=5)
+
+    results = verify_on_one_loop(verifier, ["good-a"])
+
+    assert results == [({"username": "single"}, None)]
+    assert auth.single_calls == 1
+    assert verifier.get_stats()["fallbacks"] == 1
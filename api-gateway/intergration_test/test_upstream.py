@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+import requests
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream.upstream import UpstreamClient, from_env
+from upstream.async_upstream import AsyncUpstreamClient
+
+
+def test_connections_are_reused(fake_service):
+    client = UpstreamClient("test", fake_service, pool_size=2, backoff_factor=0)
+
+    for _ in range(5):
+        response = client.get("/items/")
+        assert response.status_code == 200
+        assert response.json() == {"path": "/items/"}
+
+    stats = client.get_stats()
+    assert stats["checkouts"] == 5
+    assert stats["misses"] == 1
+    assert stats["hits"] == 4
+    assert stats["pool_size"] == 2
+    client.close()
+
+
+def test_idempotent_requests_are_retried(fake_service, fake_handler):
+    fake_handler.failures_left = 2
+    client = UpstreamClient("test", fake_service, retries=2, backoff_factor=0)
+
+    response = client.get("/flaky")
+
+    assert response.status_code == 200
+    assert fake_handler.hits.count(("GET", "/flaky")) == 3
+    client.close()
+
+
+def test_post_is_not_retried(fake_service, fake_handler):
+    client = UpstreamClient("test", fake_service, retries=2, backoff_factor=0)
+
+    response = client.post("/items/", json={"name": "thing"})
+
+    assert response.status_code == 503
+    assert fake_handler.hits.count(("POST", "/items/")) == 1
+    client.close()
+
+
+def test_waiting_for_a_full_pool_times_out(fake_service):
+    client = UpstreamClient("test", fake_service, pool_size=1, pool_timeout=0.1, backoff_factor=0)
+    # An unread streamed response keeps the only connection checked out
+    held = client.get("/items/", stream=True)
+
+    started = time.perf_counter()
+    with pytest.raises(requests.ConnectionError):
+        client.get("/items/")
+    assert time.perf_counter() - started < 2
+    assert client.get_stats()["timeouts"] == 1
+
+    # Returned to the pool, the connection can be used again
+    held.close()
+    assert client.get("/items/").status_code == 200
+    client.close()
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("MARKETPLACE_SVC_ADDRESS", "marketplace:5001")
+    monkeypatch.setenv("MARKETPLACE_SVC_POOL_SIZE", "25")
+    monkeypatch.setenv("MARKETPLACE_SVC_POOL_TIMEOUT", "0.5")
+    monkeypatch.setenv("MARKETPLACE_SVC_TIMEOUT", "4")
+
+    client = from_env("marketplace", "MARKETPLACE_SVC_ADDRESS", "unused:1", "/api")
+
+    assert client.base_url == "http://marketplace:5001/api"
+    assert client.pool_size == 25
+    assert client.pool_timeout == 0.5
+    assert client.timeout == (3.05, 4.0)
+    client.close()
+
+
+def test_async_client_reuses_connections_and_retries(fake_service, fake_handler):
+    fake_handler.failures_left = 1
+    client = AsyncUpstreamClient("test", fake_service, pool_size=2, backoff_factor=0)
+
+    async def run():
+        try:
+            first = await client.get("/flaky")
+            second = await client.get("/items/")
+            posted = await client.post("/items/", json={"name": "thing"})
+            return first, second, posted
+        finally:
+            await client.close()
+
+    first, second, posted = asyncio.run(run())
+
+    assert first.status_code == 200
+    assert second.json() == {"path": "/items/"}
+    assert posted.status_code == 503
+    assert fake_handler.hits.count(("GET", "/flaky")) == 2
+    assert fake_handler.hits.count(("POST", "/items/")) == 1
+    stats = client.get_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 3
+
+
+def test_async_client_waiting_for_a_full_pool_times_out(fake_service):
+    client = AsyncUpstreamClient(
+        "test", fake_service, pool_size=1, pool_timeout=0.1, connect_timeout=0.1, retries=0
+    )
+
+    async def run():
+        try:
+            # An unread streamed response keeps the only connection checked out
+            held = await client.open_stream("GET", "/large")
+            started = time.perf_counter()
+            with pytest.raises(asyncio.TimeoutError):
+                await client.get("/items/")
+            waited = time.perf_counter() - started
+            held.release()
+            response = await client.get("/items/")
+            return waited, response
+        finally:
+            await client.close()
+
+    waited, response = asyncio.run(run())
+
+    assert waited < 2
+    assert response.status_code == 200
+    assert client.get_stats()["timeouts"] == 1
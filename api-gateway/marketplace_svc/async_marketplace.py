@@ -0,0 +1,216 @@
+from upstream import async_upstream
+from marketplace_svc.response_cache import async_cached, invalidate_after
+
+# Async versions of marketplace.py for the ASGI server. They receive the
+# already parsed request body instead of the Flask request.
+marketplace_svc = async_upstream.marketplace
+
+
+# ------- User Routes -------
+
+async def add_user(user_data):
+    if not user_data:
+        return None, ("User data is required", 400)
+
+    response = await marketplace_svc.post("/users/", json=user_data)
+    invalidate_after("add_user")
+
+    if response.status_code == 201:
+        user = response.json().get('user')
+        return user, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_users():
+    response = await marketplace_svc.get("/users/")
+    if response.status_code == 200:
+        users = response.json().get('users')
+        return users, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_user_by_username(username):
+    if not username:
+        return None, ("Username is required", 400)
+
+    response = await marketplace_svc.get(f"/users/{username}")
+
+    if response.status_code == 200:
+        user = response.json().get('user')
+        return user, None
+
+    return None, (response.text, response.status_code)
+
+
+async def delete_user(username):
+    if not username:
+        return None, ("Username is required", 400)
+
+    response = await marketplace_svc.delete(f"/users/{username}")
+    invalidate_after("delete_user")
+
+    if response.status_code == 204:
+        return None, None
+
+    return None, (response.text, response.status_code)
+
+
+# ------- Product Routes -------
+
+async def add_product(product_data):
+    if not product_data:
+        return None, ("Product data is required", 400)
+
+    response = await marketplace_svc.post("/products/", json=product_data)
+    invalidate_after("add_product")
+
+    if response.status_code == 201:
+        product = response.json().get('product')
+        return product, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_products():
+    response = await marketplace_svc.get("/products/")
+    if response.status_code == 200:
+        products = response.json().get('products')
+        return products, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_product_by_id(product_id):
+    if not product_id:
+        return None, ("Product ID is required", 400)
+
+    response = await marketplace_svc.get(f"/products/{product_id}")
+
+    if response.status_code == 200:
+        product = response.json().get('product')
+        return product, None
+
+    return None, (response.text, response.status_code)
+
+
+async def update_product_rating(review_data, product_id):
+    if not review_data or not product_id:
+        return None, ("Product data is required", 400)
+
+    response = await marketplace_svc.post(
+        f"/products/{product_id}/review/", json=review_data
+    )
+    invalidate_after("update_product_rating")
+
+    if response.status_code == 200:
+        product = response.json()
+        return product, None
+
+    return None, (response.text, response.status_code)
+
+
+async def delete_product(product_id):
+    if not product_id:
+        return None, ("Product ID is required", 400)
+
+    response = await marketplace_svc.delete(f"/products/{product_id}")
+    invalidate_after("delete_product")
+
+    if response.status_code == 204:
+        return None, None
+
+    return None, (response.text, response.status_code)
+
+
+# ------- Review Routes -------
+
+async def add_review(review_data):
+    if not review_data:
+        return None, ("Review data is required", 400)
+
+    response = await marketplace_svc.post(
+        "/reviews/", json=review_data
+    )
+    invalidate_after("add_review")
+
+    if response.status_code == 201:
+        review = response.json().get('review')
+        return review, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_reviews():
+    response = await marketplace_svc.get("/reviews/")
+    if response.status_code == 200:
+        reviews = response.json().get('reviews')
+        return reviews, None
+
+    return None, (response.text, response.status_code)
+
+
+@async_cached
+async def get_reviews_per_product(product_id):
+    if not product_id:
+        return None, ("Product ID is required", 400)
+
+    response = await marketplace_svc.get(f"/reviews/{product_id}")
+
+    if response.status_code == 200:
+        reviews = response.json().get('reviews')
+        return reviews, None
+
+    return None, (response.text, response.status_code)
+
+
+# ------- Transaction Routes -------
+
+async def add_transaction(transaction_data):
+    if not transaction_data:
+        return None, ("Transaction data is required", 400)
+
+    response = await marketplace_svc.post(
+        "/transactions/", json=transaction_data
+    )
+
+    if response.status_code == 201:
+        transaction = response.json().get('transaction')
+        return transaction, None
+
+    return None, (response.text, response.status_code)
+
+
+async def get_all_transactions():
+    response = await marketplace_svc.get("/transactions/")
+    if response.status_code == 200:
+        transactions = response.json().get('transactions')
+        return transactions, None
+
+    return None, (response.text, response.status_code)
+
+
+async def get_user_transactions(user_id):
+    if not user_id:
+        return None, ("User ID is required", 400)
+
+    response = await marketplace_svc.get(f"/transactions/{user_id}")
+
+    if response.status_code == 200:
+        transactions = response.json().get('transactions')
+        return transactions, None
+
+    return None, (response.text, response.status_code)
+
+
+# ------- Streaming -------
+
+async def stream_collection(path):
+    """Open an upstream list response without reading its body, release it when done."""
+    return await marketplace_svc.open_stream("GET", path)
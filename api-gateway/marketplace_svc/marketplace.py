@@ -1,9 +1,9 @@
-import os
 from flask import Flask, Request, jsonify
-import requests
+from upstream import upstream
+from marketplace_svc.response_cache import cached, invalidate_after
 
 app = Flask(__name__)
-fastapi_url = f"http://{os.environ.get('MARKETPLACE_SVC_ADDRESS')}/api"
+marketplace_svc = upstream.marketplace
 
 
 # ------- User Routes -------
@@ -13,7 +13,8 @@ def add_user(request: Request):
     if not request:
         return jsonify({"error": "User data is required"}), 400
 
-    response = requests.post(f"{fastapi_url}/users/", json=request.json)
+    response = marketplace_svc.post("/users/", json=request.json)
+    invalidate_after("add_user")
 
     if response.status_code == 201:
         user = response.json().get('user')
@@ -22,8 +23,9 @@ def add_user(request: Request):
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_users():
-    response = requests.get(f"{fastapi_url}/users/")
+    response = marketplace_svc.get("/users/")
     if response.status_code == 200:
         users = response.json().get('users')
         return users, None
@@ -31,11 +33,12 @@ def get_users():
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_user_by_username(username):
     if not username:
         return jsonify({"error": "Username is required"}), 400
 
-    response = requests.get(f"{fastapi_url}/users/{username}")
+    response = marketplace_svc.get(f"/users/{username}")
 
     if response.status_code == 200:
         user = response.json().get('user')
@@ -48,7 +51,8 @@ def delete_user(username):
     if not username:
         return jsonify({"error": "Username is required"}), 400
 
-    response = requests.delete(f"{fastapi_url}/users/{username}")
+    response = marketplace_svc.delete(f"/users/{username}")
+    invalidate_after("delete_user")
 
     if response.status_code == 204:
         return None, None
@@ -64,7 +68,8 @@ def add_product(request: Request):
     if not product_data:
         return {"error": "Product data is required"}, 400
 
-    response = requests.post(f"{fastapi_url}/products/", json=product_data)
+    response = marketplace_svc.post("/products/", json=product_data)
+    invalidate_after("add_product")
 
     if response.status_code == 201:
         product = response.json().get('product')
@@ -73,8 +78,9 @@ def add_product(request: Request):
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_products():
-    response = requests.get(f"{fastapi_url}/products/")
+    response = marketplace_svc.get("/products/")
     if response.status_code == 200:
         products = response.json().get('products')
         return products, None
@@ -82,11 +88,12 @@ def get_products():
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_product_by_id(product_id):
     if not product_id:
         return jsonify({"error": "Product ID is required"}), 400
 
-    response = requests.get(f"{fastapi_url}/products/{product_id}")
+    response = marketplace_svc.get(f"/products/{product_id}")
 
     if response.status_code == 200:
         product = response.json().get('product')
@@ -100,9 +107,10 @@ def update_product_rating(request: Request, product_id):
     if not request or not product_id:
         return jsonify({"error": "Product data is required"}), 400
 
-    response = requests.post(
-        f"{fastapi_url}/products/{product_id}/review/", json=request.json
+    response = marketplace_svc.post(
+        f"/products/{product_id}/review/", json=request.json
     )
+    invalidate_after("update_product_rating")
 
     if response.status_code == 200:
         product = response.json()
@@ -115,7 +123,8 @@ def delete_product(product_id):
     if not product_id:
         return jsonify({"error": "Product ID is required"}), 400
 
-    response = requests.delete(f"{fastapi_url}/products/{product_id}")
+    response = marketplace_svc.delete(f"/products/{product_id}")
+    invalidate_after("delete_product")
 
     if response.status_code == 204:
         return None, None
@@ -131,9 +140,10 @@ def add_review(request: Request):
     if not review_data:
         return {"error": "Review data is required"}, 400
 
-    response = requests.post(
-        f"{fastapi_url}/reviews/", json=review_data
+    response = marketplace_svc.post(
+        "/reviews/", json=review_data
     )
+    invalidate_after("add_review")
 
     if response.status_code == 201:
         review = response.json().get('review')
@@ -142,8 +152,9 @@ def add_review(request: Request):
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_reviews():
-    response = requests.get(f"{fastapi_url}/reviews/")
+    response = marketplace_svc.get("/reviews/")
     if response.status_code == 200:
         reviews = response.json().get('reviews')
         return reviews, None
@@ -151,11 +162,12 @@ def get_reviews():
     return None, (response.text, response.status_code)
 
 
+@cached
 def get_reviews_per_product(product_id):
     if not product_id:
         return jsonify({"error": "Product ID is required"}), 400
 
-    response = requests.get(f"{fastapi_url}/reviews/{product_id}")
+    response = marketplace_svc.get(f"/reviews/{product_id}")
 
     if response.status_code == 200:
         reviews = response.json().get('reviews')
@@ -172,8 +184,8 @@ def add_transaction(request: Request):
     if not transaction_data:
         return {"error": "Transaction data is required"}, 400
 
-    response = requests.post(
-        f"{fastapi_url}/transactions/", json=transaction_data
+    response = marketplace_svc.post(
+        "/transactions/", json=transaction_data
     )
 
     if response.status_code == 201:
@@ -184,7 +196,7 @@ def add_transaction(request: Request):
 
 
 def get_all_transactions():
-    response = requests.get(f"{fastapi_url}/transactions/")
+    response = marketplace_svc.get("/transactions/")
     if response.status_code == 200:
         transactions = response.json().get('transactions')
         return transactions, None
@@ -196,10 +208,17 @@ def get_user_transactions(user_id):
     if not user_id:
         return jsonify({"error": "User ID is required"}), 400
 
-    response = requests.get(f"{fastapi_url}/transactions/{user_id}")
+    response = marketplace_svc.get(f"/transactions/{user_id}")
 
     if response.status_code == 200:
         transactions = response.json().get('transactions')
         return transactions, None
 
     return None, (response.text, response.status_code)
+
+
+# ------- Streaming -------
+
+def stream_collection(path):
+    """Open an upstream list response without reading its body."""
+    return marketplace_svc.get(path, stream=True)
@@ -0,0 +1,190 @@
+import base64
+import binascii
+import json
+import os
+import re
+from collections import namedtuple
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+STREAM_CHUNK_SIZE = 64 * 1024
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# limit=None means the whole collection, fields=None means every field
+ListParams = namedtuple("ListParams", ["limit", "offset", "fields", "stream"])
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(f"o:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        kind, _, offset = base64.urlsafe_b64decode(padded).decode().partition(":")
+        if kind != "o":
+            raise ValueError(cursor)
+        return int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def parse_list_params(args):
+    """Read limit, cursor, fields and stream from the query string of a list route."""
+    try:
+        limit = args.get("limit")
+        if limit is not None:
+            limit = int(limit)
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        cursor = args.get("cursor")
+        offset = decode_cursor(cursor) if cursor else 0
+        if offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
+    except ValueError as e:
+        return None, (str(e), 400)
+
+    fields = args.get("fields")
+    if fields is not None:
+        fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+
+    stream = args.get("stream", "").lower() in ("1", "true", "yes")
+    if stream and (limit is not None or cursor or fields):
+        return None, ("stream cannot be combined with limit, cursor or fields", 400)
+
+    return ListParams(limit, offset, fields, stream), None
+
+
+def project(item, fields):
+    if not isinstance(item, dict):
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+def paginate(items, params):
+    """Return the requested page of items and the cursor of the next page, if any."""
+    if items is None:
+        return items, None
+
+    next_cursor = None
+    if params.limit is not None or params.offset:
+        end = len(items) if params.limit is None else params.offset + params.limit
+        if end < len(items):
+            next_cursor = encode_cursor(end)
+        items = items[params.offset:end]
+
+    if params.fields:
+        items = [project(item, params.fields) for item in items]
+
+    return items, next_cursor
+
+
+class EnvelopeUnwrapper:
+    """
+    Cuts the list out of a streamed marketplace envelope, {"products": [...]}
+    becomes [...], so a streamed list has the same shape as a decoded one.
+
+    Feed it the chunks of the body as they arrive. Only the structure of the
+    JSON is scanned (quotes, brackets, colons and commas), the items are
+    passed on as they are. A body that is not an object with the list under
+    key (a bare list, an error) is passed on unchanged.
+    """
+
+    STRUCTURE = re.compile(rb'[\\"\[\]{}:,]')
+
+    def __init__(self, key):
+        self.key = json.dumps(key).encode()
+        self._buffer = bytearray()  # Body up to the start of the list
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False  # The next byte is escaped, it was in the next chunk
+        self._expect_key = False
+        self._key_start = None
+        self._last_key = None
+        self._start = None  # Offset of the list in the buffer
+        self._emitting = False
+        self._passthrough = False
+        self._done = False
+
+    def _scan(self, data, pos):
+        """Follow the structure of data from pos, returns the end of the list once it is closed."""
+        if self._escaped and pos < len(data):
+            self._escaped = False
+            pos += 1
+        while True:
+            match = self.STRUCTURE.search(data, pos)
+            if match is None:
+                return None
+            i = match.start()
+            char = data[i:i + 1]
+            pos = i + 1
+            if self._in_string:
+                if char == b"\\":
+                    if pos < len(data):
+                        pos += 1
+                    else:
+                        self._escaped = True
+                elif char == b'"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._last_key = bytes(data[self._key_start:pos])
+                        self._key_start = None
+                continue
+            if char == b'"':
+                self._in_string = True
+                if self._start is None and self._depth == 1 and self._expect_key:
+                    self._key_start = i
+            elif char in (b"[", b"{"):
+                if self._depth == 0 and char == b"[":
+                    self._passthrough = True
+                    return None
+                if self._start is None and self._depth == 1 and char == b"[" and self._last_key == self.key:
+                    self._start = i
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+            elif char in (b"]", b"}"):
+                self._depth -= 1
+                if self._start is not None and self._depth == 1:
+                    return pos
+            elif self._depth == 1 and self._start is None:
+                if char == b":":
+                    self._expect_key = False
+                else:
+                    self._expect_key = True
+                    self._last_key = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Take the next chunk of the body, returns the bytes to send on."""
+        if self._done:
+            return b""
+        if self._passthrough:
+            return chunk
+        if self._emitting:
+            end = self._scan(chunk, 0)
+            if end is None:
+                return chunk
+            self._done = True
+            return chunk[:end]
+
+        self._buffer += chunk
+        end = self._scan(self._buffer, self._scanned)
+        self._scanned = len(self._buffer)
+        if self._passthrough:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            return data
+        if self._start is None:
+            return b""
+        data, self._buffer = bytes(self._buffer), bytearray()
+        self._emitting = True
+        if end is not None:
+            self._done = True
+            return data[self._start:end]
+        return data[self._start:]
+
+    def close(self) -> bytes:
+        """The end of the body, returns what is left to send."""
+        data, self._buffer = bytes(self._buffer), bytearray()
+        # Never found the list, the body goes out as it came in
+        return data if not self._emitting else b""
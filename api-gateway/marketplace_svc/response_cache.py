@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache for marketplace read results.
+
+    Keys are (route, *params). Writes invalidate whole routes, so a key index
+    per route is kept to avoid scanning the cache.
+
+    Every invalidation also bumps the generation of the route. A read takes
+    the generation before it calls the marketplace and passes it to set, so
+    a result fetched before a write finished is not stored after the write
+    invalidated the route.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._routes = {}  # route -> set of keys
+        self._generations = {}  # route -> number of invalidations
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return (found, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def generation(self, route):
+        with self._lock:
+            return self._generations.get(route, 0)
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                # The route was invalidated while the value was fetched
+                self.stale_fills += 1
+                return
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._routes.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, *routes):
+        with self._lock:
+            for route in routes:
+                self._generations[route] = self._generations.get(route, 0) + 1
+                for key in self._routes.pop(route, ()):
+                    self._entries.pop(key, None)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._routes.clear()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._routes.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._routes[key[0]]
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "miss_ratio": self.misses / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_fills": self.stale_fills,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("MARKETPLACE_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("MARKETPLACE_CACHE_TTL", 30)),
+)
+
+
+def cached(func):
+    """Cache the (result, error) of a marketplace read, errors are never cached."""
+    @wraps(func)
+    def wrapper(*args):
+        if not response_cache.enabled:
+            return func(*args)
+        key = (func.__name__, *args)
+        found, value = response_cache.get(key)
+        if found:
+            return value, None
+        generation = response_cache.generation(func.__name__)
+        result, error = func(*args)
+        if error is None:
+            response_cache.set(key, result, generation)
+        return result, error
+    return wrapper
+
+
+def async_cached(func):
+    """Same as cached, for the coroutines of async_marketplace.py."""
+    @wraps(func)
+    async def wrapper(*args):
+        if not response_cache.enabled:
+            return await func(*args)
+        key = (func.__name__, *args)
+        found, value = response_cache.get(key)
+        if found:
+            return value, None
+        generation = response_cache.generation(func.__name__)
+        result, error = await func(*args)
+        if error is None:
+            response_cache.set(key, result, generation)
+        return result, error
+    return wrapper
+
+
+# Read routes made stale by each write route
+INVALIDATES = {
+    "add_user": ("get_users", "get_user_by_username"),
+    "delete_user": ("get_users", "get_user_by_username", "get_reviews", "get_reviews_per_product"),
+    "add_product": ("get_products",),
+    "delete_product": ("get_products", "get_product_by_id", "get_reviews", "get_reviews_per_product"),
+    "update_product_rating": ("get_products", "get_product_by_id", "get_reviews", "get_reviews_per_product"),
+    "add_review": ("get_reviews", "get_reviews_per_product", "get_products", "get_product_by_id"),
+}
+
+
+def invalidate_after(write_route):
+    response_cache.invalidate(*INVALIDATES[write_route])
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from event_codec import event_codec
+from matrix_com.matrix_com import CHAT_MESSAGE_FIELDS, build_connection_request, encode_chat_batch
+
+# Same /bots endpoints as matrix_com.py, for the ASGI server
+bots_router = APIRouter()
+
+nats_client = None
+
+def init_router(client):
+    global nats_client
+    nats_client = client
+    return bots_router
+
+@bots_router.post("/ask_connection")
+async def ask_connection():
+    try:
+        print("Received request to /bots/ask_connection")
+        if not nats_client or not nats_client.connected:
+            print("NATS client is not connected!")
+            raise RuntimeError("NATS client is not connected")
+
+        connection_request = build_connection_request()
+
+        # Published on the event loop that also serves this request
+        await nats_client.publish_async("bots.connection", event_codec.encode("bots.connection", connection_request))
+
+        print("Message published to NATS successfully")
+        return JSONResponse({"message": "Bot connection request sent"}, status_code=200)
+    except Exception as e:
+        print(f"Error in /ask_connection: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@bots_router.post("/chat_message")
+async def chat_message(request: Request):
+    try:
+        payload = await request.json()
+
+        # Validate the payload
+        if not all(field in payload for field in CHAT_MESSAGE_FIELDS):
+            return JSONResponse({"error": "Missing required fields"}, status_code=400)
+        try:
+            data = event_codec.encode("chat.messages", payload)
+        except event_codec.EventValidationError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        print(f"Received chat message: {payload}")
+
+        if not nats_client or not nats_client.connected:
+            raise RuntimeError("NATS client is not connected")
+
+        await nats_client.publish_async("chat.messages", data)
+        print("Chat message published to NATS successfully")
+        return JSONResponse({"message": "Chat message sent successfully"}, status_code=200)
+    except Exception as e:
+        print(f"Error in /chat_message: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@bots_router.post("/chat_message/batch")
+async def chat_message_batch(request: Request):
+    try:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        result, error = encode_chat_batch(body)
+        if error:
+            return JSONResponse({"error": error[0]}, status_code=error[1])
+        encoded, rejected = result
+
+        if not nats_client or not nats_client.connected:
+            raise RuntimeError("NATS client is not connected")
+
+        await nats_client.publish_many_async([("chat.messages", data) for data in encoded])
+        print(f"{len(encoded)} chat messages published to NATS, {len(rejected)} rejected")
+        return JSONResponse({"accepted": len(encoded), "rejected": rejected}, status_code=200)
+    except Exception as e:
+        print(f"Error in /chat_message/batch: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request
 from datetime import datetime
+import os
 import uuid
+from event_codec import event_codec
 
 bots_blueprint = Blueprint('bots', __name__)
 
@@ -14,6 +16,47 @@ def init_blueprint(client):
 def get_current_time_iso():
     return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
 
+CHAT_MESSAGE_FIELDS = ["room_id", "room_name", "sender", "receiver", "message", "timestamp"]
+
+# Most chat messages accepted in one /chat_message/batch request
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", 500))
+
+def encode_chat_batch(body):
+    """
+    Validate and encode the messages of a /chat_message/batch body.
+
+    Returns ((encoded, rejected), None), where rejected lists the index and
+    error of every invalid message, or (None, (error, status)) if the body
+    itself cannot be used.
+    """
+    messages = body.get("messages") if isinstance(body, dict) else None
+    if not isinstance(messages, list):
+        return None, ("Expected a list of messages", 400)
+    if len(messages) > CHAT_BATCH_MAX:
+        return None, (f"At most {CHAT_BATCH_MAX} messages per batch", 413)
+
+    encoded, rejected = [], []
+    for index, payload in enumerate(messages):
+        if not isinstance(payload, dict) or not all(field in payload for field in CHAT_MESSAGE_FIELDS):
+            rejected.append({"index": index, "error": "Missing required fields"})
+            continue
+        try:
+            encoded.append(event_codec.encode("chat.messages", payload))
+        except event_codec.EventValidationError as e:
+            rejected.append({"index": index, "error": str(e)})
+    return (encoded, rejected), None
+
+def build_connection_request():
+    return {
+        "event_id": str(uuid.uuid4()),
+        "timestamp": get_current_time_iso(),
+        "platform": "Matrix",
+        "service": "update",
+        "event_type": "post",
+        "actor": "Matrix-Gateway",
+        "payload": "A new Matrix-Gateway service is running"
+    }
+
 @bots_blueprint.route("/ask_connection", methods=["POST"])
 def ask_connection():
     try:
@@ -22,18 +65,10 @@ def ask_connection():
             print("NATS client is not connected!")
             raise RuntimeError("NATS client is not connected")
 
-        connection_request = {
-            "event_id": str(uuid.uuid4()),
-            "timestamp": get_current_time_iso(),
-            "platform": "Matrix",
-            "service": "update",
-            "event_type": "post",
-            "actor": "Matrix-Gateway",
-            "payload": "A new Matrix-Gateway service is running"
-        }
+        connection_request = build_connection_request()
 
         # Serialize and encode the connection request
-        nats_client.publish("bots.connection", str(connection_request))
+        nats_client.publish("bots.connection", event_codec.encode("bots.connection", connection_request))
 
         print("Message published to NATS successfully")
         return jsonify({"message": "Bot connection request sent"}), 200
@@ -45,20 +80,42 @@ def ask_connection():
 def chat_message():
     try:
         payload = request.json
-        required_fields = ["room_id", "room_name", "sender", "receiver", "message", "timestamp"]
-
         # Validate the payload
-        if not all(field in payload for field in required_fields):
+        if not all(field in payload for field in CHAT_MESSAGE_FIELDS):
             return jsonify({"error": "Missing required fields"}), 400
+        try:
+            data = event_codec.encode("chat.messages", payload)
+        except event_codec.EventValidationError as e:
+            return jsonify({"error": str(e)}), 400
 
         print(f"Received chat message: {payload}")
 
         if not nats_client or not nats_client.connected:
             raise RuntimeError("NATS client is not connected")
 
-        nats_client.publish("chat.messages", str(payload))  # Convert payload to a string for NATS
+        # Buffered and flushed in batches, failures are logged by the NATS client
+        nats_client.publish("chat.messages", data)
         print("Chat message published to NATS successfully")
         return jsonify({"message": "Chat message sent successfully"}), 200
     except Exception as e:
         print(f"Error in /chat_message: {e}")
         return jsonify({"error": str(e)}), 500
+
+@bots_blueprint.route("/chat_message/batch", methods=["POST"])
+def chat_message_batch():
+    try:
+        result, error = encode_chat_batch(request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+        encoded, rejected = result
+
+        if not nats_client or not nats_client.connected:
+            raise RuntimeError("NATS client is not connected")
+
+        # One hand-off to the NATS loop for the whole batch
+        nats_client.publish_many([("chat.messages", data) for data in encoded])
+        print(f"{len(encoded)} chat messages published to NATS, {len(rejected)} rejected")
+        return jsonify({"accepted": len(encoded), "rejected": rejected}), 200
+    except Exception as e:
+        print(f"Error in /chat_message/batch: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,208 @@
+import os
+import asyncio
+import time
+from collections import deque
+import aiohttp
+from event_codec import event_codec
+
+DISPATCH_WORKERS = int(os.getenv("NATS_DISPATCH_WORKERS", 8))
+DISPATCH_QUEUE_SIZE = int(os.getenv("NATS_DISPATCH_QUEUE_SIZE", 1000))
+# Connections kept open to the services the handlers call (matrix-gateway)
+HANDLER_POOL_SIZE = int(os.getenv("NATS_HANDLER_POOL_SIZE", 20))
+HANDLER_TIMEOUT = float(os.getenv("NATS_HANDLER_TIMEOUT", 10))
+LATENCY_WINDOW = 1000
+
+
+class PermanentError(Exception):
+    """Raised by a handler for a message that would fail the same way again, it is not redelivered."""
+
+
+class HandlerStats:
+    def __init__(self):
+        self.handled = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, elapsed, failed, rejected=False):
+        self.handled += 1
+        self.failed += failed
+        self.rejected += rejected
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.recent.append(elapsed)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+        return {
+            "handled": self.handled,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_ms": self.total_time / self.handled * 1000 if self.handled else 0.0,
+            "p95_ms": recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000 if recent else 0.0,
+            "max_ms": self.max_time * 1000,
+        }
+
+
+class MessageDispatcher:
+    """
+    Runs the handlers of received NATS messages on a fixed number of workers.
+
+    Messages are queued by the subscription callback and routed to a handler
+    by their "service" field. When the queue is full the callback waits, which
+    holds back the subscription instead of piling up handler tasks. The
+    handlers share one aiohttp session with a bounded connection pool.
+
+    JetStream messages (manual_ack) that are waiting for a worker or being
+    handled are reported in progress every progress_interval seconds, so a
+    long queue does not make the server redeliver them after its ack wait.
+    """
+
+    def __init__(self, handlers, workers=DISPATCH_WORKERS, queue_size=DISPATCH_QUEUE_SIZE,
+                 pool_size=HANDLER_POOL_SIZE, timeout=HANDLER_TIMEOUT, manual_ack=False,
+                 progress_interval=None):
+        self.handlers = handlers  # service -> async handler(data)
+        self.manual_ack = manual_ack  # JetStream messages, acked once handled
+        self.progress_interval = progress_interval
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None
+        self.loop = None
+        self._queue = None
+        self._tasks = []
+        self._unsettled = {}  # id(msg) -> msg, received and not yet acked
+        self.received = 0
+        self.invalid = 0
+        self.unhandled = 0
+        self.max_queue_depth = 0
+        self.progress_sent = 0
+        self.stats = {}  # service -> HandlerStats
+
+    @property
+    def started(self):
+        return self.loop is not None
+
+    async def start(self):
+        """Create the session, the queue and the workers on the running loop."""
+        if self.started:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.manual_ack and self.progress_interval:
+            self._tasks.append(asyncio.create_task(self._report_progress()))
+        print(f"Started {self.workers} NATS message workers")
+
+    async def submit(self, msg):
+        """Subscription callback, queues the message for the workers."""
+        if not self.started:
+            await self.start()
+        self.received += 1
+        if self.manual_ack:
+            self._unsettled[id(msg)] = msg
+        await self._queue.put(msg)
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    async def _worker(self):
+        while True:
+            msg = await self._queue.get()
+            try:
+                await self.dispatch(msg)
+            finally:
+                self._queue.task_done()
+
+    async def dispatch(self, msg):
+        try:
+            # JSON or msgpack, validated against the event schema
+            data = event_codec.decode(msg.subject, msg.data)
+        except event_codec.EventValidationError as e:
+            self.invalid += 1
+            print(f"Invalid event on '{msg.subject}': {e}")
+            # Will never decode, do not redeliver it
+            await self._settle(msg, "term")
+            return
+
+        # Route message based on 'service' field
+        service = data.get("service")
+        handler = self.handlers.get(service)
+        if handler is None:
+            self.unhandled += 1
+            print(f"Unhandled service type: {service}")
+            await self._settle(msg, "ack")
+            return
+
+        started = time.perf_counter()
+        outcome = "ack"
+        try:
+            await handler(data)
+        except PermanentError as e:
+            outcome = "term"
+            print(f"Handler for '{service}' rejected the message: {e}")
+        except Exception as e:
+            outcome = "nak"
+            print(f"Unexpected error in handler for '{service}': {e}")
+        finally:
+            self.stats.setdefault(service, HandlerStats()).record(
+                time.perf_counter() - started, outcome != "ack", outcome == "term"
+            )
+        # Failed messages are redelivered, up to the max_deliver of the consumer,
+        # rejected ones are not
+        await self._settle(msg, outcome)
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            for msg in list(self._unsettled.values()):
+                try:
+                    await msg.in_progress()
+                    self.progress_sent += 1
+                except Exception as e:
+                    print(f"Failed to report progress of message on '{msg.subject}': {e}")
+
+    async def _settle(self, msg, outcome):
+        if not self.manual_ack:
+            return
+        self._unsettled.pop(id(msg), None)
+        try:
+            await getattr(msg, outcome)()
+        except Exception as e:
+            print(f"Failed to {outcome} message on '{msg.subject}': {e}")
+
+    async def join(self):
+        """Wait until every queued message has been handled."""
+        if self.started:
+            await self._queue.join()
+
+    async def close(self):
+        if not self.started:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.session.close()
+        self._tasks = []
+        self._unsettled = {}
+        self.session = None
+        self.loop = None
+
+    def get_stats(self):
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self.started else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_size": self.queue_size,
+            "received": self.received,
+            "invalid": self.invalid,
+            "unhandled": self.unhandled,
+            "unsettled": len(self._unsettled),
+            "progress_sent": self.progress_sent,
+            "handlers": {service: stats.as_dict() for service, stats in self.stats.items()},
+        }
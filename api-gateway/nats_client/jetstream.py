@@ -0,0 +1,47 @@
+"""
+JetStream stream and consumer settings of the services that consume NATS events.
+
+The same file is shipped in every service that consumes from the stream
+(api-gateway/nats_client/jetstream.py, chat-assistant/jetstream.py), keep
+the copies identical. api-gateway/intergration_test/test_event_codec.py
+fails when they differ.
+"""
+import os
+from nats.js.api import AckPolicy, ConsumerConfig
+from nats.js.errors import NotFoundError
+
+STREAM_NAME = os.getenv("NATS_STREAM", "DVERSE_EVENTS")
+STREAM_SUBJECTS = ["bots.connection", "chat.messages", "send.matrix.message"]
+STREAM_MAX_AGE = float(os.getenv("NATS_STREAM_MAX_AGE", 24 * 3600))
+# A message that is not acked within ACK_WAIT seconds is redelivered, at
+# most MAX_DELIVER times
+ACK_WAIT = float(os.getenv("NATS_ACK_WAIT", 30))
+MAX_DELIVER = int(os.getenv("NATS_MAX_DELIVER", 5))
+MAX_ACK_PENDING = int(os.getenv("NATS_MAX_ACK_PENDING", 1000))
+# Messages still waiting for a worker are reported in progress this often,
+# which restarts their ACK_WAIT
+PROGRESS_INTERVAL = float(os.getenv("NATS_PROGRESS_INTERVAL", ACK_WAIT / 3))
+
+
+def durable_name(queue, subject):
+    # One consumer per subject, durable names cannot contain dots
+    return f"{queue}_{subject.replace('.', '_')}"
+
+
+def consumer_config():
+    return ConsumerConfig(
+        ack_policy=AckPolicy.EXPLICIT,
+        ack_wait=ACK_WAIT,
+        max_deliver=MAX_DELIVER,
+        max_ack_pending=MAX_ACK_PENDING,
+    )
+
+
+async def ensure_stream(js, name=None, subjects=None):
+    name = name or STREAM_NAME
+    subjects = subjects or STREAM_SUBJECTS
+    try:
+        await js.stream_info(name)
+    except NotFoundError:
+        print(f"Creating JetStream stream '{name}' for {subjects}")
+        await js.add_stream(name=name, subjects=subjects, max_age=STREAM_MAX_AGE)
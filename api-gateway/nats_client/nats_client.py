@@ -1,19 +1,62 @@
 import os
 from dotenv import load_dotenv
 import asyncio
-import json
-import aiohttp
+import threading
+from concurrent.futures import Future
+from event_codec import event_codec
+from nats_client import jetstream
+from nats_client.dispatcher import MessageDispatcher, PermanentError
 from nats.aio.client import Client as NATS
 
 load_dotenv()
 matrix_gateway_url = os.getenv("MATRIX_GATEWAY_URL")
 
+# Messages published from other threads are buffered and handed to the NATS
+# loop in batches, flushed when the batch is full or the interval has passed
+PUBLISH_BATCH_SIZE = int(os.getenv("NATS_PUBLISH_BATCH_SIZE", 64))
+PUBLISH_FLUSH_INTERVAL = float(os.getenv("NATS_PUBLISH_FLUSH_INTERVAL", 0.002))
+# Publishers block once this many messages are buffered or in flight
+PUBLISH_MAX_PENDING = int(os.getenv("NATS_PUBLISH_MAX_PENDING", 10000))
+PUBLISH_TIMEOUT = float(os.getenv("NATS_PUBLISH_TIMEOUT", 5))
+LOG_PAYLOADS = os.getenv("NATS_LOG_PAYLOADS", "false").lower() == "true"
+
+# Replicas in the same queue group share the messages instead of each
+# receiving all of them, an empty group subscribes every replica
+QUEUE_GROUP = os.getenv("NATS_QUEUE_GROUP", "api-gateway")
+# Consume from a JetStream stream with durable consumers and explicit acks,
+# so messages published while no replica is running are delivered later.
+# The stream and consumer settings are shared with chat-assistant, see jetstream.py
+JETSTREAM_ENABLED = os.getenv("NATS_JETSTREAM", "false").lower() == "true"
+STREAM_NAME = jetstream.STREAM_NAME
+STREAM_SUBJECTS = jetstream.STREAM_SUBJECTS
+durable_name = jetstream.durable_name
+# Client errors that may go away, the other 4xx answers are not redelivered
+RETRY_STATUSES = {408, 425, 429}
+
+
+async def ensure_stream(js):
+    await jetstream.ensure_stream(js, STREAM_NAME, STREAM_SUBJECTS)
+
 class NATSClient:
-    def __init__(self):
+    def __init__(self, batch_size=PUBLISH_BATCH_SIZE, flush_interval=PUBLISH_FLUSH_INTERVAL,
+                 max_pending=PUBLISH_MAX_PENDING, publish_timeout=PUBLISH_TIMEOUT,
+                 jetstream=JETSTREAM_ENABLED):
         self.nc = NATS()
         self.loop = asyncio.new_event_loop()
         # asyncio.set_event_loop(self.loop)
         self.connected = False
+        self.jetstream = jetstream
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.publish_timeout = publish_timeout
+        self._buffer = []  # (subject, data, future)
+        self._pending = 0  # buffered + being published
+        self._flush_scheduled = False
+        self._buffer_changed = threading.Condition()
+        self.batches_published = 0
+        self.messages_published = 0
 
     def connect(self, servers=["nats://localhost:4222"], ping_interval=20, max_outstanding_pings=3):
         if not self.connected:
@@ -32,23 +75,178 @@ class NATSClient:
                 print(f"Error connecting to NATS: {e}")
                 raise RuntimeError(f"Failed to connect to NATS: {e}")
 
-    def publish(self, subject, payload):
+    async def connect_async(self, servers=["nats://localhost:4222"], ping_interval=20, max_outstanding_pings=3):
+        """Connect on the already running loop, used when the gateway is served over ASGI."""
+        if not self.connected:
+            try:
+                print(f"Connecting to NATS servers: {servers}")
+                # Share the loop of the web server instead of running our own
+                running_loop = asyncio.get_running_loop()
+                if self.loop is not running_loop:
+                    self.loop.close()
+                    self.loop = running_loop
+                await self.nc.connect(
+                    servers=servers,
+                    ping_interval=ping_interval,
+                    max_outstanding_pings=max_outstanding_pings
+                )
+                self.connected = True
+                print("Successfully connected to NATS.")
+            except Exception as e:
+                print(f"Error connecting to NATS: {e}")
+                raise RuntimeError(f"Failed to connect to NATS: {e}")
+
+    def publish(self, subject, payload, timeout=None):
+        """
+        Publish a payload, either already encoded bytes or a string.
+
+        Returns a future that resolves once the batch holding the message has
+        been flushed to the server; callers may wait on it or ignore it.
+        """
+        return self.publish_many([(subject, payload)], timeout=timeout)[0]
+
+    def publish_many(self, messages, timeout=None):
+        """
+        Buffer (subject, payload) pairs for the NATS loop and return one future per message.
+
+        Blocks while the buffer is full, and raises RuntimeError if it is
+        still full after timeout (publish_timeout by default) seconds.
+        """
         if not self.connected:
             raise RuntimeError("NATS client is not connected")
-        print(f"Publishing to subject '{subject}': {payload}")
+
+        batch = []
+        for subject, payload in messages:
+            data = payload if isinstance(payload, bytes) else payload.encode()
+            if LOG_PAYLOADS:
+                print(f"Publishing to subject '{subject}': {payload}")
+            batch.append((subject, data, Future()))
+        if not batch:
+            return []
+
+        with self._buffer_changed:
+            # Back-pressure, a batch larger than max_pending still goes through on its own
+            has_room = self._buffer_changed.wait_for(
+                lambda: self._pending == 0 or self._pending + len(batch) <= self.max_pending,
+                timeout=self.publish_timeout if timeout is None else timeout,
+            )
+            if not has_room:
+                raise RuntimeError(f"NATS publish buffer is full ({self._pending} messages pending)")
+            self._buffer.extend(batch)
+            self._pending += len(batch)
+            flush_now = len(self._buffer) >= self.batch_size
+            start_timer = not flush_now and not self._flush_scheduled
+            self._flush_scheduled = self._flush_scheduled or flush_now or start_timer
+
+        # One hop onto the loop per batch instead of one per message
+        if flush_now:
+            self.loop.call_soon_threadsafe(self._flush_buffer)
+        elif start_timer:
+            self.loop.call_soon_threadsafe(self.loop.call_later, self.flush_interval, self._flush_buffer)
+
+        return [future for _, _, future in batch]
+
+    def _flush_buffer(self):
+        """Runs on the loop, hands everything buffered so far to the NATS client."""
+        with self._buffer_changed:
+            batch, self._buffer = self._buffer, []
+            self._flush_scheduled = False
+        if batch:
+            self.loop.create_task(self._publish_batch(batch))
+
+    async def _publish_batch(self, batch):
+        errors = [None] * len(batch)
+        for i, (subject, data, _) in enumerate(batch):
+            try:
+                await self.nc.publish(subject, data)
+            except Exception as e:
+                errors[i] = e
         try:
-            asyncio.run_coroutine_threadsafe(self.nc.publish(subject, payload.encode()), self.loop)
-            print(f"Message published to '{subject}' successfully.")
+            # Round trip to the server, so errors show up here instead of being lost
+            await self.nc.flush(timeout=self.publish_timeout)
         except Exception as e:
-            print(f"Error publishing to NATS: {e}")
-            raise RuntimeError(f"Failed to publish message to '{subject}': {e}")
+            print(f"Error flushing {len(batch)} messages to NATS: {e}")
+            errors = [error or e for error in errors]
+
+        failed = len(batch) - errors.count(None)
+        if failed:
+            print(f"{failed} of {len(batch)} messages could not be published to NATS")
+        with self._buffer_changed:
+            self._pending -= len(batch)
+            self.batches_published += 1
+            self.messages_published += len(batch) - failed
+            self._buffer_changed.notify_all()
+
+        for (subject, _, future), error in zip(batch, errors):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(f"Failed to publish message to '{subject}': {error}"))
+
+    def get_publish_stats(self):
+        with self._buffer_changed:
+            return {
+                "pending": self._pending,
+                "buffered": len(self._buffer),
+                "batches_published": self.batches_published,
+                "messages_published": self.messages_published,
+                "messages_per_batch": (
+                    self.messages_published / self.batches_published if self.batches_published else 0.0
+                ),
+            }
+
+    async def publish_async(self, subject, payload):
+        await self.publish_many_async([(subject, payload)])
+
+    async def publish_many_async(self, messages):
+        """Publish (subject, payload) pairs, written to the server in one go by the NATS client."""
+        if not self.connected:
+            raise RuntimeError("NATS client is not connected")
+        if not messages:
+            return
+        for subject, payload in messages:
+            data = payload if isinstance(payload, bytes) else payload.encode()
+            try:
+                await self.nc.publish(subject, data)
+            except Exception as e:
+                print(f"Error publishing to NATS: {e}")
+                raise RuntimeError(f"Failed to publish message to '{subject}': {e}")
+        # Same counters as the batches of the threaded server, for /metrics/nats
+        with self._buffer_changed:
+            self.batches_published += 1
+            self.messages_published += len(messages)
 
-    def subscribe(self, subject, callback):
+    def subscribe(self, subject, callback, queue=QUEUE_GROUP):
         if not self.connected:
             raise RuntimeError("NATS client is not connected")
         print(f"Subscribing to subject: {subject}")
-        asyncio.run_coroutine_threadsafe(self.nc.subscribe(subject, cb=callback), self.loop)
-        
+        return asyncio.run_coroutine_threadsafe(self._subscribe(subject, callback, queue), self.loop)
+
+    async def subscribe_async(self, subject, callback, queue=QUEUE_GROUP):
+        if not self.connected:
+            raise RuntimeError("NATS client is not connected")
+        print(f"Subscribing to subject: {subject}")
+        return await self._subscribe(subject, callback, queue)
+
+    async def _subscribe(self, subject, callback, queue):
+        if not self.jetstream:
+            return await self.nc.subscribe(subject, queue=queue or "", cb=callback)
+
+        if not queue:
+            raise ValueError("A queue group is needed to name the durable JetStream consumer")
+        js = self.nc.jetstream()
+        await ensure_stream(js)
+        # The callback has to ack every message, unacked ones are redelivered after ACK_WAIT
+        durable = durable_name(queue, subject)
+        return await js.subscribe(
+            subject,
+            queue=durable,
+            cb=callback,
+            stream=STREAM_NAME,
+            manual_ack=True,
+            config=jetstream.consumer_config(),
+        )
+
     def start_event_loop(self):
         try:
             print("Starting NATS event loop...")
@@ -60,111 +258,111 @@ class NATSClient:
     def close(self):
         if self.connected:
             print("Closing NATS connection...")
-            asyncio.run_coroutine_threadsafe(self.nc.close(), self.loop)
+            asyncio.run_coroutine_threadsafe(self._flush_and_close(), self.loop)
             self.connected = False
             print("NATS connection closed.")
 
-# Define a callback function for the subscription
-async def message_handler(msg):
-    print("\n\n\nA message received\n\n\n")
-    try:
-        # Decode and parse the message as JSON
-        data = json.loads(msg.data.decode())
-        print(f"Received message on subject '{msg.subject}': {data}")
-
-        # Route message based on 'service' field
-        service = data.get("service")
-        if service == "matrix-login":
-            await handle_matrix_login(data)
-        elif service == "matrix-message":
-            await send_matrix_message(data)
-        else:
-            print(f"Unhandled service type: {service}")
-
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: Failed to decode message on '{msg.subject}': {msg.data.decode()}")
-    except Exception as e:
-        print(f"Unexpected error in message_handler: {e}")
+    async def _flush_and_close(self):
+        with self._buffer_changed:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            await self._publish_batch(batch)
+        await self.nc.close()
+
+    async def close_async(self):
+        if self.connected:
+            print("Closing NATS connection...")
+            await self.nc.close()
+            self.connected = False
+            print("NATS connection closed.")
 
 async def handle_matrix_login(data):
     print("Handling 'matrix-login' service...")
-    try:
-        # Extract the payload from the message
-        payload = data.get("payload", {})
-        if isinstance(payload, str):
-            # Replace single quotes with double quotes to make it JSON-compliant
-            payload = payload.replace("'", '"')
-            payload = json.loads(payload)
-        
-        # Extract username and password from the payload
-        username = payload.get("username")
-        password = payload.get("password")
-
-        if username and password:
-            print(f"Extracted credentials - Username: {username}, Password: {password}")
-            # Prepare the API request data
-            api_payload = {
-                "username": username,
-                "password": password
-            }
+    # Extract the payload from the message
+    payload = event_codec.parse_payload(data.get("payload", {}))
+    if not isinstance(payload, dict):
+        print(f"Invalid payload: {payload}")
+        return
+
+    # Extract username and password from the payload
+    username = payload.get("username")
+    password = payload.get("password")
 
-            # Use the reusable API request function
-            url = f"{matrix_gateway_url}/bots/add"
-            await send_api_request(url, api_payload)
-        else:
-            print("Invalid payload: Missing username or password.")
+    if username and password:
+        print(f"Extracted credentials - Username: {username}")
+        # Prepare the API request data
+        api_payload = {
+            "username": username,
+            "password": password
+        }
 
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError while parsing payload: {data.get('payload')}")
-    except Exception as e:
-        print(f"Unexpected error in handle_matrix_login: {e}")
+        # Use the reusable API request function
+        url = f"{matrix_gateway_url}/bots/add"
+        await send_api_request(url, api_payload)
+    else:
+        print("Invalid payload: Missing username or password.")
 
 
 async def send_api_request(url, payload, headers=None):
     """
     A reusable function to send an API request.
-    
+
+    Uses the session of the dispatcher, so connections to the matrix-gateway
+    are kept open between messages.
+
     Args:
         url (str): The API endpoint URL.
         payload (dict): The JSON payload to send in the request.
         headers (dict): The HTTP headers to include in the request.
-    
+
     Returns:
-        None
+        int: The status code of the response.
+
+    Raises:
+        PermanentError: The request was rejected with a 4xx, sending it again would not help.
+        RuntimeError: Any other error status, the request may succeed later.
     """
     if headers is None:
         headers = {"Content-Type": "application/json"}
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            print(f"Sending API request to {url} with payload: {payload}")
-            response = await session.post(url, json=payload, headers=headers)
-            if response.status == 200:
-                print(f"Request to {url} successful.")
-            else:
-                print(f"Failed to send request to {url}: {response.status} - {await response.text()}")
-        except Exception as e:
-            print(f"Error sending request to {url}: {e}")
+
+    print(f"Sending API request to {url}")
+    async with dispatcher.session.post(url, json=payload, headers=headers) as response:
+        # Read to the end, a connection with unread body is closed instead of reused
+        body = await response.text()
+        # matrix-gateway answers 202 for messages it sends in the background
+        if 400 <= response.status < 500 and response.status not in RETRY_STATUSES:
+            raise PermanentError(f"Request to {url} was rejected: {response.status} - {body}")
+        if response.status >= 300:
+            raise RuntimeError(f"Failed to send request to {url}: {response.status} - {body}")
+        print(f"Request to {url} successful.")
+        return response.status
 
 async def send_matrix_message(data):
     print("Handling 'matrix-message' service...")
-    try:
-        # Extract the payload from the message
-        payload = data.get("payload", {})
-        if isinstance(payload, str):
-            # Replace single quotes with double quotes to make it JSON-compliant
-            payload = payload.replace("'", '"')
-            try:
-                payload = json.loads(payload)
-            except json.JSONDecodeError as e:
-                print(f"Error parsing payload: {payload}")
-                raise e
-
-        # Send the payload to the API endpoint
-        url = f"{matrix_gateway_url}/messages/send"
-        await send_api_request(url, payload)
-
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError while parsing payload: {data.get('payload')} - Error: {e}")
-    except Exception as e:
-        print(f"Unexpected error in send_matrix_message: {e}")
+    # Extract the payload from the message
+    payload = event_codec.parse_payload(data.get("payload", {}))
+    if not isinstance(payload, dict):
+        print(f"Invalid payload: {payload}")
+        return
+
+    # The event id doubles as transaction id, so a redelivered event is not sent twice
+    payload.setdefault("txn_id", data.get("event_id"))
+
+    # Send the payload to the API endpoint
+    url = f"{matrix_gateway_url}/messages/send"
+    await send_api_request(url, payload)
+
+
+# Handlers of the messages received on send.matrix.message, by 'service' field
+HANDLERS = {
+    "matrix-login": handle_matrix_login,
+    "matrix-message": send_matrix_message,
+}
+
+dispatcher = MessageDispatcher(
+    HANDLERS, manual_ack=JETSTREAM_ENABLED, progress_interval=jetstream.PROGRESS_INTERVAL
+)
+
+# Define a callback function for the subscription
+async def message_handler(msg):
+    await dispatcher.submit(msg)
@@ -1,12 +1,13 @@
 import os
 from dotenv import load_dotenv
 import threading
-from flask import Flask, request, jsonify
-import requests
-from auth_svc import access
-from marketplace_svc import marketplace
+from flask import Flask, Response, request, jsonify, stream_with_context
+from auth_svc import access, token_verifier
+from marketplace_svc import marketplace, pagination
+from marketplace_svc.response_cache import response_cache
 from matrix_com.matrix_com import init_blueprint
-from nats_client.nats_client import NATSClient, message_handler
+from nats_client.nats_client import NATSClient, dispatcher, message_handler
+from upstream import upstream
 
 server = Flask(__name__)
 
@@ -26,6 +27,39 @@ def handle_error_response(error):
     return None
 
 
+def list_response(items, params):
+    page, next_cursor = pagination.paginate(items, params)
+    response = jsonify(page)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+
+def stream_response(path, key):
+    """Pass the list under key of the upstream body through, without decoding its items."""
+    upstream_response = marketplace.stream_collection(path)
+    # Error bodies go through as they are
+    unwrapper = pagination.EnvelopeUnwrapper(key) if upstream_response.status_code == 200 else None
+
+    def generate():
+        try:
+            for chunk in upstream_response.iter_content(chunk_size=pagination.STREAM_CHUNK_SIZE):
+                data = unwrapper.feed(chunk) if unwrapper else chunk
+                if data:
+                    yield data
+            tail = unwrapper.close() if unwrapper else b""
+            if tail:
+                yield tail
+        finally:
+            upstream_response.close()
+
+    return Response(
+        stream_with_context(generate()),
+        status=upstream_response.status_code,
+        content_type=upstream_response.headers.get("Content-Type", "application/json"),
+    )
+
+
 # Login route
 @server.route("/api/v1/login", methods=["POST"])
 def login():
@@ -83,9 +117,8 @@ def get_user(user_id):
 
     # Forward the request to user-service
     try:
-        user_service_url = f"http://user-service:5002/user/{user_id}"
         headers = {"Authorization": token}
-        response = requests.get(user_service_url, headers=headers)
+        response = upstream.user.get(f"/user/{user_id}", headers=headers)
         return jsonify(response.json()), response.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -112,10 +145,9 @@ def update_user(user_id):
 
     # Forward the request to user-service
     try:
-        user_service_url = f"http://user-service:5002/user/{user_id}"
         headers = {"Authorization": token, "Content-Type": "application/json"}
-        response = requests.put(
-            user_service_url, headers=headers, json=update_data
+        response = upstream.user.put(
+            f"/user/{user_id}", headers=headers, json=update_data
         )
 
         # Return the response from the user-service
@@ -140,9 +172,8 @@ def delete_user(user_id):
 
     # Forward the request to user-service
     try:
-        user_service_url = f"http://user-service:5002/user/{user_id}"
         headers = {"Authorization": token}
-        response = requests.delete(user_service_url, headers=headers)
+        response = upstream.user.delete(f"/user/{user_id}", headers=headers)
 
         # Return the response from the user-service
         return response.json()
@@ -163,11 +194,17 @@ def add_user():
 
 @server.route("/api/v1/users/", methods=["GET"])
 def get_users():
+    params, error = pagination.parse_list_params(request.args)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return stream_response("/users/", "users")
+
     users, error = marketplace.get_users()
     error_response = handle_error_response(error)
     if error_response:
         return error_response
-    return jsonify(users), 200
+    return list_response(users, params)
 
 
 @server.route("/api/v1/users/<username>", methods=["GET"])
@@ -201,11 +238,17 @@ def add_product():
 
 @server.route("/api/v1/products/", methods=["GET"])
 def get_products():
+    params, error = pagination.parse_list_params(request.args)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return stream_response("/products/", "products")
+
     products, error = marketplace.get_products()
     error_response = handle_error_response(error)
     if error_response:
         return error_response
-    return jsonify(products), 200
+    return list_response(products, params)
 
 
 @server.route("/api/v1/products/<int:product_id>", methods=["GET"])
@@ -248,11 +291,17 @@ def add_review():
 
 @server.route("/api/v1/reviews/", methods=["GET"])
 def get_reviews():
+    params, error = pagination.parse_list_params(request.args)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return stream_response("/reviews/", "reviews")
+
     reviews, error = marketplace.get_reviews()
     error_response = handle_error_response(error)
     if error_response:
         return error_response
-    return jsonify(reviews), 200
+    return list_response(reviews, params)
 
 
 @server.route("/api/v1/reviews/<int:product_id>", methods=["GET"])
@@ -276,11 +325,17 @@ def add_transaction():
 
 @server.route("/api/v1/transactions/", methods=["GET"])
 def get_all_transactions():
+    params, error = pagination.parse_list_params(request.args)
+    if error_response := handle_error_response(error):
+        return error_response
+    if params.stream:
+        return stream_response("/transactions/", "transactions")
+
     transactions, error = marketplace.get_all_transactions()
     error_response = handle_error_response(error)
     if error_response:
         return error_response
-    return jsonify(transactions), 200
+    return list_response(transactions, params)
 
 
 @server.route("/api/v1/transactions/<int:user_id>", methods=["GET"])
@@ -291,6 +346,33 @@ def get_user_transactions(user_id):
         return error_response
     return jsonify(transactions), 200
 
+
+# ------- Metrics Routes -------
+
+@server.route("/metrics/upstreams", methods=["GET"])
+def upstream_metrics():
+    return jsonify(upstream.get_stats()), 200
+
+
+@server.route("/metrics/verify", methods=["GET"])
+def verify_metrics():
+    return jsonify(access.batch_verifier.get_stats()), 200
+
+
+@server.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    return jsonify(response_cache.get_stats()), 200
+
+
+@server.route("/metrics/nats", methods=["GET"])
+def nats_metrics():
+    return jsonify(nats_client.get_publish_stats()), 200
+
+
+@server.route("/metrics/dispatcher", methods=["GET"])
+def dispatcher_metrics():
+    return jsonify(dispatcher.get_stats()), 200
+
 # Function to run Flask app
 def run_flask():
     print("Starting Flask API...")
@@ -303,8 +385,18 @@ def run_nats():
     nats_client.subscribe("send.matrix.message", message_handler)
     nats_client.start_event_loop()
 
-if __name__ == "__main__":
+# Function to run the async (ASGI) gateway, where the HTTP routes and NATS share one event loop
+def run_asgi():
+    import uvicorn
+    print("Starting ASGI API...")
+    uvicorn.run("asgi_server:app", host="0.0.0.0", port=8080)
+
+# Function to run Flask in a thread next to the NATS event loop
+def run_threaded():
     try:
+        # Keep the local revocation cache in sync with auth-service logouts
+        token_verifier.start_revocation_listener()
+
         # Start Flask in a separate thread
         flask_thread = threading.Thread(target=run_flask)
         flask_thread.daemon = True  # Ensure Flask thread exits with the main program
@@ -315,4 +407,10 @@ if __name__ == "__main__":
     finally:
         if nats_client.connected:
             print("Closing NATS connection...")
-            nats_client.close()
\ No newline at end of file
+            nats_client.close()
+
+if __name__ == "__main__":
+    if os.getenv("SERVER_MODE", "flask") == "asgi":
+        run_asgi()
+    else:
+        run_threaded()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+import aiohttp
+from upstream.upstream import IDEMPOTENT_METHODS, RETRY_STATUSES, upstreams as sync_upstreams
+
+
+class AsyncPoolStats:
+    """Same counters as upstream.PoolStats, fed by aiohttp trace hooks."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.misses = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(self._queued_start)
+        trace.on_connection_queued_end.append(self._queued_end)
+        trace.on_connection_create_end.append(self._created)
+        trace.on_connection_reuseconn.append(self._reused)
+        trace.on_request_exception.append(self._failed)
+        return trace
+
+    async def _queued_start(self, session, ctx, params):
+        ctx.queued_at = time.perf_counter()
+
+    async def _queued_end(self, session, ctx, params):
+        waited = time.perf_counter() - ctx.queued_at
+        ctx.queued_at = None
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+
+    async def _failed(self, session, ctx, params):
+        # Still queued, so the request timed out waiting for a free connection
+        if getattr(ctx, "queued_at", None) is not None and isinstance(params.exception, asyncio.TimeoutError):
+            self.timeouts += 1
+
+    async def _created(self, session, ctx, params):
+        self.checkouts += 1
+        self.misses += 1
+
+    async def _reused(self, session, ctx, params):
+        self.checkouts += 1
+
+    def snapshot(self):
+        hits = self.checkouts - self.misses
+        return {
+            "checkouts": self.checkouts,
+            "hits": hits,
+            "misses": self.misses,
+            "hit_ratio": hits / self.checkouts if self.checkouts else 0.0,
+            "wait_time_total": round(self.wait_time, 6),
+            "wait_time_max": round(self.max_wait_time, 6),
+            "timeouts": self.timeouts,
+        }
+
+
+class UpstreamResponse:
+    """Fully read upstream response, with the parts of requests.Response we use."""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncUpstreamClient:
+    """
+    Async counterpart of upstream.UpstreamClient for the ASGI server.
+
+    Every request is a coroutine on the server's event loop, so in-flight
+    upstream calls cost a socket instead of a thread. Like the sync client it
+    waits at most pool_timeout seconds for a free connection: aiohttp's
+    connect timeout covers the wait and opening the connection.
+    """
+
+    def __init__(self, name, base_url, pool_size=10, pool_timeout=5, connect_timeout=3.05,
+                 read_timeout=10, retries=2, backoff_factor=0.2):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            connect=pool_timeout + connect_timeout, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.stats = AsyncPoolStats()
+        self.session = None
+
+    @classmethod
+    def from_sync(cls, client):
+        """Reuse the configuration of a synchronous upstream client."""
+        return cls(
+            client.name,
+            client.base_url,
+            pool_size=client.pool_size,
+            pool_timeout=client.pool_timeout,
+            connect_timeout=client.timeout[0],
+            read_timeout=client.timeout[1],
+            retries=client.retries,
+            backoff_factor=client.backoff_factor,
+        )
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                # Shared by all users of the gateway, never keep cookies
+                cookie_jar=aiohttp.DummyCookieJar(),
+                trace_configs=[self.stats.trace_config()],
+            )
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    async def request(self, method, path, **kwargs):
+        if self.session is None:
+            await self.start()
+
+        retryable = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, self.url(path), **kwargs) as response:
+                    content = await response.read()
+                    if not (retryable and response.status in RETRY_STATUSES and attempt < self.retries):
+                        return UpstreamResponse(response.status, content, response.headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not retryable or attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    async def open_stream(self, method, path, **kwargs):
+        """Send a request and return the aiohttp response with its body still unread."""
+        if self.session is None:
+            await self.start()
+        return await self.session.request(method, self.url(path), **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats["pool_size"] = self.pool_size
+        return stats
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+upstreams = {
+    name: AsyncUpstreamClient.from_sync(client)
+    for name, client in sync_upstreams.items()
+}
+auth = upstreams["auth"]
+user = upstreams["user"]
+marketplace = upstreams["marketplace"]
+
+
+async def start_all():
+    for client in upstreams.values():
+        await client.start()
+
+
+async def close_all():
+    for client in upstreams.values():
+        await client.close()
+
+
+def get_stats():
+    return {name: client.get_stats() for name, client in upstreams.items()}
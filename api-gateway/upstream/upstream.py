@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+# Only these verbs are safe to send twice after a read error or a 5xx
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+RETRY_STATUSES = (502, 503, 504)
+
+
+class PoolStats:
+    """Counters for one upstream connection pool, used to size the pools."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.misses = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def connection_created(self, connect_time):
+        # Called from inside the checkout on the same thread
+        self._local.connect_time = getattr(self._local, "connect_time", 0.0) + connect_time
+        with self._lock:
+            self.misses += 1
+
+    def connection_checked_out(self, elapsed):
+        waited = max(elapsed - getattr(self._local, "connect_time", 0.0), 0.0)
+        self._local.connect_time = 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+    def checkout_timed_out(self):
+        self._local.connect_time = 0.0
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            hits = self.checkouts - self.misses
+            return {
+                "checkouts": self.checkouts,
+                "hits": hits,
+                "misses": self.misses,
+                "hit_ratio": hits / self.checkouts if self.checkouts else 0.0,
+                "wait_time_total": round(self.wait_time, 6),
+                "wait_time_max": round(self.max_wait_time, 6),
+                "timeouts": self.timeouts,
+            }
+
+
+def _instrumented_pool_class(base, stats, pool_timeout):
+    class InstrumentedPool(base):
+        def _get_conn(self, timeout=None):
+            # requests never passes a timeout, without one a full pool blocks forever
+            if timeout is None:
+                timeout = pool_timeout
+            start = time.perf_counter()
+            try:
+                conn = super()._get_conn(timeout)
+            except EmptyPoolError:
+                stats.checkout_timed_out()
+                raise
+            stats.connection_checked_out(time.perf_counter() - start)
+            return conn
+
+        def _new_conn(self):
+            start = time.perf_counter()
+            conn = super()._new_conn()
+            stats.connection_created(time.perf_counter() - start)
+            return conn
+
+    return InstrumentedPool
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats, pool_timeout, **kwargs):
+        self.stats = stats
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _instrumented_pool_class(HTTPConnectionPool, self.stats, self.pool_timeout),
+            "https": _instrumented_pool_class(HTTPSConnectionPool, self.stats, self.pool_timeout),
+        }
+
+
+class UpstreamClient:
+    """
+    Keep-alive HTTP client for one backend service.
+
+    All gateway threads share the same connection pool; when it is exhausted
+    callers wait for a free connection instead of opening extra sockets, for
+    at most pool_timeout seconds before the request fails with a
+    requests ConnectionError.
+    """
+
+    def __init__(
+        self,
+        name,
+        base_url,
+        pool_size=10,
+        pool_timeout=5,
+        connect_timeout=3.05,
+        read_timeout=10,
+        retries=2,
+        backoff_factor=0.2,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.stats = PoolStats()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            allowed_methods=IDEMPOTENT_METHODS,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = InstrumentedHTTPAdapter(
+            self.stats,
+            pool_timeout,
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        # The session is shared by all users of the gateway, never keep cookies
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            return self.session.request(method, self.url(path), **kwargs)
+        except EmptyPoolError as e:
+            raise requests.ConnectionError(e) from e
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats["pool_size"] = self.pool_size
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+def _base_url(address, path=""):
+    if not address.startswith("http"):
+        address = f"http://{address}"
+    return f"{address.rstrip('/')}{path}"
+
+
+def from_env(name, address_var, default_address, path=""):
+    """Build an upstream client configured by <NAME>_SVC_* environment variables."""
+    prefix = f"{name.upper()}_SVC"
+    return UpstreamClient(
+        name,
+        _base_url(os.getenv(address_var, default_address), path),
+        pool_size=int(os.getenv(f"{prefix}_POOL_SIZE", 10)),
+        pool_timeout=float(os.getenv(f"{prefix}_POOL_TIMEOUT", 5)),
+        connect_timeout=float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", 3.05)),
+        read_timeout=float(os.getenv(f"{prefix}_TIMEOUT", 10)),
+        retries=int(os.getenv(f"{prefix}_RETRIES", 2)),
+        backoff_factor=float(os.getenv("UPSTREAM_BACKOFF_FACTOR", 0.2)),
+    )
+
+
+auth = from_env("auth", "AUTH_SVC_ADDRESS", "auth-service:5000")
+user = from_env("user", "USER_SVC_ADDRESS", "user-service:5002")
+marketplace = from_env("marketplace", "MARKETPLACE_SVC_ADDRESS", "marketplace-service:5001", "/api")
+
+upstreams = {
+    "auth": auth,
+    "user": user,
+    "marketplace": marketplace,
+}
+
+
+def get_stats():
+    return {name: client.get_stats() for name, client in upstreams.items()}
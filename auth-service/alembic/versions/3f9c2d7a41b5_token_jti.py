@@ -0,0 +1,66 @@
+"""Key tokens by jti
+
+Revision ID: 3f9c2d7a41b5
+Revises: 16ded13136a6
+Create Date: 2026-10-18 10:12:31.504218
+
+"""
+import base64
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d7a41b5'
+down_revision: Union[str, None] = '16ded13136a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _jti(token: str):
+    # Read the jti claim of a stored JWT, the signature was checked when it was issued
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get('jti')
+    except (IndexError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    op.add_column('tokens', sa.Column('jti', sa.String(length=36), nullable=True))
+    op.add_column('tokens', sa.Column('revoked_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_tokens_jti'), 'tokens', ['jti'], unique=True)
+    op.create_index(op.f('ix_tokens_revoked_at'), 'tokens', ['revoked_at'], unique=False)
+    op.alter_column('tokens', 'token', existing_type=sa.String(length=512), nullable=True)
+
+    # Fill in the jti of the tokens that are still valid, so the stateless
+    # mode knows about their revocations right after the upgrade
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT id, token, revoked FROM tokens WHERE expires_at > now() AND token IS NOT NULL"
+    )).fetchall()
+    for token_id, token, revoked in rows:
+        jti = _jti(token)
+        if jti is None:
+            continue
+        conn.execute(
+            sa.text(
+                "UPDATE tokens SET jti = :jti, "
+                "revoked_at = CASE WHEN :revoked THEN now() ELSE NULL END WHERE id = :id"
+            ),
+            {"jti": jti, "revoked": bool(revoked), "id": token_id},
+        )
+
+
+def downgrade() -> None:
+    # Tokens issued in the stateless mode have no token text to go back to
+    op.execute("DELETE FROM tokens WHERE token IS NULL")
+    op.alter_column('tokens', 'token', existing_type=sa.String(length=512), nullable=False)
+    op.drop_index(op.f('ix_tokens_revoked_at'), table_name='tokens')
+    op.drop_index(op.f('ix_tokens_jti'), table_name='tokens')
+    op.drop_column('tokens', 'revoked_at')
+    op.drop_column('tokens', 'jti')
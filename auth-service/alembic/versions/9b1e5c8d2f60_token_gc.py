@@ -0,0 +1,111 @@
+"""Index token expiry, optionally partition tokens by day
+
+Revision ID: 9b1e5c8d2f60
+Revises: 3f9c2d7a41b5
+Create Date: 2026-10-18 21:05:47.118390
+
+The expires_at index is what the batched deletes of token_gc.py use. The
+partitioned layout is opt-in, and Postgres only:
+
+    alembic -x partition_tokens=true upgrade head
+
+It replaces the tokens table by one partitioned by day on expires_at, so
+token_gc.py can drop whole days of expired tokens instead of deleting
+them row by row. Only the tokens that have not expired are copied over.
+The unique indexes on token and jti have to include expires_at, the
+partition key.
+
+"""
+from datetime import date, timedelta
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b1e5c8d2f60'
+down_revision: Union[str, None] = '3f9c2d7a41b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same default as TOKEN_PARTITIONS_AHEAD, token_gc.py creates the later ones
+PARTITIONS_AHEAD = 3
+
+
+def _partitioned(conn) -> bool:
+    return conn.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('tokens')"
+    )).first() is not None
+
+
+def _swap_table(conn, create_sql):
+    # Rows are copied before the old table (and its index names) are dropped,
+    # the id sequence moves over to the new table first
+    op.execute("ALTER TABLE tokens RENAME TO tokens_old")
+    op.execute(create_sql)
+    return conn.execute(sa.text("SELECT pg_get_serial_sequence('tokens_old', 'id')")).scalar()
+
+
+def _finish_swap(sequence):
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY tokens.id")
+    op.execute("DROP TABLE tokens_old")
+    op.execute(
+        "ALTER TABLE tokens ADD CONSTRAINT tokens_user_id_fkey "
+        "FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE"
+    )
+    op.create_index(op.f('ix_tokens_id'), 'tokens', ['id'], unique=False)
+    op.create_index(op.f('ix_tokens_revoked_at'), 'tokens', ['revoked_at'], unique=False)
+    op.create_index(op.f('ix_tokens_expires_at'), 'tokens', ['expires_at'], unique=False)
+
+
+def partition_tokens(conn):
+    sequence = _swap_table(
+        conn,
+        "CREATE TABLE tokens (LIKE tokens_old INCLUDING DEFAULTS) PARTITION BY RANGE (expires_at)",
+    )
+    last = conn.execute(sa.text("SELECT max(expires_at) FROM tokens_old")).scalar()
+    today = date.today()
+    days = max((last.date() - today).days if last else 0, 0) + PARTITIONS_AHEAD
+    for offset in range(days + 1):
+        day = today + timedelta(days=offset)
+        op.execute(
+            f"CREATE TABLE tokens_p{day:%Y%m%d} PARTITION OF tokens "
+            f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+        )
+    # Tokens that expire beyond the partitions token_gc.py has created
+    op.execute("CREATE TABLE tokens_default PARTITION OF tokens DEFAULT")
+    op.execute("INSERT INTO tokens SELECT * FROM tokens_old WHERE expires_at > now()")
+    _finish_swap(sequence)
+    op.execute("ALTER TABLE tokens ADD PRIMARY KEY (id, expires_at)")
+    op.create_index(op.f('ix_tokens_token'), 'tokens', ['token', 'expires_at'], unique=True)
+    op.create_index(op.f('ix_tokens_jti'), 'tokens', ['jti', 'expires_at'], unique=True)
+
+
+def unpartition_tokens(conn):
+    sequence = _swap_table(conn, "CREATE TABLE tokens (LIKE tokens_old INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO tokens SELECT * FROM tokens_old")
+    # Dropping the partitioned table drops its partitions too
+    _finish_swap(sequence)
+    op.execute("ALTER TABLE tokens ALTER COLUMN expires_at DROP NOT NULL")
+    op.execute("ALTER TABLE tokens ADD PRIMARY KEY (id)")
+    op.create_index(op.f('ix_tokens_token'), 'tokens', ['token'], unique=True)
+    op.create_index(op.f('ix_tokens_jti'), 'tokens', ['jti'], unique=True)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    partition = context.get_x_argument(as_dictionary=True).get('partition_tokens', '').lower()
+    if partition in ('1', 'true', 'yes') and conn.dialect.name == 'postgresql':
+        if not _partitioned(conn):
+            partition_tokens(conn)
+        return
+    op.create_index(op.f('ix_tokens_expires_at'), 'tokens', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql' and _partitioned(conn):
+        unpartition_tokens(conn)
+    op.drop_index(op.f('ix_tokens_expires_at'), table_name='tokens')
@@ -1,38 +1,83 @@
-import bcrypt
 from flask import Flask, request, jsonify
+from jwt import ExpiredSignatureError, InvalidTokenError
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
+    decode_token,
+    get_jti,
+    get_jwt,
     get_jwt_identity,
     jwt_required
 )
-from database import get_db
+from flask_jwt_extended.exceptions import JWTExtendedException
+from database import get_db, close_db, get_pool_stats
 from crud import (
     create_user,
     get_user_by_username,
+    update_password_hash,
     create_token,
     get_token,
+    get_token_by_jti,
+    get_tokens_by_jti,
+    get_tokens_by_text,
     revoke_token
 )
 from database import engine
 from models import Base
+from config import Config
+from revocation import publish_revocation, revocation_set
+from hashing import hash_pool, HashPoolFull, HashTimeout
+from token_gc import token_compactor
 
 
 app = Flask(__name__)
-app.config['JWT_SECRET_KEY'] = "your_jwt_secret_key"
+# The API gateway verifies tokens locally, so it must share this key
+app.config['JWT_SECRET_KEY'] = Config.JWT_SECRET_KEY
 jwt = JWTManager(app)
+# Every request gets one session, returned to the pool when the request ends
+app.teardown_appcontext(close_db)
 
 Base.metadata.create_all(bind=engine)
 
+STATELESS = Config.VERIFY_MODE == "stateless"
+if STATELESS:
+    revocation_set.start()
+token_compactor.start()
+
+
+# Only in the stateless mode, the db mode checks the tokens table in /verify
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    return STATELESS and revocation_set.is_revoked(jwt_payload["jti"])
+
+
+@jwt.revoked_token_loader
+def revoked_token_response(jwt_header, jwt_payload):
+    return jsonify({"msg": "Token invalid or revoked"}), 401
+
+
+# All password hash workers are busy and the queue is full, the client can retry
+@app.errorhandler(HashPoolFull)
+def hash_pool_full(e):
+    return jsonify({"msg": "Too many login attempts, try again"}), 429, {"Retry-After": "1"}
+
+
+# The hash waited HASH_TIMEOUT for a worker or ran that long
+@app.errorhandler(HashTimeout)
+def hash_timeout(e):
+    return jsonify({"msg": "Password check timed out, try again"}), 503, {"Retry-After": "1"}
+
 
 # Register route
 @app.route("/register", methods=["POST"])
 def register():
     data = request.json
-    db = next(get_db())
+    db = get_db()
 
     if get_user_by_username(db, data['username']):
         return jsonify({"msg": "User already exists"}), 400
+    # End the read, the connection goes back to the pool during the hash
+    db.rollback()
 
     user = create_user(db, data['username'], data['password'])
     return jsonify({
@@ -47,27 +92,58 @@ def login():
     if not auth or not auth.username or not auth.password:
         return jsonify({"msg": "Missing credentials"}), 401
 
-    db = next(get_db())
+    db = get_db()
     user = get_user_by_username(db, auth.username)
-
-    if user and bcrypt.checkpw(
-        auth.password.encode('utf-8'),
-        user.password.encode('utf-8')
-    ):
+    hashed = user.password if user else None
+    # End the read, the connection goes back to the pool during the hash
+    db.rollback()
+
+    if user and hash_pool.check_password(auth.password, hashed):
+        if hash_pool.needs_rehash(hashed):
+            # Hashed with an older BCRYPT_ROUNDS, the password is known now
+            try:
+                update_password_hash(db, user, auth.password)
+            except (HashPoolFull, HashTimeout):
+                pass  # Next login
         access_token = create_access_token(
             identity={"username": user.username, "user_id": user.id}
         )
-        create_token(db, access_token, user.id)
+        # The stateless mode only needs the jti to revoke the token
+        create_token(
+            db,
+            None if STATELESS else access_token,
+            user.id,
+            jti=get_jti(access_token)
+        )
         return jsonify(access_token=access_token), 200
 
     return jsonify({"msg": "Bad username or password"}), 401
 
 
+@app.route("/metrics/hashing", methods=["GET"])
+def hashing_metrics():
+    return jsonify(hash_pool.get_stats()), 200
+
+
+@app.route("/metrics/tokens", methods=["GET"])
+def token_metrics():
+    return jsonify(token_compactor.get_stats()), 200
+
+
+@app.route("/metrics/db", methods=["GET"])
+def db_metrics():
+    return jsonify(get_pool_stats()), 200
+
+
 # Verify token
 @app.route("/verify", methods=["POST"])
 @jwt_required()
 def verify_token():
-    db = next(get_db())
+    if STATELESS:
+        # Signature, expiry and revocation are checked by jwt_required
+        return jsonify(get_jwt_identity()), 200
+
+    db = get_db()
     token_str = request.headers.get("Authorization").split(" ")[1]
     token = get_token(db, token_str)
 
@@ -77,15 +153,76 @@ def verify_token():
     return jsonify(get_jwt_identity()), 200
 
 
+# Verify many tokens with one lookup of their jti's (and one of the token
+# text for rows stored without a jti), the results are in the order of the
+# tokens: {"identity": ...} or {"msg": ..., "status": 401}
+@app.route("/verify/batch", methods=["POST"])
+def verify_tokens():
+    data = request.get_json(silent=True) or {}
+    tokens = data.get("tokens")
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        return jsonify({"msg": "tokens must be a list of strings"}), 400
+    if len(tokens) > Config.VERIFY_BATCH_MAX:
+        return jsonify({"msg": f"At most {Config.VERIFY_BATCH_MAX} tokens per batch"}), 413
+
+    results = []
+    decoded = {}  # index in tokens -> (token, claims), of the tokens with a valid signature
+    for index, token in enumerate(tokens):
+        if token.startswith("Bearer "):
+            token = token.split(" ", 1)[1]
+        try:
+            claims = decode_token(token)
+        except ExpiredSignatureError:
+            results.append({"msg": "Token has expired", "status": 401})
+            continue
+        except (InvalidTokenError, JWTExtendedException):
+            results.append({"msg": "Token verification failed", "status": 401})
+            continue
+        if claims.get("type") != "access":
+            results.append({"msg": "Token verification failed", "status": 401})
+            continue
+        decoded[index] = (token, claims)
+        results.append(None)
+
+    if STATELESS:
+        valid = {index for index, (_, claims) in decoded.items() if not revocation_set.is_revoked(claims["jti"])}
+    else:
+        db = get_db()
+        by_jti = {row.jti: row for row in get_tokens_by_jti(db, {claims["jti"] for _, claims in decoded.values()})}
+        # Tokens issued before the jti was stored are only found by their text
+        legacy = {token for token, claims in decoded.values() if claims["jti"] not in by_jti}
+        by_text = {row.token: row for row in get_tokens_by_text(db, legacy)}
+        valid = set()
+        for index, (token, claims) in decoded.items():
+            row = by_jti.get(claims["jti"]) or by_text.get(token)
+            if row is not None and not row.revoked:
+                valid.add(index)
+
+    for index, (_, claims) in decoded.items():
+        if index not in valid:
+            results[index] = {"msg": "Token invalid or revoked", "status": 401}
+        else:
+            # The identity claim, as get_jwt_identity reads it
+            results[index] = {"identity": claims["sub"]}
+    return jsonify({"results": results}), 200
+
+
 # Logout (Revoke token)
 @app.route("/logout", methods=["POST"])
 @jwt_required()
 def logout():
-    db = next(get_db())
+    db = get_db()
+    claims = get_jwt()
     token_str = request.headers.get("Authorization").split(" ")[1]
-    token = get_token(db, token_str)
+    # Tokens issued before the jti was stored are only found by their text
+    token = get_token_by_jti(db, claims["jti"]) or get_token(db, token_str)
     if token:
-        revoke_token(db, token)
+        revoke_token(db, token, jti=claims["jti"])
+        revocation_set.add(claims["jti"], claims["exp"])
+        try:
+            publish_revocation(claims["jti"], claims["exp"])
+        except Exception as e:
+            print(f"Failed to publish revocation for {claims['jti']}: {e}")
         return jsonify({"msg": "Token revoked successfully"}), 200
     return jsonify({"msg": "Token not found"}), 404
 
@@ -0,0 +1,94 @@
+"""
+Login throughput of the password check per bcrypt cost factor.
+
+Simulates the request threads of the Flask server: threads concurrent
+logins check a password for duration seconds, once inline on the request
+threads (the old login) and once through the hash pool. Next to them one
+thread does a cheap request (a few microseconds of work) every 10ms and
+records how late it is, like /verify waiting behind the logins. Logins
+refused by a full pool (429) are counted separately.
+
+Needs bcrypt only, not the database.
+
+    python benchmarks/bench_login_throughput.py [threads] [duration] [costs, e.g. 4,8,10,12]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from hashing import HashPool, HashPoolFull
+
+PASSWORD = "correct horse battery staple"
+
+
+def cheap_request_delays(stop):
+    """Lateness in ms of a request due every 10ms."""
+    delays = []
+    while not stop.is_set():
+        due = time.perf_counter() + 0.01
+        time.sleep(0.01)
+        delays.append((time.perf_counter() - due) * 1000)
+    return delays
+
+
+def measure(check, threads, duration):
+    stop = threading.Event()
+    counts = {"ok": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    def login():
+        while not stop.is_set():
+            try:
+                check()
+                outcome = "ok"
+            except HashPoolFull:
+                outcome = "rejected"
+                time.sleep(0.001)
+            with lock:
+                counts[outcome] += 1
+
+    delays = []
+    workers = [threading.Thread(target=login) for _ in range(threads)]
+    probe = threading.Thread(target=lambda: delays.extend(cheap_request_delays(stop)))
+    for thread in workers + [probe]:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in workers + [probe]:
+        thread.join()
+
+    delays.sort()
+    p99 = delays[int(len(delays) * 0.99) - 1] if delays else 0.0
+    return counts["ok"] / duration, counts["rejected"], statistics.median(delays), p99
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    costs = [int(cost) for cost in sys.argv[3].split(",")] if len(sys.argv) > 3 else [4, 8, 10, 12]
+    workers = os.cpu_count() or 1
+
+    print(f"{threads} login threads, {duration:.0f}s per run, {workers} hash workers, queue limit {threads // 2}")
+    for cost in costs:
+        hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(cost)).decode()
+        inline = HashPool(workers=0, rounds=cost)
+        pool = HashPool(workers=workers, queue_limit=threads // 2, rounds=cost)
+        pool.check_password(PASSWORD, hashed)  # Start the workers
+        for name, hash_pool in (("inline", inline), ("pool", pool)):
+            logins, rejected, p50, p99 = measure(
+                lambda: hash_pool.check_password(PASSWORD, hashed), threads, duration,
+            )
+            print(
+                f"cost {cost:>2} {name:<6} {logins:8.1f} logins/s  {rejected:6d} refused  "
+                f"cheap request late by p50 {p50:.2f}ms p99 {p99:.2f}ms"
+            )
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Token lookup latency against the size of the tokens table.
+
+Fills the tokens table with rows, of which expired_share expired long
+ago, and times get_token_by_jti / get_token on live tokens and
+create_token (an insert into the unique indexes). Then deletes the stale
+rows with the compaction job of token_gc.py and times the same again.
+
+Runs against DATABASE_URL, by default a new SQLite file. The table is
+emptied first, so do not point it at a real database.
+
+    python benchmarks/bench_token_lookup.py [sizes, e.g. 10000,100000,1000000] [expired share] [lookups]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_tokens.db")
+
+from sqlalchemy import insert
+from crud import create_token, get_token, get_token_by_jti
+from database import SessionLocal, engine
+from models import Base, Token, User
+from token_gc import TokenCompactor
+
+INSERT_BATCH = 10000
+
+
+def fill(db, user_id, size, expired_share):
+    """Add size rows, returns the (token, jti) of the live ones."""
+    now = datetime.now()
+    live = []
+    for start in range(0, size, INSERT_BATCH):
+        rows = []
+        for i in range(start, min(start + INSERT_BATCH, size)):
+            jti = str(uuid.uuid4())
+            expired = i < size * expired_share
+            row = {
+                "token": f"bench.{jti}.{'x' * 200}",
+                "jti": jti,
+                "user_id": user_id,
+                "issued_at": now,
+                "expires_at": now + (timedelta(days=-2) if expired else timedelta(hours=1)),
+                "revoked": False,
+            }
+            rows.append(row)
+            if not expired:
+                live.append((row["token"], jti))
+        db.execute(insert(Token), rows)
+        db.commit()
+    return live
+
+
+def percentiles(samples):
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def time_lookups(db, user_id, live, lookups):
+    timings = {"by jti": [], "by token": [], "insert": []}
+    step = max(len(live) // lookups, 1)
+    for token, jti in live[::step][:lookups]:
+        started = time.perf_counter()
+        get_token_by_jti(db, jti)
+        timings["by jti"].append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        get_token(db, token)
+        timings["by token"].append((time.perf_counter() - started) * 1000)
+    for _ in range(lookups):
+        jti = str(uuid.uuid4())
+        started = time.perf_counter()
+        create_token(db, f"bench.{jti}", user_id, jti=jti)
+        timings["insert"].append((time.perf_counter() - started) * 1000)
+    return {name: percentiles(samples) for name, samples in timings.items()}
+
+
+def report(label, rows, timings):
+    line = "  ".join(f"{name} p50 {p50:.3f}ms p99 {p99:.3f}ms" for name, (p50, p99) in timings.items())
+    print(f"{label:<8} {rows:>9} rows  {line}")
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    expired_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.9
+    lookups = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+    Base.metadata.create_all(bind=engine)
+    print(f"{engine.url.render_as_string(hide_password=True)}, {expired_share:.0%} expired, {lookups} lookups")
+    compactor = TokenCompactor(interval=0, batch_size=5000, max_batches=10 ** 6, batch_pause=0)
+    for size in sizes:
+        db = SessionLocal()
+        try:
+            db.query(Token).delete()
+            db.query(User).filter(User.username == "bench").delete()
+            db.commit()
+            user = User(username="bench", password="-")
+            db.add(user)
+            db.commit()
+
+            live = fill(db, user.id, size, expired_share)
+            report("before", db.query(Token).count(), time_lookups(db, user.id, live, lookups))
+
+            started = time.perf_counter()
+            deleted = compactor.compact()
+            print(f"compacted, {deleted} rows deleted in {time.perf_counter() - started:.1f}s")
+            report("after", db.query(Token).count(), time_lookups(db, user.id, live, lookups))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Load test of the database connection pools of auth-service and user-service.
+
+Logs a test user in, then keeps threads sending /verify to auth-service and
+GET /user/<id> to user-service for a while. Every few seconds it reads
+/metrics/db of both services and prints the connections checked out, in
+overflow and open. With request-scoped sessions the open connections stay
+within pool_size + max_overflow and stop growing once the pool is warm,
+however long the test runs.
+
+    python benchmarks/load_test_db_pool.py [threads] [duration] [auth url] [user url]
+"""
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+AUTH_URL = "http://localhost:5000"
+USER_URL = "http://localhost:5002"
+PASSWORD = "loadtestpassword"
+SAMPLE_INTERVAL = 2
+
+
+def login(auth_url):
+    """Register and log in a new user, returns (user_id, token)."""
+    username = f"loadtest-{uuid.uuid4().hex[:8]}"
+    response = requests.post(f"{auth_url}/register", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    user_id = response.json()["user_id"]
+    response = requests.post(f"{auth_url}/login", auth=(username, PASSWORD))
+    response.raise_for_status()
+    return user_id, response.json()["access_token"]
+
+
+def send_requests(auth_url, user_url, user_id, token, stop, counts, lock):
+    session = requests.Session()
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        for method, url in (("POST", f"{auth_url}/verify"), ("GET", f"{user_url}/user/{user_id}")):
+            try:
+                ok = session.request(method, url, headers=headers, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                counts["ok" if ok else "errors"] += 1
+
+
+def pool_stats(url):
+    try:
+        return requests.get(f"{url}/metrics/db", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def describe(stats):
+    if stats is None:
+        return f"{'unavailable':<36}"
+    line = f"out {stats['checked_out']:>3} overflow {stats['overflow']:>3} open {stats['connections_open']:>3}"
+    # Only auth-service times its checkouts
+    if "wait_time_max_ms" in stats:
+        line += f" wait max {stats['wait_time_max_ms']:>7.1f}ms"
+    return f"{line:<36}"
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    auth_url = sys.argv[3] if len(sys.argv) > 3 else AUTH_URL
+    user_url = sys.argv[4] if len(sys.argv) > 4 else USER_URL
+
+    user_id, token = login(auth_url)
+    stop = threading.Event()
+    counts = {"ok": 0, "errors": 0}
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(target=send_requests, args=(auth_url, user_url, user_id, token, stop, counts, lock))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+
+    print(f"{threads} threads for {duration:.0f}s against {auth_url} and {user_url}")
+    samples = []
+    started = time.time()
+    done = 0
+    while time.time() - started < duration:
+        time.sleep(SAMPLE_INTERVAL)
+        with lock:
+            total = counts["ok"] + counts["errors"]
+            rate, done = (total - done) / SAMPLE_INTERVAL, total
+            errors = counts["errors"]
+        auth, user = pool_stats(auth_url), pool_stats(user_url)
+        samples.append((auth, user))
+        print(
+            f"{time.time() - started:5.0f}s {rate:7.0f} req/s {errors:5d} errors  "
+            f"auth {describe(auth)}  user {describe(user)}"
+        )
+
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    # Overflow connections are opened and closed as the load goes up and down,
+    # a leak shows as open connections that keep growing or pass the pool limit
+    for name, index in (("auth-service", 0), ("user-service", 1)):
+        stats = [sample[index] for sample in samples if sample[index]]
+        if len(stats) < 2:
+            print(f"{name}: not enough samples")
+            continue
+        limit = stats[-1]["pool_size"] + stats[-1]["max_overflow"]
+        half = len(stats) // 2
+        first, second = max(s["connections_open"] for s in stats[:half]), max(s["connections_open"] for s in stats[half:])
+        flat = second <= first and second <= limit
+        print(
+            f"{name}: at most {first} open connections in the first half, {second} in the second "
+            f"(limit {limit}), {'flat' if flat else 'GROWING'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
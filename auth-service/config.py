@@ -22,3 +22,30 @@ class Config:
     POSTGRES_DB = os.getenv('POSTGRES_DB', 'auth_db')
     POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'postgres')
     POSTGRES_PORT = os.getenv('POSTGRES_PORT', 5432)
+    REDIS_URL = os.getenv('REDIS_URL')
+    REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+    REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+    # Password hashing, see hashing.py
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+    HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', 32))
+    HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+    # "db" looks every token up in the tokens table on /verify, "stateless"
+    # only checks the signature and an in-memory set of revoked jti's
+    VERIFY_MODE = os.getenv('VERIFY_MODE', 'db')
+    # Most tokens one /verify/batch call may check
+    VERIFY_BATCH_MAX = int(os.getenv('VERIFY_BATCH_MAX', 100))
+    REVOCATION_REFRESH_INTERVAL = float(os.getenv('REVOCATION_REFRESH_INTERVAL', 5))
+    # Deleting expired and revoked tokens, see token_gc.py (interval 0 turns it off)
+    TOKEN_GC_INTERVAL = float(os.getenv('TOKEN_GC_INTERVAL', 300))
+    TOKEN_GC_BATCH_SIZE = int(os.getenv('TOKEN_GC_BATCH_SIZE', 1000))
+    TOKEN_GC_MAX_BATCHES = int(os.getenv('TOKEN_GC_MAX_BATCHES', 100))
+    TOKEN_GC_BATCH_PAUSE = float(os.getenv('TOKEN_GC_BATCH_PAUSE', 0.05))
+    TOKEN_GC_GRACE = int(os.getenv('TOKEN_GC_GRACE', 300))
+    TOKEN_PARTITIONS_AHEAD = int(os.getenv('TOKEN_PARTITIONS_AHEAD', 3))
+    # Connection pool of the database engine, see database.py
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
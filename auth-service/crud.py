@@ -1,15 +1,15 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from models import User, Token
-import bcrypt
+from sqlalchemy import Table, delete, or_, select
 from sqlalchemy.orm import Session
 from config import Config
+from hashing import hash_pool
 
 
-# Hash password
+# Hash password, in the worker processes of the hash pool
 def get_password_hash(password: str) -> str:
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    return hashed.decode('utf-8')
+    return hash_pool.hash_password(password)
 
 
 # Register a new user
@@ -22,19 +22,28 @@ def create_user(db: Session, username: str, password: str) -> User:
     return new_user
 
 
+# Store a new hash of the same password, made with the current cost
+def update_password_hash(db: Session, user: User, password: str) -> User:
+    user.password = get_password_hash(password)
+    db.commit()
+    return user
+
+
 # Get user by username
 def get_user_by_username(db: Session, username: str) -> Optional[User]:
     return db.query(User).filter(User.username == username).first()
 
 
-# Create a new token
+# Create a new token, access_token is None when only the jti is stored
 def create_token(
     db: Session,
-    access_token: str,
+    access_token: Optional[str],
     user_id: int,
+    jti: Optional[str] = None,
 ) -> Token:
     new_token = Token(
         token=access_token,
+        jti=jti,
         user_id=user_id,
         expires_at=datetime.now() + timedelta(
             minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES
@@ -51,9 +60,71 @@ def get_token(db: Session, token_str: str) -> Optional[Token]:
     return db.query(Token).filter(Token.token == token_str).first()
 
 
+# Get token by its jti claim
+def get_token_by_jti(db: Session, jti: str) -> Optional[Token]:
+    return db.query(Token).filter(Token.jti == jti).first()
+
+
+# Get the tokens of many jti's in one query
+def get_tokens_by_jti(db: Session, jtis) -> list:
+    if not jtis:
+        return []
+    return db.query(Token).filter(Token.jti.in_(list(jtis))).all()
+
+
+# Get the tokens of many token strings in one query
+def get_tokens_by_text(db: Session, tokens) -> list:
+    if not tokens:
+        return []
+    return db.query(Token).filter(Token.token.in_(list(tokens))).all()
+
+
 # Revoke token
-def revoke_token(db: Session, token: Token):
+def revoke_token(db: Session, token: Token, jti: Optional[str] = None):
     token.revoked = True
+    token.revoked_at = datetime.now()
+    if jti and not token.jti:
+        token.jti = jti
     db.commit()
     db.refresh(token)
     return token
+
+
+# Revocations of tokens that have not expired yet, revoked at or after since
+def get_revocations_since(db: Session, since: Optional[datetime] = None):
+    query = db.query(Token.jti, Token.expires_at, Token.revoked_at).filter(
+        Token.revoked_at.isnot(None),
+        Token.jti.isnot(None),
+        Token.expires_at > datetime.now(),
+    )
+    if since is not None:
+        query = query.filter(Token.revoked_at >= since)
+    return query.all()
+
+
+# Delete at most batch_size tokens that expired before expired_before or were
+# revoked before revoked_before (None skips that condition), returns the count.
+# table is the tokens table by default, or one of its partitions
+def delete_stale_tokens(
+    db: Session,
+    batch_size: int,
+    expired_before: Optional[datetime] = None,
+    revoked_before: Optional[datetime] = None,
+    table: Optional[Table] = None,
+) -> int:
+    table = Token.__table__ if table is None else table
+    conditions = []
+    if expired_before is not None:
+        conditions.append(table.c.expires_at < expired_before)
+    if revoked_before is not None:
+        conditions.append(table.c.revoked_at < revoked_before)
+    if not conditions:
+        return 0
+
+    # Picked by id first, so one batch never locks more than batch_size rows
+    ids = db.execute(select(table.c.id).where(or_(*conditions)).limit(batch_size)).scalars().all()
+    if not ids:
+        return 0
+    deleted = db.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+    db.commit()
+    return deleted
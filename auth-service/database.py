@@ -1,15 +1,104 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from flask import g
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from config import Config
 
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that also counts the connections it opened, how long
+    checkouts took and the checkouts that timed out.
+
+    A checkout takes an idle connection, opens a new one while fewer than
+    pool_size + max_overflow are checked out, and otherwise waits for one
+    to be returned, for at most pool_timeout seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+
+    def count(self, name: str):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            # Not a checkout, its wait would only show pool_timeout in the averages
+            self.count("timeouts")
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return connection
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "connections_open": self.connections_opened - self.connections_closed,
+                "connections_opened": self.connections_opened,
+                "connections_closed": self.connections_closed,
+                "checkouts": self.checkouts,
+                "wait_time_avg_ms": round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(self.max_wait * 1000, 3),
+                "timeouts": self.timeouts,
+            }
+
+
+engine = create_engine(
+    Config.SQLALCHEMY_DATABASE_URI,
+    poolclass=InstrumentedQueuePool,
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+    pool_timeout=Config.DB_POOL_TIMEOUT,
+    pool_recycle=Config.DB_POOL_RECYCLE,
+    pool_pre_ping=Config.DB_POOL_PRE_PING,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-# Dependency to create and close database sessions
+@event.listens_for(engine, "connect")
+def _connection_opened(dbapi_connection, connection_record):
+    engine.pool.count("connections_opened")
+
+
+@event.listens_for(engine, "close")
+def _connection_closed(dbapi_connection, connection_record):
+    engine.pool.count("connections_closed")
+
+
+# Session of the current request, closed by close_db when the request ends
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
+    if "db" not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+# Registered with app.teardown_appcontext, returns the connection to the pool
+def close_db(exception=None):
+    db = g.pop("db", None)
+    if db is not None:
         db.close()
+
+
+def get_pool_stats():
+    return engine.pool.get_stats()
@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+from config import Config
+
+
+class HashPoolFull(Exception):
+    """More password hashes are waiting than HASH_QUEUE_LIMIT allows."""
+
+
+class HashTimeout(Exception):
+    """A password hash took longer than HASH_TIMEOUT, queueing included."""
+
+
+# Run in the worker processes, so they have to be module level functions
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+class HashPool:
+    """
+    Runs bcrypt in a pool of worker processes instead of on the request threads.
+
+    At most workers hashes run at the same time, queue_limit more may wait
+    for a worker. Beyond that a request is refused with HashPoolFull right
+    away (the caller answers 429), so a burst of logins cannot take all CPU
+    from the cheap requests. A request that waited timeout seconds gets
+    HashTimeout (the caller answers 503). Its slot is only given back once
+    the hash has finished or was cancelled before it started, so abandoned
+    hashes still count against the limit. With workers=0 hashing runs inline.
+    """
+
+    def __init__(self, workers=Config.HASH_WORKERS, queue_limit=Config.HASH_QUEUE_LIMIT,
+                 rounds=Config.BCRYPT_ROUNDS, timeout=Config.HASH_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers else None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        # Started on first use, so the workers are forked from the serving process
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashPoolFull(f"{self.workers + self.queue_limit} password hashes are already waiting")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Drops it if no worker picked it up yet, a running hash keeps its slot
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise HashTimeout(f"Password hash did not finish within {self.timeout}s")
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def hash_password(self, password: str) -> str:
+        return self._run(_hash, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def check_password(self, password: str, hashed: str) -> bool:
+        return self._run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True if a hash was made with another cost than BCRYPT_ROUNDS ($2b$<cost>$...)."""
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "rounds": self.rounds,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+hash_pool = HashPool()
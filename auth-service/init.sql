@@ -37,9 +37,14 @@ CREATE TABLE IF NOT EXISTS users (
 -- Create tokens table based on Token model
 CREATE TABLE IF NOT EXISTS tokens (
     id SERIAL PRIMARY KEY,
-    token VARCHAR(512) UNIQUE NOT NULL,  -- Increased size for flexibility
+    token VARCHAR(512) UNIQUE,  -- Not stored with VERIFY_MODE=stateless
+    jti VARCHAR(36) UNIQUE,  -- Token id (jti claim)
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     issued_at TIMESTAMPTZ DEFAULT NOW(),
     expires_at TIMESTAMPTZ,  -- Define expiration time
-    revoked BOOLEAN DEFAULT FALSE
+    revoked BOOLEAN DEFAULT FALSE,
+    revoked_at TIMESTAMPTZ
 );
+
+CREATE INDEX IF NOT EXISTS ix_tokens_revoked_at ON tokens (revoked_at);
+CREATE INDEX IF NOT EXISTS ix_tokens_expires_at ON tokens (expires_at);
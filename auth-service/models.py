@@ -42,21 +42,28 @@ class Token(Base):
 
     Attributes:
         id (int): Unique identifier for the token.
-        token (str): The actual token string, used for authentication.
+        token (str): The actual token string, used for authentication. Not
+            stored with VERIFY_MODE=stateless.
+        jti (str): The jti claim of the token, its unique id.
         user_id (int): Identifier of the user associated with this token.
         issued_at (datetime): Timestamp of when the token was issued.
-        expires_at (datetime): Timestamp of when the token will expire.
+        expires_at (datetime): Timestamp of when the token will expire. The
+            token is deleted TOKEN_GC_GRACE seconds later (token_gc.py).
         revoked (bool): Indicates whether the token has been revoked.
+        revoked_at (datetime): Timestamp of the revocation, used to load
+            the revocations incrementally.
         user (User): The user associated with this token.
     """
 
     __tablename__ = "tokens"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    token = Column(String(512), unique=True, nullable=False)
+    token = Column(String(512), unique=True, nullable=True)
+    jti = Column(String(36), unique=True, index=True, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     issued_at = Column(DateTime, default=datetime.now())
-    expires_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
     revoked = Column(Boolean, default=False)
+    revoked_at = Column(DateTime, index=True, nullable=True)
 
     user = relationship("User", back_populates="tokens")
@@ -0,0 +1,117 @@
+import threading
+import time
+from datetime import timedelta
+import redis
+from config import Config
+from crud import get_revocations_since
+from database import SessionLocal
+
+# Must match the gateway side (api-gateway/auth_svc/token_verifier.py)
+REVOCATION_CHANNEL = "auth:revocations"
+REVOKED_KEY_PREFIX = "auth:revoked:"
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None and Config.REDIS_URL:
+        _redis_client = redis.StrictRedis(
+            host=Config.REDIS_URL,
+            port=Config.REDIS_PORT,
+            password=Config.REDIS_PASSWORD,
+            decode_responses=True
+        )
+    return _redis_client
+
+
+# Push a revoked token id to the shared revocation set
+def publish_revocation(jti: str, expires_at: float) -> bool:
+    client = get_redis()
+    if client is None:
+        return False
+
+    # The entry only has to live as long as the token itself
+    ttl = max(int(expires_at - time.time()), 1)
+    pipe = client.pipeline()
+    pipe.set(f"{REVOKED_KEY_PREFIX}{jti}", int(expires_at), ex=ttl)
+    pipe.publish(REVOCATION_CHANNEL, f"{jti}:{int(expires_at)}")
+    pipe.execute()
+    return True
+
+
+class RevocationSet:
+    """
+    Revoked token ids (jti) in memory, checked by /verify with VERIFY_MODE=stateless.
+
+    Loaded from the tokens table and refreshed every interval seconds by a
+    background thread. A refresh only reads the rows revoked since the last
+    one (with some overlap for transactions that committed late). Logouts on
+    this instance are added right away, the other instances see them after
+    the next refresh. Entries are dropped once the token has expired anyway.
+    """
+
+    # Re-read this much before the newest revoked_at seen
+    OVERLAP = timedelta(seconds=30)
+
+    def __init__(self, interval=Config.REVOCATION_REFRESH_INTERVAL):
+        self.interval = interval
+        self._revoked = {}  # jti -> expiry as epoch seconds
+        self._lock = threading.Lock()
+        self._since = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.refreshes = 0
+
+    def add(self, jti: str, expires_at: float):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def is_revoked(self, jti: str) -> bool:
+        expires_at = self._revoked.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def refresh(self):
+        db = SessionLocal()
+        try:
+            since = self._since - self.OVERLAP if self._since else None
+            rows = get_revocations_since(db, since)
+        finally:
+            db.close()
+        for jti, expires_at, revoked_at in rows:
+            self.add(jti, expires_at.timestamp())
+            if self._since is None or revoked_at > self._since:
+                self._since = revoked_at
+        now = time.time()
+        with self._lock:
+            for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[jti]
+        self.refreshes += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh the revoked tokens: {e}")
+
+    def start(self):
+        if self._thread is None:
+            # Loaded before the first /verify, later refreshes run in the background
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Failed to load the revoked tokens: {e}")
+            self._thread = threading.Thread(target=self._run, daemon=True, name="revocation-refresh")
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+revocation_set = RevocationSet()
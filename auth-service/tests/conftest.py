@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+# Config is read when the modules are imported, so set it up first: a
+# throwaway SQLite database, cheap hashes inline and no background jobs
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/auth_test.db"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("HASH_WORKERS", "0")
+os.environ.setdefault("TOKEN_GC_INTERVAL", "0")
+os.environ.pop("REDIS_URL", None)
+
+# Add the service directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    from database import SessionLocal
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def stateless(monkeypatch):
+    """Run the app in VERIFY_MODE=stateless."""
+    import app as app_module
+    monkeypatch.setattr(app_module, "STATELESS", True)
+
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """Register a user with a new name, returns (username, password, user_id)."""
+    def register(password="secret"):
+        username = f"user-{uuid.uuid4().hex[:8]}"
+        response = client.post("/register", json={"username": username, "password": password})
+        assert response.status_code == 201
+        return username, password, response.json["user_id"]
+    return register
+
+
+@pytest.fixture
+def login(client, register):
+    """Register and log in a new user, returns (user_id, access_token)."""
+    def login():
+        username, password, user_id = register()
+        response = client.post("/login", auth=(username, password))
+        assert response.status_code == 200
+        return user_id, response.json["access_token"]
+    return login
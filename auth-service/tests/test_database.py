@@ -0,0 +1,95 @@
+import sqlite3
+import uuid
+import pytest
+from sqlalchemy import exc
+
+import database
+from app import app
+from database import InstrumentedQueuePool, SessionLocal, get_db, get_pool_stats
+from models import User
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Every session handed out by get_db, with the calls to close."""
+    created = []
+
+    def recording_session():
+        session = SessionLocal()
+        session.closed = 0
+        close = session.close
+
+        def recording_close():
+            session.closed += 1
+            close()
+
+        session.close = recording_close
+        created.append(session)
+        return session
+
+    monkeypatch.setattr(database, "SessionLocal", recording_session)
+    return created
+
+
+def test_one_session_per_request(client, register, sessions):
+    username, password, _ = register()
+    del sessions[:]
+
+    response = client.post("/login", auth=(username, password))
+
+    assert response.status_code == 200
+    # Read the user, store the token: one session, closed at the end
+    assert len(sessions) == 1
+    assert sessions[0].closed == 1
+
+
+def test_session_is_shared_within_the_app_context(sessions):
+    with app.app_context():
+        assert get_db() is get_db()
+    assert len(sessions) == 1
+    assert sessions[0].closed == 1
+
+
+def test_session_is_rolled_back_and_closed_after_an_exception(db, sessions):
+    username = f"rollback-{uuid.uuid4().hex[:8]}"
+    checked_out = get_pool_stats()["checked_out"]
+
+    with pytest.raises(RuntimeError):
+        with app.app_context():
+            get_db().add(User(username=username, password="-"))
+            get_db().flush()
+            raise RuntimeError("request failed")
+
+    assert sessions[0].closed == 1
+    assert get_pool_stats()["checked_out"] == checked_out
+    assert db.query(User).filter(User.username == username).first() is None
+
+
+def test_requests_count_checkouts(client, register):
+    before = get_pool_stats()
+    register()
+    after = get_pool_stats()
+
+    assert after["checkouts"] > before["checkouts"]
+    assert after["checked_out"] == before["checked_out"]
+    assert after["connections_open"] == after["connections_opened"] - after["connections_closed"]
+
+
+def test_pool_counts_waits_and_timeouts(tmp_path):
+    pool = InstrumentedQueuePool(
+        lambda: sqlite3.connect(tmp_path / "pool.db", check_same_thread=False),
+        pool_size=1, max_overflow=0, timeout=0.05,
+    )
+    connection = pool.connect()
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+
+    stats = pool.get_stats()
+    assert (stats["pool_size"], stats["max_overflow"]) == (1, 0)
+    # The checkout that timed out is only counted as a timeout
+    assert (stats["checked_out"], stats["checkouts"], stats["timeouts"]) == (1, 1, 1)
+    assert stats["wait_time_max_ms"] < 50
+
+    connection.close()
+    assert pool.get_stats()["checked_in"] == 1
+
@@ -0,0 +1,106 @@
+import threading
+import time
+import pytest
+
+from hashing import HashPool, HashPoolFull, HashTimeout
+import app as app_module
+
+
+# Run in the worker processes, so it has to be a module level function
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def make(**kwargs):
+        kwargs.setdefault("rounds", 4)
+        pools.append(HashPool(**kwargs))
+        return pools[-1]
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_hash_and_check_round_trip(pool, workers):
+    hash_pool = pool(workers=workers, queue_limit=2, timeout=10)
+    hashed = hash_pool.hash_password("correct horse")
+
+    assert hashed.startswith("$2b$04$")
+    assert hash_pool.check_password("correct horse", hashed)
+    assert not hash_pool.check_password("wrong horse", hashed)
+    assert not hash_pool.needs_rehash(hashed)
+    assert pool(workers=0, rounds=5).needs_rehash(hashed)
+
+
+def test_requests_beyond_workers_and_queue_are_refused(pool):
+    hash_pool = pool(workers=1, queue_limit=1, timeout=10)
+    threads = [threading.Thread(target=hash_pool._run, args=(_sleep, 0.5)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: hash_pool.get_stats()["in_flight"] == 2)
+
+    with pytest.raises(HashPoolFull):
+        hash_pool._run(_sleep, 0)
+    for thread in threads:
+        thread.join()
+
+    stats = hash_pool.get_stats()
+    assert (stats["in_flight"], stats["completed"], stats["rejected"]) == (0, 2, 1)
+    assert hash_pool._run(_sleep, 0) == 0
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_finished(pool):
+    hash_pool = pool(workers=1, queue_limit=0, timeout=0.1)
+    hash_pool._run(_sleep, 0)  # Start the worker process
+
+    with pytest.raises(HashTimeout):
+        hash_pool._run(_sleep, 0.5)
+    # Still running in the worker, so there is no room for another one
+    assert hash_pool.get_stats()["in_flight"] == 1
+    with pytest.raises(HashPoolFull):
+        hash_pool._run(_sleep, 0)
+
+    wait_for(lambda: hash_pool.get_stats()["in_flight"] == 0)
+    assert hash_pool.get_stats()["timeouts"] == 1
+    assert hash_pool._run(_sleep, 0) == 0
+
+
+def test_login_and_register_answer_503_on_timeout(client, register, monkeypatch):
+    username, password, _ = register()
+
+    def timeout(*args):
+        raise HashTimeout("Password hash did not finish within 10s")
+
+    monkeypatch.setattr(app_module.hash_pool, "check_password", timeout)
+    monkeypatch.setattr(app_module.hash_pool, "hash_password", timeout)
+
+    response = client.post("/login", auth=(username, password))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    response = client.post("/register", json={"username": f"{username}-2", "password": password})
+    assert response.status_code == 503
+
+
+def test_login_answers_429_when_the_pool_is_full(client, register, monkeypatch):
+    username, password, _ = register()
+
+    def full(*args):
+        raise HashPoolFull("33 password hashes are already waiting")
+
+    monkeypatch.setattr(app_module.hash_pool, "check_password", full)
+
+    response = client.post("/login", auth=(username, password))
+    assert response.status_code == 429
@@ -0,0 +1,61 @@
+from flask_jwt_extended import decode_token
+
+from app import app
+from crud import get_token_by_jti
+from models import Token
+from revocation import RevocationSet, revocation_set
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def jti_of(token):
+    with app.app_context():
+        return decode_token(token)["jti"]
+
+
+def test_login_stores_only_the_jti(client, login, stateless, db):
+    _, token = login()
+
+    row = get_token_by_jti(db, jti_of(token))
+    assert row is not None
+    assert row.token is None
+
+
+def test_token_is_accepted_without_a_row(client, login, stateless, db):
+    user_id, token = login()
+    db.query(Token).filter(Token.jti == jti_of(token)).delete()
+    db.commit()
+
+    response = client.post("/verify", headers=bearer(token))
+    assert response.status_code == 200
+    assert response.json["user_id"] == user_id
+
+
+def test_logout_revokes_through_the_jti_set(client, login, stateless, db):
+    _, token = login()
+    jti = jti_of(token)
+
+    assert client.post("/logout", headers=bearer(token)).status_code == 200
+    assert revocation_set.is_revoked(jti)
+    assert get_token_by_jti(db, jti).revoked_at is not None
+    assert client.post("/verify", headers=bearer(token)).status_code == 401
+
+
+def test_revocations_are_loaded_again_after_a_restart(client, login, stateless):
+    first, second = login()[1], login()[1]
+    client.post("/logout", headers=bearer(first))
+
+    # A new instance only knows what is in the tokens table
+    restarted = RevocationSet(interval=60)
+    restarted.refresh()
+    assert restarted.is_revoked(jti_of(first))
+    assert not restarted.is_revoked(jti_of(second))
+
+    # Later refreshes only read the rows revoked since, and add them
+    client.post("/logout", headers=bearer(second))
+    restarted.refresh()
+    assert restarted.is_revoked(jti_of(first))
+    assert restarted.is_revoked(jti_of(second))
+    assert restarted.refreshes == 2
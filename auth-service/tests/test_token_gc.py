@@ -0,0 +1,122 @@
+import itertools
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import insert, select, text
+
+import token_gc
+from crud import delete_stale_tokens
+from models import Token, User
+from token_gc import DEFAULT_PARTITION, TokenCompactor
+
+
+# The stand-in for tokens_default has no autoincrement
+partition_ids = itertools.count(1)
+
+
+@pytest.fixture
+def user_id(db):
+    # The other tests leave tokens behind, start from an empty table
+    db.query(Token).delete()
+    user = User(username=f"gc-{uuid.uuid4().hex[:8]}", password="-")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def add_tokens(db, user_id, count, expires_in, revoked_ago=None, table=Token.__table__):
+    now = datetime.now()
+    rows = [
+        {
+            "id": None if table is Token.__table__ else next(partition_ids),
+            "jti": str(uuid.uuid4()),
+            "user_id": user_id,
+            "expires_at": now + expires_in,
+            "revoked": revoked_ago is not None,
+            "revoked_at": now - revoked_ago if revoked_ago is not None else None,
+        }
+        for _ in range(count)
+    ]
+    db.execute(insert(table), rows)
+    db.commit()
+
+
+def count(db, table=Token.__table__):
+    return len(db.execute(select(table.c.id)).all())
+
+
+def compactor(**kwargs):
+    kwargs = {"interval": 0, "batch_size": 10, "max_batches": 100, "batch_pause": 0, "grace": 60, **kwargs}
+    return TokenCompactor(**kwargs)
+
+
+def test_deletes_in_batches_up_to_the_last_partial_one(db, user_id):
+    add_tokens(db, user_id, 25, timedelta(hours=-1))
+    add_tokens(db, user_id, 5, timedelta(hours=1))
+
+    cutoff = datetime.now()
+    batches = [delete_stale_tokens(db, 10, expired_before=cutoff) for _ in range(4)]
+
+    assert batches == [10, 10, 5, 0]
+    assert count(db) == 5
+
+
+def test_without_a_condition_nothing_is_deleted(db, user_id):
+    add_tokens(db, user_id, 3, timedelta(hours=-1))
+
+    assert delete_stale_tokens(db, 10) == 0
+    assert count(db) == 3
+
+
+def test_compact_deletes_expired_and_revoked_tokens(db, user_id):
+    add_tokens(db, user_id, 23, timedelta(hours=-1))
+    add_tokens(db, user_id, 4, timedelta(hours=1), revoked_ago=timedelta(hours=1))
+    # Within the grace period
+    add_tokens(db, user_id, 2, timedelta(seconds=-1))
+    add_tokens(db, user_id, 6, timedelta(hours=1))
+
+    job = compactor()
+    assert job.compact() == 27
+    assert count(db) == 8
+    stats = job.get_stats()
+    assert (stats["runs"], stats["deleted"], stats["last_deleted"]) == (1, 27, 27)
+
+
+def test_revoked_tokens_stay_when_delete_revoked_is_off(db, user_id):
+    add_tokens(db, user_id, 4, timedelta(hours=1), revoked_ago=timedelta(hours=1))
+
+    assert compactor(delete_revoked=False).compact() == 0
+    assert count(db) == 4
+
+
+def test_a_run_stops_after_max_batches(db, user_id):
+    add_tokens(db, user_id, 35, timedelta(hours=-1))
+
+    job = compactor(max_batches=2)
+    assert job.compact() == 20
+    assert job.compact() == 15
+    assert count(db) == 0
+
+
+@pytest.fixture
+def default_partition(db, monkeypatch):
+    # SQLite has no partitions, a plain table stands in for tokens_default
+    db.execute(text("CREATE TABLE tokens_default AS SELECT * FROM tokens WHERE 0"))
+    db.commit()
+    monkeypatch.setattr(token_gc, "is_partitioned", lambda db: True)
+    monkeypatch.setattr(TokenCompactor, "maintain_partitions", lambda self, db, now: None)
+    yield
+    db.execute(text("DROP TABLE tokens_default"))
+    db.commit()
+
+
+def test_partitioned_compact_deletes_expired_tokens_of_the_default_partition(db, user_id, default_partition):
+    add_tokens(db, user_id, 13, timedelta(hours=-1), table=DEFAULT_PARTITION)
+    add_tokens(db, user_id, 2, timedelta(days=30), table=DEFAULT_PARTITION)
+    add_tokens(db, user_id, 3, timedelta(hours=1), revoked_ago=timedelta(hours=1))
+    # Left for maintain_partitions, which drops their day
+    add_tokens(db, user_id, 4, timedelta(hours=-1))
+
+    assert compactor().compact() == 16
+    assert count(db, DEFAULT_PARTITION) == 2
+    assert count(db) == 4
@@ -0,0 +1,71 @@
+from flask_jwt_extended import decode_token
+
+from app import app
+from models import Token
+
+
+def jti_of(token):
+    with app.app_context():
+        return decode_token(token)["jti"]
+
+
+def verify_batch(client, tokens):
+    response = client.post("/verify/batch", json={"tokens": tokens})
+    assert response.status_code == 200
+    return response.json["results"]
+
+
+def test_results_are_in_the_order_of_the_tokens(client, login):
+    (first_id, first), (second_id, second) = login(), login()
+    client.post("/logout", headers={"Authorization": f"Bearer {second}"})
+
+    results = verify_batch(client, [first, "not a token", f"Bearer {first}", second])
+
+    assert results[0]["identity"]["user_id"] == first_id
+    assert results[1] == {"msg": "Token verification failed", "status": 401}
+    assert results[2] == results[0]
+    assert results[3] == {"msg": "Token invalid or revoked", "status": 401}
+
+
+def test_token_without_a_row_is_rejected(client, login, db):
+    _, token = login()
+    db.query(Token).filter(Token.jti == jti_of(token)).delete()
+    db.commit()
+
+    assert verify_batch(client, [token]) == [{"msg": "Token invalid or revoked", "status": 401}]
+
+
+def test_rows_without_a_jti_are_found_by_their_text(client, login, db):
+    # Stored before the jti column existed
+    (user_id, legacy), (_, revoked) = login(), login()
+    db.query(Token).filter(Token.jti.in_([jti_of(legacy), jti_of(revoked)])).update(
+        {Token.jti: None}, synchronize_session=False
+    )
+    db.query(Token).filter(Token.token == revoked).update({Token.revoked: True}, synchronize_session=False)
+    db.commit()
+
+    results = verify_batch(client, [legacy, revoked])
+
+    assert results[0]["identity"]["user_id"] == user_id
+    assert results[1] == {"msg": "Token invalid or revoked", "status": 401}
+
+
+def test_stateless_mode_checks_the_revocation_set(client, login, stateless, db):
+    (user_id, token), (_, revoked) = login(), login()
+    client.post("/logout", headers={"Authorization": f"Bearer {revoked}"})
+    db.query(Token).filter(Token.jti == jti_of(token)).delete()
+    db.commit()
+
+    results = verify_batch(client, [token, revoked])
+
+    assert results[0]["identity"]["user_id"] == user_id
+    assert results[1] == {"msg": "Token invalid or revoked", "status": 401}
+
+
+def test_invalid_and_oversized_batches_are_refused(client, monkeypatch):
+    from config import Config
+    monkeypatch.setattr(Config, "VERIFY_BATCH_MAX", 2)
+
+    assert client.post("/verify/batch", json={"tokens": "a"}).status_code == 400
+    assert client.post("/verify/batch", json={"tokens": [1]}).status_code == 400
+    assert client.post("/verify/batch", json={"tokens": ["a", "b", "c"]}).status_code == 413
@@ -0,0 +1,202 @@
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, text
+from config import Config
+from crud import delete_stale_tokens
+from database import SessionLocal
+from models import Token
+
+# Day partitions of a partitioned tokens table are named tokens_pYYYYMMDD,
+# must match alembic/versions/9b1e5c8d2f60_token_gc.py
+PARTITION_NAME = re.compile(r"^tokens_p(\d{8})$")
+# Holds the tokens that expire on a day without a partition
+DEFAULT_PARTITION = Token.__table__.to_metadata(MetaData(), name="tokens_default")
+
+
+def partition_name(day) -> str:
+    return f"tokens_p{day:%Y%m%d}"
+
+
+# True if the tokens table was partitioned by the migration
+def is_partitioned(db) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('tokens')"
+    )).first() is not None
+
+
+def list_partitions(db):
+    """Day partitions of the tokens table, as (name, day) sorted by day."""
+    rows = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'tokens'::regclass"
+    )).fetchall()
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, datetime.strptime(match.group(1), "%Y%m%d").date()))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+class TokenCompactor:
+    """
+    Deletes the tokens that can no longer be used, in the background.
+
+    Every interval seconds the rows that expired more than grace seconds
+    ago are deleted, and the revoked rows too when delete_revoked is set.
+    The stateless verify mode loads its revocations from the revoked rows,
+    so with VERIFY_MODE=stateless they stay until they expire. Rows are
+    deleted in batches of batch_size, each in its own transaction with a
+    pause in between, so the job never holds many row locks next to the
+    logins. A run stops after max_batches, the rest is left for the next one.
+
+    When the tokens table is partitioned by day on expires_at (see the
+    token_gc migration), the expired rows are not deleted one by one: the
+    partitions that ended more than grace ago are dropped, and the
+    partitions of the next partitions_ahead days are created. Only the
+    default partition, which takes the tokens of days without a partition
+    (say the job did not run for a while), is still deleted in batches.
+    """
+
+    # Give up on a DDL statement instead of queueing the logins behind it
+    LOCK_TIMEOUT = "2s"
+
+    def __init__(
+        self,
+        interval=Config.TOKEN_GC_INTERVAL,
+        batch_size=Config.TOKEN_GC_BATCH_SIZE,
+        max_batches=Config.TOKEN_GC_MAX_BATCHES,
+        batch_pause=Config.TOKEN_GC_BATCH_PAUSE,
+        grace=Config.TOKEN_GC_GRACE,
+        partitions_ahead=Config.TOKEN_PARTITIONS_AHEAD,
+        delete_revoked=Config.VERIFY_MODE != "stateless",
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause = batch_pause
+        self.grace = grace
+        self.partitions_ahead = partitions_ahead
+        self.delete_revoked = delete_revoked
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.runs = 0
+        self.deleted = 0
+        self.partitions_dropped = 0
+        self.partitions_created = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.last_deleted = 0
+
+    def _ddl(self, db, statement) -> bool:
+        try:
+            db.execute(text(f"SET LOCAL lock_timeout = '{self.LOCK_TIMEOUT}'"))
+            db.execute(text(statement))
+            db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            print(f"Token partition maintenance failed ({statement}): {e}")
+            return False
+
+    def maintain_partitions(self, db, now: datetime):
+        """Create the partitions of the coming days and drop the expired ones."""
+        existing = {name for name, _ in list_partitions(db)}
+        for days in range(self.partitions_ahead + 1):
+            day = now.date() + timedelta(days=days)
+            name = partition_name(day)
+            if name in existing:
+                continue
+            created = self._ddl(
+                db,
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF tokens "
+                f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')",
+            )
+            if created:
+                self.partitions_created += 1
+
+        cutoff = now - timedelta(seconds=self.grace)
+        for name, day in list_partitions(db):
+            # Every token in it expired before the end of its day
+            if datetime.combine(day + timedelta(days=1), datetime.min.time()) > cutoff:
+                break
+            if self._ddl(db, f"DROP TABLE IF EXISTS {name}"):
+                self.partitions_dropped += 1
+
+    def compact(self) -> int:
+        """One run, returns the number of rows deleted."""
+        with self._lock:
+            started = time.perf_counter()
+            now = datetime.now()
+            cutoff = now - timedelta(seconds=self.grace)
+            deleted = 0
+            db = SessionLocal()
+            try:
+                revoked_before = cutoff if self.delete_revoked else None
+                if is_partitioned(db):
+                    self.maintain_partitions(db, now)
+                    deleted += self._delete_in_batches(db, expired_before=cutoff, table=DEFAULT_PARTITION)
+                    deleted += self._delete_in_batches(db, revoked_before=revoked_before)
+                else:
+                    deleted += self._delete_in_batches(db, expired_before=cutoff, revoked_before=revoked_before)
+            finally:
+                db.close()
+                self.runs += 1
+                self.deleted += deleted
+                self.last_deleted = deleted
+                self.last_run = now
+                self.last_duration = time.perf_counter() - started
+            return deleted
+
+    def _delete_in_batches(self, db, **conditions) -> int:
+        deleted = 0
+        for _ in range(self.max_batches):
+            count = delete_stale_tokens(db, self.batch_size, **conditions)
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return deleted
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Failed to delete the expired tokens: {e}")
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="token-gc")
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_stats(self):
+        return {
+            "interval": self.interval,
+            "batch_size": self.batch_size,
+            "delete_revoked": self.delete_revoked,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_deleted": self.last_deleted,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_duration": round(self.last_duration, 3),
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+        }
+
+
+token_compactor = TokenCompactor()
+
+
+if __name__ == "__main__":
+    # One run, for a cron job instead of the background thread
+    print(f"Deleted {token_compactor.compact()} tokens")
+    print(token_compactor.get_stats())
@@ -1,15 +1,21 @@
 import asyncio
 from nats.aio.client import Client as NATS
 from aiohttp import web
-import json
 from datetime import datetime, timezone
 import uuid
 from dotenv import load_dotenv
 import os
+import event_codec
+import jetstream
 
 load_dotenv()
 nc = NATS()
 
+# Replicas of the assistant share the messages instead of each answering them
+QUEUE_GROUP = os.getenv("NATS_QUEUE_GROUP", "chat-assistant")
+# Same stream as the api-gateway, consumed with explicit acks, see jetstream.py
+JETSTREAM_ENABLED = os.getenv("NATS_JETSTREAM", "false").lower() == "true"
+
 def get_current_time_iso():
     return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
 
@@ -29,10 +35,10 @@ async def send_credentials():
         "service": "matrix-login",
         "event_type": "post",
         "actor": "Chat Assistance",
-        "payload": str(credentials)
+        "payload": credentials
     }
     print("\n\n\n",credentials_response,"\n\n\n")
-    await nc.publish("send.matrix.message", json.dumps(credentials_response).encode())
+    await nc.publish("send.matrix.message", event_codec.encode("send.matrix.message", credentials_response))
     
 async def handle_specific_message(data):
     """
@@ -67,40 +73,62 @@ async def handle_normal_message(data):
         "service": "matrix-message",
         "event_type": "post",
         "actor": "Chat Assistance",
-        "payload": json.dumps(payload_response)
+        "payload": payload_response
     }
 
     # Publish response to "send.matrix.message"
-    await nc.publish("send.matrix.message", json.dumps(message_response).encode())
+    await nc.publish("send.matrix.message", event_codec.encode("send.matrix.message", message_response))
 
 async def message_handler(msg):
+    """Handle a message, returns how to settle it: "ack", "nak" (redeliver) or "term"."""
     subject = msg.subject
-    raw_data = msg.data.decode()
 
     try:
-        # Attempt to parse the incoming message as JSON
-        if raw_data.startswith("{") and raw_data.endswith("}"):
-            fixed_data = raw_data.replace("'", '"')
-            data = json.loads(fixed_data)
-        else:
-            raise ValueError(f"Received non-JSON formatted data: {raw_data}")
+        # JSON or msgpack, validated against the schema of the subject
+        data = event_codec.decode(subject, msg.data)
 
-        print(f"Received a valid JSON message on '{subject}': {data}")
+        print(f"Received a valid message on '{subject}': {data}")
 
         # First, handle specific messages
         if await handle_specific_message(data):
             print("Specific message handled.")
-            return
+            return "ack"
 
         # Otherwise, handle normal messages
         await handle_normal_message(data)
+        return "ack"
 
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: Invalid JSON received on '{subject}': {raw_data}")
-    except ValueError as e:
-        print(f"ValueError: {e}")
+    except event_codec.EventValidationError as e:
+        # Will never decode, do not redeliver it
+        print(f"Invalid event received on '{subject}': {e}")
+        return "term"
     except Exception as e:
         print(f"Unexpected error: {e}")
+        return "nak"
+
+async def subscribe(subject, callback):
+    if not JETSTREAM_ENABLED:
+        return await nc.subscribe(subject, queue=QUEUE_GROUP, cb=callback)
+
+    js = nc.jetstream()
+    await jetstream.ensure_stream(js)
+
+    async def handle_and_settle(msg):
+        # A failed message is redelivered, up to MAX_DELIVER times
+        outcome = await callback(msg)
+        try:
+            await getattr(msg, outcome)()
+        except Exception as e:
+            print(f"Failed to {outcome} message on '{msg.subject}': {e}")
+
+    return await js.subscribe(
+        subject,
+        queue=jetstream.durable_name(QUEUE_GROUP, subject),
+        cb=handle_and_settle,
+        stream=jetstream.STREAM_NAME,
+        manual_ack=True,
+        config=jetstream.consumer_config(),
+    )
 
 async def run():
     # Initialize the NATS client
@@ -110,8 +138,8 @@ async def run():
     await nc.connect(nats_url)  # Update with your NATS server address if needed
 
     # Subscribe to topics
-    await nc.subscribe("bots.connection", cb=message_handler)
-    await nc.subscribe("chat.messages", cb=message_handler)
+    await subscribe("bots.connection", message_handler)
+    await subscribe("chat.messages", message_handler)
 
     print("Chat bot is listening on 'bots.connection' and 'chat.messages'...")
 
@@ -0,0 +1,178 @@
+import json
+from app.config import INSTANCE_IP
+from app.redis_client import get_redis
+
+# Key scheme of the bot registry:
+#   bot:{username}                  client data (JSON) of a bot
+#   bots:index                      sorted set of all usernames
+#   bots:instance:{instance_ip}     sorted set of the usernames registered by an instance
+# Every member has score 0, so the sets are ordered by username and a page is
+# read with ZRANGEBYLEX from the last username of the previous page.
+BOT_PREFIX = "bot:"
+BOTS_INDEX = "bots:index"
+INSTANCE_INDEX_PREFIX = "bots:instance:"
+
+# Store a bot and index it, moving it out of the index of the instance that
+# registered it before
+REGISTER = """
+local previous = redis.call('GET', KEYS[1])
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('ZADD', KEYS[2], 0, ARGV[1])
+redis.call('ZADD', KEYS[3], 0, ARGV[1])
+if previous then
+    local ok, bot = pcall(cjson.decode, previous)
+    if ok and type(bot) == 'table' and type(bot['instance_ip']) == 'string'
+            and ARGV[3] .. bot['instance_ip'] ~= KEYS[3] then
+        redis.call('ZREM', ARGV[3] .. bot['instance_ip'], ARGV[1])
+    end
+end
+return 1
+"""
+
+# Remove a bot and its index entries. With an expected value the bot is only
+# removed if it still holds it, so a bot registered again by another instance
+# in the meantime is left alone.
+UNREGISTER = """
+local data = redis.call('GET', KEYS[1])
+if not data or (ARGV[2] ~= '' and data ~= ARGV[2]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+local ok, bot = pcall(cjson.decode, data)
+if ok and type(bot) == 'table' and type(bot['instance_ip']) == 'string' then
+    redis.call('ZREM', ARGV[3] .. bot['instance_ip'], ARGV[1])
+end
+return 1
+"""
+
+# Move a bot to another instance: rewrite its instance_ip and move it between
+# the instance indexes. With a from instance it only moves while still there.
+ASSIGN = """
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return 0
+end
+local bot = cjson.decode(data)
+local previous = bot['instance_ip']
+if type(previous) ~= 'string' then
+    previous = ''
+end
+if previous == ARGV[2] or (ARGV[4] ~= '' and previous ~= ARGV[4]) then
+    return 0
+end
+bot['instance_ip'] = ARGV[2]
+redis.call('SET', KEYS[1], cjson.encode(bot))
+redis.call('ZREM', ARGV[3] .. previous, ARGV[1])
+redis.call('ZADD', KEYS[2], 0, ARGV[1])
+return 1
+"""
+
+
+def bot_key(username: str) -> str:
+    return f"{BOT_PREFIX}{username}"
+
+
+def instance_index(instance_ip: str) -> str:
+    return f"{INSTANCE_INDEX_PREFIX}{instance_ip}"
+
+
+async def register_bot(username: str, client_data: dict):
+    """Store the client data of a bot and add it to the indexes."""
+    instance_ip = client_data.get("instance_ip", INSTANCE_IP)
+    await get_redis().eval(
+        REGISTER, 3, bot_key(username), BOTS_INDEX, instance_index(instance_ip),
+        username, json.dumps(client_data), INSTANCE_INDEX_PREFIX,
+    )
+
+
+async def get_bot(username: str):
+    """Client data of a bot as stored (JSON), or None."""
+    return await get_redis().get(bot_key(username))
+
+
+async def unregister_bot(username: str, expected: str = None) -> bool:
+    """
+    Remove a bot from the registry, returns False if there was nothing to remove.
+
+    If expected is given, the bot is only removed while its data is still
+    expected.
+    """
+    removed = await get_redis().eval(
+        UNREGISTER, 2, bot_key(username), BOTS_INDEX,
+        username, expected or "", INSTANCE_INDEX_PREFIX,
+    )
+    return bool(removed)
+
+
+async def assign_bot(username: str, instance_ip: str, from_instance: str = None) -> bool:
+    """
+    Hand a bot over to another instance, returns False if it was not moved.
+
+    With from_instance the bot is only moved while it is still assigned to
+    that instance, so two instances cannot both move it.
+    """
+    moved = await get_redis().eval(
+        ASSIGN, 2, bot_key(username), instance_index(instance_ip),
+        username, instance_ip, INSTANCE_INDEX_PREFIX, from_instance or "",
+    )
+    return bool(moved)
+
+
+async def list_bots(cursor: str = "", count: int = 100, instance_ip: str = None):
+    """
+    One page of usernames, ordered by username, starting after cursor.
+
+    Returns the usernames and the cursor of the next page, None on the last
+    page. With instance_ip only the bots of that instance are listed.
+    """
+    index = instance_index(instance_ip) if instance_ip else BOTS_INDEX
+    start = f"({cursor}" if cursor else "-"
+    # One extra to know whether there is a next page
+    usernames = await get_redis().zrangebylex(index, start, "+", start=0, num=count + 1)
+    if len(usernames) > count:
+        return usernames[:count], usernames[count - 1]
+    return usernames, None
+
+
+async def iter_bots(instance_ip: str = None, page_size: int = 500):
+    """All usernames of an index, read page by page."""
+    cursor = ""
+    while cursor is not None:
+        usernames, cursor = await list_bots(cursor, page_size, instance_ip)
+        for username in usernames:
+            yield username
+
+
+async def migrate_legacy_keys(batch_size: int = 500) -> int:
+    """
+    Move bots stored under their plain username into the namespaced scheme.
+
+    Walks the keyspace with SCAN, so Redis is never blocked for long, and only
+    takes the string keys that hold client data.
+    """
+    redis_client = get_redis()
+    migrated = 0
+    async for key in redis_client.scan_iter(count=batch_size, _type="string"):
+        if key.startswith(BOT_PREFIX) or key.startswith("bots:"):
+            continue
+        try:
+            client_data = json.loads(await redis_client.get(key) or "")
+        except ValueError:
+            continue
+        if not isinstance(client_data, dict) or "access_token" not in client_data:
+            continue
+        await register_bot(key, client_data)
+        await redis_client.delete(key)
+        migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    async def main():
+        migrated = await migrate_legacy_keys()
+        print(f"Migrated {migrated} bots to the namespaced registry")
+
+    asyncio.run(main())
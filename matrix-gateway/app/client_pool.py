@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class ClientPool:
+    """
+    Live, logged-in Matrix clients of this instance, keyed by username.
+
+    Reusing a client also reuses its HTTP session, so sending a message is a
+    single request to the homeserver. Clients that run their sync loop here
+    are pinned: never evicted and not counted against max_size. Other clients
+    (rehydrated from Redis to send a message) are evicted least recently used
+    first once the pool is full, or when they have been idle for idle_timeout
+    seconds. Evicted clients are closed.
+
+    Supports the dict operations the routes need: in, [], get, pop and clear.
+    """
+
+    def __init__(self, max_size=256, idle_timeout=600):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._clients = OrderedDict()  # username -> client, least recently used first
+        self._last_used = {}
+        self._sync_tasks = {}  # username -> sync task, for pinned clients
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, username):
+        return username in self._clients
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(list(self._clients))
+
+    def __getitem__(self, username):
+        client = self._clients[username]
+        self._touch(username)
+        return client
+
+    def __setitem__(self, username, client):
+        previous = self._clients.get(username)
+        if previous is not None and previous is not client:
+            # Logged in again, the old client and its sync loop are replaced
+            self.pop(username)
+            self._close_later(previous)
+        self._clients[username] = client
+        self._touch(username)
+        self._evict_overflow()
+
+    def __delitem__(self, username):
+        if self.pop(username, None) is None:
+            raise KeyError(username)
+
+    def get(self, username, default=None):
+        """Return the client of a username, counting the lookup as a hit or a miss."""
+        if username not in self._clients:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self[username]
+
+    def pop(self, username, default=None):
+        """Remove a client without closing it, its sync task is cancelled."""
+        self._last_used.pop(username, None)
+        sync_task = self._sync_tasks.pop(username, None)
+        if sync_task is not None:
+            sync_task.cancel()
+        return self._clients.pop(username, default)
+
+    def clear(self):
+        for username in list(self._clients):
+            self.pop(username)
+
+    def keys(self):
+        return list(self._clients)
+
+    def pin(self, username, sync_task):
+        """Keep the client of a username in the pool while its sync loop runs."""
+        self._sync_tasks[username] = sync_task
+
+    def is_pinned(self, username):
+        return username in self._sync_tasks
+
+    def pinned(self):
+        """Usernames of the clients syncing on this instance."""
+        return list(self._sync_tasks)
+
+    def _touch(self, username):
+        self._clients.move_to_end(username)
+        self._last_used[username] = time.monotonic()
+
+    def _evictable(self):
+        return [username for username in self._clients if username not in self._sync_tasks]
+
+    def _evict_overflow(self):
+        # Pinned clients do not count against the size, they cannot be evicted
+        evictable = self._evictable()
+        for username in evictable[:len(evictable) - self.max_size]:
+            self._evict(username)
+
+    def _evict(self, username):
+        client = self.pop(username)
+        self.evictions += 1
+        self._close_later(client)
+
+    def _close_later(self, client):
+        try:
+            asyncio.get_running_loop().create_task(client.close())
+        except RuntimeError:
+            pass  # No loop, nothing was opened either
+
+    async def evict_idle(self):
+        """Close the unpinned clients that have not been used for idle_timeout seconds."""
+        deadline = time.monotonic() - self.idle_timeout
+        idle = [username for username in self._evictable() if self._last_used.get(username, 0) <= deadline]
+        for username in idle:
+            client = self.pop(username)
+            self.evictions += 1
+            await client.close()
+        return len(idle)
+
+    async def run_reaper(self, interval=60):
+        """Background task evicting idle clients every interval seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    print(f"Evicted {evicted} idle Matrix clients")
+            except Exception as e:
+                print(f"Error while evicting idle Matrix clients: {e}")
+
+    async def close_all(self):
+        for username in list(self._clients):
+            client = self.pop(username)
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing Matrix client of {username}: {e}")
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "pinned": len(self._sync_tasks),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -1,19 +1,35 @@
-from app.config import HOMESERVER_URL, REDIS_URL, INSTANCE_IP
-from nio import AsyncClient, LoginError, InviteEvent, RoomMessageText, MatrixRoom
+from app.config import HOMESERVER_URL, INSTANCE_IP, CLIENT_POOL_SIZE, CLIENT_IDLE_TIMEOUT
+from nio import AsyncClient, LoginError, InviteEvent, RoomMessageText, MatrixRoom, RoomSendError
 from fastapi import HTTPException
+from .client_pool import ClientPool
+from .placement import Placement
+from .sync_scheduler import SyncScheduler, attach
+from .sync_state import make_store
+from .send_queue import SendQueue
+from .bot_registry import register_bot, get_bot
 from .utils.event_callbacks import message_listener
-import asyncio
-import redis
 import json
-import os
 
-# Redis client
-redis_client = redis.StrictRedis(host=REDIS_URL, port=6379, password='yourpassword', decode_responses=True)
+# Live clients of this instance, Redis is only read when a bot is not in here
+client_pool = ClientPool(max_size=CLIENT_POOL_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT)
+
+# Which instance syncs which bot, a bot is only synced while its lease is held
+placement = Placement(INSTANCE_IP)
+leases = placement.leases
+
+# Runs the sync loops of the bots of this instance over shared connections
+sync_scheduler = SyncScheduler(make_store(leases=leases))
+def username_from_user_id(user_id: str) -> str:
+    """@name:server -> name"""
+    if user_id.startswith("@"):
+        return user_id[1:].split(":")[0]
+    return user_id
 
 async def create_client(username: str, password: str):
     """Create and login a Matrix client."""
     print("Enter create_client()")
     client = AsyncClient(HOMESERVER_URL, username)
+    attach(client)
     print("Client created")
     try:
         response = await client.login(password)
@@ -25,7 +41,8 @@ async def create_client(username: str, password: str):
     print("Client logged in")
     # Add client to pool
     user_id = client.user_id  # Original user_id
-    username = user_id[1:].split(":")[0]
+    username = username_from_user_id(user_id)
+    client_pool[username] = client
     client_data = {
         "user_id": user_id,
         "device_id": client.device_id,
@@ -33,7 +50,7 @@ async def create_client(username: str, password: str):
         "homeserver": HOMESERVER_URL,
         "instance_ip": INSTANCE_IP
     }
-    redis_client.set(username, json.dumps(client_data))
+    await register_bot(username, client_data)
     print("Client stored in redis")
 
     # Register callbacks
@@ -47,29 +64,100 @@ async def create_client(username: str, password: str):
 
     return client
 
+async def get_client(username: str) -> AsyncClient:
+    """
+    Return the live client of a bot, or None if the bot is unknown.
+
+    Only on a pool miss the client is rehydrated from Redis, it is then kept
+    in the pool for the next messages.
+    """
+    client = client_pool.get(username)
+    if client is not None:
+        return client
+
+    try:
+        client = await get_client_from_pool(username)
+    except HTTPException:
+        return None
+    client_pool[username] = client
+    return client
+
+async def discard_client(username: str):
+    """Close the pooled client of a bot, for example when its token is no longer valid."""
+    client = client_pool.pop(username, None)
+    if client is not None:
+        await client.close()
+
+async def room_send_text(client, room_id, message, txn_id=None):
+    return await client.room_send(
+        room_id=room_id,
+        message_type="m.room.message",
+        content={"msgtype": "m.text", "body": message},
+        tx_id=txn_id,
+    )
+
+async def send_text(username: str, room_id: str, message: str, txn_id: str):
+    """Send a text message with the client of a bot, used by the send queue."""
+    client = await get_client(username)
+    if client is None:
+        raise LookupError(f"Bot {username} not found")
+    response = await room_send_text(client, room_id, message, txn_id)
+    if isinstance(response, RoomSendError) and response.status_code == "M_UNKNOWN_TOKEN":
+        # The bot logged in again somewhere else, retry once with the new token from Redis
+        await discard_client(username)
+        client = await get_client(username)
+        if client is None:
+            raise LookupError(f"Bot {username} not found")
+        response = await room_send_text(client, room_id, message, txn_id)
+    return response
+
+# Outgoing messages of the bots, rate-limited and retried in the background
+send_queue = SendQueue(send_text)
+
+async def adopt_bot(username: str):
+    """Start syncing a bot that was assigned to this instance, from its stored token."""
+    if client_pool.is_pinned(username):
+        return
+    if await leases.acquire(username) is None:
+        print(f"Bot {username} is still synced by {await leases.holder(username)}")
+        return
+    client = client_pool.get(username) or await get_client_from_pool(username)
+    if client_pool.is_pinned(username):
+        # Started by /bots/add while the client was loaded
+        return
+    client_pool[username] = client
+    client.add_event_callback(on_invite_event, InviteEvent)
+    client.add_event_callback(message_listener, RoomMessageText)
+    await start_sync(client)
+
+async def release_bot(username: str):
+    """Stop syncing a bot that was handed over to another instance."""
+    await sync_scheduler.stop(username)
+    await discard_client(username)
+    await leases.release(username)
+
 async def get_client_from_pool(user_id: str) -> AsyncClient:
-    """Retrieve a client from Redis and recreate the AsyncClient."""    
-    client_data = redis_client.get(user_id)
+    """Retrieve a client from Redis and recreate the AsyncClient."""
+    client_data = await get_bot(user_id)
     if not client_data:
         raise HTTPException(status_code=404, detail="Client not found in Redis")
 
     client_data = json.loads(client_data)
     client = AsyncClient(client_data["homeserver"], client_data["user_id"])
+    attach(client)
     client.access_token = client_data["access_token"]
     client.device_id = client_data["device_id"]
     return client
 
 async def start_sync(client: AsyncClient):
-    """Start syncing for a Matrix client."""
+    """Start syncing for a Matrix client, pending invites are processed after its first sync."""
     print(f"Starting sync for user: {client.user_id}")
     try:
-        # Start syncing
-        asyncio.create_task(client.sync_forever(timeout=30000))
+        # Start syncing, the client stays in the pool while its sync loop runs
+        username = username_from_user_id(client.user_id)
+        sync_task = sync_scheduler.start(username, client, on_first_sync=process_pending_invites)
+        client_pool.pin(username, sync_task)
         print(f"Sync started successfully for user: {client.user_id}.")
-        await asyncio.sleep(2)
-
-        # Initial processing of pending invites
-        await process_pending_invites(client)
     except Exception as e:
         print(f"Error during sync for user {client.user_id}: {e}")
 
@@ -99,11 +187,11 @@ async def on_invite_event(event: InviteEvent, client: AsyncClient):
     try:
         print(f"Received an invite to room: {room_id} for user: {user_id}")
 
-        # Fetch the client from Redis
+        # Fetch the client from the pool, or from Redis
         print(f"Fetching client from pool for user: {user_id}")
-        username = user_id[1:].split(":")[0]
-        
-        target_client = await get_client_from_pool(username)
+        username = username_from_user_id(user_id)
+
+        target_client = await get_client(username)
         if target_client is None:
             print(f"No client found in pool for user: {username}")
             return
@@ -6,4 +6,64 @@ load_dotenv()
 HOMESERVER_URL = os.getenv("HOMESERVER_URL")
 API_GATEWAY_URL = os.getenv("API_GATEWAY_URL")
 REDIS_URL = os.getenv("REDIS_URL")
-INSTANCE_IP = os.getenv("INSTANCE_IP", "unknown-instance")
\ No newline at end of file
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "yourpassword")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+INSTANCE_IP = os.getenv("INSTANCE_IP", "unknown-instance")
+
+# Live Matrix clients kept per instance, see app/client_pool.py
+CLIENT_POOL_SIZE = int(os.getenv("CLIENT_POOL_SIZE", 256))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("CLIENT_IDLE_TIMEOUT", 600))
+
+# Placement of the bots over the instances, see app/placement.py
+PLACEMENT_HEARTBEAT_INTERVAL = float(os.getenv("PLACEMENT_HEARTBEAT_INTERVAL", 5))
+# Seconds an instance heartbeat and a bot sync lease stay valid without renewal,
+# must be a few heartbeat intervals
+LEASE_TTL = float(os.getenv("LEASE_TTL", 15))
+PLACEMENT_VNODES = int(os.getenv("PLACEMENT_VNODES", 64))
+PLACEMENT_CONCURRENCY = int(os.getenv("PLACEMENT_CONCURRENCY", 10))
+
+# Sync loops of the bots, see app/sync_scheduler.py
+SYNC_MAX_CONCURRENT = int(os.getenv("SYNC_MAX_CONCURRENT", 100))
+# Connections of the shared pool left to sends and joins while every long-poll is open
+SYNC_RESERVED_CONNECTIONS = max(int(os.getenv("SYNC_RESERVED_CONNECTIONS", 20)), 1)
+SYNC_MAX_CONNECTIONS = int(os.getenv("SYNC_MAX_CONNECTIONS", SYNC_MAX_CONCURRENT + SYNC_RESERVED_CONNECTIONS))
+SYNC_TIMEOUT = int(os.getenv("SYNC_TIMEOUT", 30000))
+SYNC_MIN_TIMEOUT = int(os.getenv("SYNC_MIN_TIMEOUT", 5000))
+SYNC_BACKOFF_BASE = float(os.getenv("SYNC_BACKOFF_BASE", 1))
+SYNC_BACKOFF_MAX = float(os.getenv("SYNC_BACKOFF_MAX", 60))
+
+# Where the sync state of the bots is kept, redis or file, see app/sync_state.py
+SYNC_STATE_BACKEND = os.getenv("SYNC_STATE_BACKEND", "redis")
+SYNC_STATE_DIR = os.getenv("SYNC_STATE_DIR", "sync_state")
+
+# Forwarding of the chat messages to the API gateway, see app/utils/gateway_com.py
+GATEWAY_HTTP2 = os.getenv("GATEWAY_HTTP2", "true").lower() == "true"
+GATEWAY_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", 20))
+FORWARD_BATCH_SIZE = int(os.getenv("FORWARD_BATCH_SIZE", 50))
+FORWARD_FLUSH_INTERVAL = float(os.getenv("FORWARD_FLUSH_INTERVAL", 0.05))
+FORWARD_MAX_PENDING = int(os.getenv("FORWARD_MAX_PENDING", 5000))
+FORWARD_ENQUEUE_TIMEOUT = float(os.getenv("FORWARD_ENQUEUE_TIMEOUT", 5))
+FORWARD_RETRIES = int(os.getenv("FORWARD_RETRIES", 3))
+LOG_EVENTS = os.getenv("LOG_EVENTS", "false").lower() == "true"
+
+# "http" posts the chat messages to the API gateway, "nats" publishes them
+# straight to NATS (chat.messages) and only uses the gateway as a fallback
+FORWARD_TRANSPORT = os.getenv("FORWARD_TRANSPORT", "http")
+NATS_URL = os.getenv("NATS_URL", "nats://localhost:4222")
+NATS_CONNECT_RETRY_INTERVAL = float(os.getenv("NATS_CONNECT_RETRY_INTERVAL", 10))
+
+# Outgoing messages, see app/send_queue.py. Rates are messages per second
+SEND_BOT_RATE = float(os.getenv("SEND_BOT_RATE", 5))
+SEND_BOT_BURST = int(os.getenv("SEND_BOT_BURST", 20))
+SEND_ROOM_RATE = float(os.getenv("SEND_ROOM_RATE", 2))
+SEND_ROOM_BURST = int(os.getenv("SEND_ROOM_BURST", 10))
+SEND_MAX_PENDING = int(os.getenv("SEND_MAX_PENDING", 10000))
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", 5))
+SEND_BACKOFF_BASE = float(os.getenv("SEND_BACKOFF_BASE", 0.5))
+SEND_BACKOFF_MAX = float(os.getenv("SEND_BACKOFF_MAX", 30))
+SEND_STATUS_TTL = int(os.getenv("SEND_STATUS_TTL", 3600))
+
+# Matrix events already forwarded are skipped for this many seconds, see app/event_dedup.py
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 3600))
+DEDUP_LRU_SIZE = int(os.getenv("DEDUP_LRU_SIZE", 10000))
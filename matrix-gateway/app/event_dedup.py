@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from app.config import DEDUP_WINDOW, DEDUP_LRU_SIZE
+from app.redis_client import get_redis
+
+# dedup:event:{receiver}:{event_id} is set by the first instance that
+# forwards an event to a bot and expires after DEDUP_WINDOW seconds
+DEDUP_PREFIX = "dedup:event:"
+
+
+def dedup_key(receiver: str, event_id: str) -> str:
+    return f"{DEDUP_PREFIX}{receiver}:{event_id}"
+
+
+class EventDeduplicator:
+    """
+    Remembers which Matrix events were forwarded, for window seconds.
+
+    Events are keyed on the receiving bot and the event_id, so an event in a
+    room with two bots still reaches both. The recently seen events are kept
+    in a local LRU of lru_size entries, which catches the repeats of one
+    instance (sync retries, re-joined rooms) without a Redis call. A miss is
+    claimed in Redis with SET NX EX, so an event is forwarded once even when
+    two instances briefly sync the same bot. Without Redis the LRU alone
+    decides: a duplicate is better than a lost message. An event that could
+    not be forwarded after all is released, so a redelivery is not skipped.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW, lru_size=DEDUP_LRU_SIZE):
+        self.window = window
+        self.lru_size = lru_size
+        self._seen = OrderedDict()  # (receiver, event_id) -> expiry
+        self.duplicates = 0
+        self.local_hits = 0
+
+    def _remember(self, key, now):
+        self._seen[key] = now + self.window
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.lru_size:
+            self._seen.popitem(last=False)
+
+    async def is_duplicate(self, receiver: str, event_id: str) -> bool:
+        """Claim an event for forwarding, returns True if it was already forwarded."""
+        if not event_id:
+            return False
+        key = (receiver, event_id)
+        now = time.monotonic()
+        expiry = self._seen.get(key)
+        if expiry is not None and expiry > now:
+            self.local_hits += 1
+            self.duplicates += 1
+            return True
+
+        try:
+            # In milliseconds, a window under a second would round down to no expiry at all
+            claimed = await get_redis().set(
+                dedup_key(receiver, event_id), 1, nx=True, px=max(int(self.window * 1000), 1)
+            )
+        except Exception as e:
+            print(f"Could not check event {event_id} in Redis: {e}")
+            claimed = True
+        self._remember(key, now)
+        if not claimed:
+            self.duplicates += 1
+        return not claimed
+
+    async def release(self, receiver: str, event_id: str):
+        """Forget a claimed event, for when forwarding it failed."""
+        if not event_id:
+            return
+        self._seen.pop((receiver, event_id), None)
+        try:
+            await get_redis().delete(dedup_key(receiver, event_id))
+        except Exception as e:
+            print(f"Could not release event {event_id} in Redis: {e}")
+
+    def get_stats(self):
+        return {
+            "remembered": len(self._seen),
+            "duplicates": self.duplicates,
+            "local_hits": self.local_hits,
+        }
+
+
+# Events forwarded by the bots of this instance
+deduplicator = EventDeduplicator()
@@ -0,0 +1,178 @@
+import time
+from app.config import INSTANCE_IP, LEASE_TTL
+from app.redis_client import get_redis
+
+# lease:bot:{username} holds "{instance_ip}:{token}" of the instance syncing
+# the bot and expires after LEASE_TTL unless renewed. fence:bot:{username}
+# only ever increases, every lease gets a new token from it, so an instance
+# that lost a lease can tell from the token that it has been taken over.
+LEASE_PREFIX = "lease:bot:"
+FENCE_PREFIX = "fence:bot:"
+
+# Renewed in groups of this many leases per script call
+RENEW_BATCH = 500
+
+ACQUIRE = """
+local holder = redis.call('GET', KEYS[1])
+if holder and string.sub(holder, 1, string.len(ARGV[1]) + 1) ~= ARGV[1] .. ':' then
+    return false
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+return token
+"""
+
+# Extend the leases that still hold the expected value, return the positions
+# of the ones that were lost
+RENEW = """
+local lost = {}
+local ttl = ARGV[#ARGV]
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[i] then
+        redis.call('PEXPIRE', key, ttl)
+    else
+        table.insert(lost, i)
+    end
+end
+return lost
+"""
+
+# Write keys only while the lease still holds the expected value
+FENCED_SET = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i])
+end
+return 1
+"""
+
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def lease_key(username: str) -> str:
+    return f"{LEASE_PREFIX}{username}"
+
+
+def fence_key(username: str) -> str:
+    return f"{FENCE_PREFIX}{username}"
+
+
+class LeaseManager:
+    """
+    Sync leases of the bots of this instance.
+
+    A bot is only synced while its instance holds the lease, so two instances
+    never sync the same bot. Leases are renewed together on every heartbeat.
+    Locally a lease is only trusted until 90% of its TTL after the last
+    renewal: if Redis cannot be reached the bots are stopped before another
+    instance can take the lease over.
+    """
+
+    def __init__(self, instance_ip=INSTANCE_IP, ttl=LEASE_TTL):
+        self.instance_ip = instance_ip
+        self.ttl = ttl
+        self._leases = {}  # username -> (token, local deadline)
+        self.lost = 0
+
+    def _value(self, username):
+        return f"{self.instance_ip}:{self._leases[username][0]}"
+
+    def _deadline(self, started):
+        return started + self.ttl * 0.9
+
+    async def acquire(self, username: str):
+        """Take the lease of a bot, returns its fencing token or None if another instance holds it."""
+        started = time.monotonic()
+        token = await get_redis().eval(
+            ACQUIRE, 2, lease_key(username), fence_key(username),
+            self.instance_ip, int(self.ttl * 1000),
+        )
+        if token is None:
+            return None
+        self._leases[username] = (int(token), self._deadline(started))
+        return int(token)
+
+    async def renew(self):
+        """Extend all leases of this instance, returns the usernames whose lease was lost."""
+        lost = []
+        # Leases released or taken again while a batch is renewed are left alone
+        held = [(username, token) for username, (token, _) in self._leases.items()]
+        for i in range(0, len(held), RENEW_BATCH):
+            batch = held[i:i + RENEW_BATCH]
+            started = time.monotonic()
+            positions = await get_redis().eval(
+                RENEW, len(batch), *(lease_key(username) for username, _ in batch),
+                *(f"{self.instance_ip}:{token}" for _, token in batch), int(self.ttl * 1000),
+            )
+            lost_positions = set(positions)
+            for position, (username, token) in enumerate(batch, 1):
+                if self._leases.get(username, (None,))[0] != token:
+                    continue
+                if position in lost_positions:
+                    del self._leases[username]
+                    lost.append(username)
+                else:
+                    self._leases[username] = (token, self._deadline(started))
+        self.lost += len(lost)
+        return lost
+
+    async def release(self, username: str):
+        """Give up the lease of a bot that stopped syncing here."""
+        if username not in self._leases:
+            return
+        value = self._value(username)
+        del self._leases[username]
+        await get_redis().eval(RELEASE, 1, lease_key(username), value)
+
+    async def release_all(self):
+        """Give up every lease of this instance, when it shuts down."""
+        for username in list(self._leases):
+            await self.release(username)
+
+    async def fenced_set(self, username: str, values: dict) -> bool:
+        """
+        Set keys on behalf of a bot, only while this instance holds its lease.
+
+        The check uses the fencing token, so a write of an instance that lost
+        the lease is dropped even if it has not noticed yet.
+        """
+        if username not in self._leases:
+            return False
+        keys = list(values)
+        stored = await get_redis().eval(
+            FENCED_SET, len(keys) + 1, lease_key(username), *keys,
+            self._value(username), *(values[key] for key in keys),
+        )
+        return bool(stored)
+
+    async def holder(self, username: str):
+        """Instance holding the lease of a bot, or None, one Redis read."""
+        value = await get_redis().get(lease_key(username))
+        return value.rsplit(":", 1)[0] if value else None
+
+    def holds(self, username: str) -> bool:
+        lease = self._leases.get(username)
+        return lease is not None and time.monotonic() < lease[1]
+
+    def token(self, username: str):
+        """Fencing token of the lease held on a bot, or None."""
+        lease = self._leases.get(username)
+        return lease[0] if lease else None
+
+    def expired(self):
+        """Usernames whose lease can no longer be trusted locally."""
+        expired = [username for username in self._leases if not self.holds(username)]
+        for username in expired:
+            del self._leases[username]
+        self.lost += len(expired)
+        return expired
+
+    def __len__(self):
+        return len(self._leases)
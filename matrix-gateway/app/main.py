@@ -3,6 +3,11 @@ from fastapi import FastAPI
 from app.routes import bot_routes, message_routes
 from contextlib import asynccontextmanager
 from app.config import API_GATEWAY_URL
+from app.clients import client_pool, placement, sync_scheduler, send_queue, adopt_bot, release_bot
+from app.redis_client import close_redis
+from app.utils.gateway_com import forwarder, close_http_client
+from app.utils.nats_com import nats_publisher
+import asyncio
 import httpx
 
 @asynccontextmanager
@@ -19,11 +24,26 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Error during startup script: {e}")
 
+    # Close the clients that have not been used for a while
+    reaper = asyncio.create_task(client_pool.run_reaper())
+    # Heartbeat, and sync the bots the ring places on this instance
+    placer = asyncio.create_task(placement.run(client_pool.pinned, adopt_bot, release_bot))
+
     # Yield control to the application
     yield
 
     # Shutdown logic
     print("Shutting down application...")
+    reaper.cancel()
+    placer.cancel()
+    await asyncio.gather(reaper, placer, return_exceptions=True)
+    # Stop the sync loops before their leases and clients are given up
+    await sync_scheduler.close()
+    try:
+        # The other instances take over the bots right away
+        await placement.leave()
+    except Exception as e:
+        print(f"Error while leaving the placement: {e}")
     try:
         async with httpx.AsyncClient() as client:
             response = await client.post(f"{API_GATEWAY_URL}/bots/disconnect")
@@ -34,6 +54,13 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Error during shutdown: {e}")
 
+    await send_queue.close()
+    await client_pool.close_all()
+    await forwarder.close()
+    await nats_publisher.close()
+    await close_http_client()
+    await close_redis()
+
 
 # Pass the lifespan function to FastAPI
 app = FastAPI(lifespan=lifespan)
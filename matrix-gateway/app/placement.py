@@ -0,0 +1,220 @@
+import asyncio
+import bisect
+import hashlib
+from app.config import (
+    INSTANCE_IP,
+    PLACEMENT_HEARTBEAT_INTERVAL,
+    LEASE_TTL,
+    PLACEMENT_VNODES,
+    PLACEMENT_CONCURRENCY,
+)
+from app.redis_client import get_redis
+from app import bot_registry
+from app.leases import LeaseManager
+
+# Sorted set of the instances, scored by the (Redis) time their heartbeat
+# lease expires. Expired members are instances that died; they stay until
+# their bots have been taken over.
+INSTANCES_KEY = "instances"
+
+# Renew the lease of an instance and return all instances with their expiry,
+# using the clock of Redis so the instances do not need synchronised clocks
+HEARTBEAT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+if ARGV[1] ~= '' then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+end
+local instances = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+table.insert(instances, tostring(now))
+return instances
+"""
+
+# Remove an expired instance once it no longer has bots
+FORGET = """
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+local now = redis.call('TIME')
+if expires and tonumber(expires) < tonumber(now[1]) and redis.call('EXISTS', KEYS[2]) == 0 then
+    return redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def _hash(value: str) -> int:
+    # Stable over processes, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring of instances.
+
+    Every instance gets vnodes points on the ring, a bot belongs to the first
+    point after the hash of its username. When an instance joins or leaves,
+    only the bots of its points move.
+    """
+
+    def __init__(self, nodes=(), vnodes=PLACEMENT_VNODES):
+        self.nodes = sorted(set(nodes))
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node_for(self, key: str):
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class Placement:
+    """
+    Spreads the bots over the live matrix-gateway instances.
+
+    Every instance renews a heartbeat lease in Redis and builds the same hash
+    ring from the live instances. The instance index of the bot registry is
+    the assignment: an instance syncs the bots in its index. On every
+    heartbeat an instance
+    - moves its bots that the ring now places on another instance there,
+    - takes over the bots of expired instances that the ring places here,
+    - starts the bots assigned to it (adopt) and stops the ones that moved
+      away (release).
+    Before that it renews the sync leases of its bots and stops the bots
+    whose lease it lost.
+    """
+
+    def __init__(
+        self,
+        instance_ip=INSTANCE_IP,
+        heartbeat_interval=PLACEMENT_HEARTBEAT_INTERVAL,
+        heartbeat_ttl=LEASE_TTL,
+        vnodes=PLACEMENT_VNODES,
+        concurrency=PLACEMENT_CONCURRENCY,
+        leases=None,
+    ):
+        self.instance_ip = instance_ip
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_ttl = heartbeat_ttl
+        self.vnodes = vnodes
+        self.concurrency = concurrency
+        self.leases = leases if leases is not None else LeaseManager(instance_ip, heartbeat_ttl)
+        self.ring = HashRing([instance_ip], vnodes)
+        self.expired = []
+        self.rebalances = 0
+        self.moved = 0
+
+    def owner(self, username: str) -> str:
+        """Instance the bot belongs on, by the last known ring."""
+        return self.ring.node_for(username) or self.instance_ip
+
+    def is_local(self, username: str) -> bool:
+        return self.owner(username) == self.instance_ip
+
+    async def heartbeat(self, renew=True):
+        """Renew the lease of this instance and rebuild the ring from the live instances."""
+        reply = await get_redis().eval(
+            HEARTBEAT, 1, INSTANCES_KEY, self.instance_ip if renew else "", self.heartbeat_ttl,
+        )
+        now = float(reply.pop())
+        instances = dict(zip(reply[::2], map(float, reply[1::2])))
+        # Sorted like the nodes of the ring, Redis returns them by expiry
+        live = sorted(instance for instance, expires in instances.items() if expires >= now)
+        self.expired = [instance for instance, expires in instances.items() if expires < now]
+        if live != self.ring.nodes:
+            print(f"Instances changed: {live}")
+        self.ring = HashRing(live or [self.instance_ip], self.vnodes)
+        return live
+
+    async def rebalance(self, running, adopt, release):
+        """
+        Move bots to the instances the ring places them on.
+
+        running returns the usernames syncing here, adopt(username) starts
+        syncing a bot and release(username) stops it.
+        """
+        moved = 0
+        # Bots of this instance that now belong on another instance
+        async for username in bot_registry.iter_bots(self.instance_ip):
+            owner = self.owner(username)
+            if owner != self.instance_ip:
+                moved += await bot_registry.assign_bot(username, owner, from_instance=self.instance_ip)
+
+        # Bots left behind by expired instances that belong here
+        for instance_ip in self.expired:
+            async for username in bot_registry.iter_bots(instance_ip):
+                if self.is_local(username):
+                    moved += await bot_registry.assign_bot(username, self.instance_ip, from_instance=instance_ip)
+            await get_redis().eval(FORGET, 2, INSTANCES_KEY, bot_registry.instance_index(instance_ip), instance_ip)
+
+        assigned = {username async for username in bot_registry.iter_bots(self.instance_ip)}
+        syncing = set(running())
+        for username in syncing - assigned:
+            print(f"Handing off bot {username}")
+            await release(username)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def start(username):
+            async with semaphore:
+                try:
+                    await adopt(username)
+                except Exception as e:
+                    print(f"Error taking over bot {username}: {e}")
+
+        to_adopt = assigned - syncing
+        if to_adopt:
+            print(f"Taking over {len(to_adopt)} bots")
+            await asyncio.gather(*(start(username) for username in sorted(to_adopt)))
+
+        self.rebalances += 1
+        self.moved += moved
+        return moved
+
+    async def renew_leases(self, release):
+        """Renew the sync leases, stop the bots whose lease was lost or could not be renewed in time."""
+        try:
+            lost = await self.leases.renew()
+        except Exception as e:
+            print(f"Error renewing sync leases: {e}")
+            lost = self.leases.expired()
+        for username in lost:
+            print(f"Lost the sync lease of bot {username}")
+            await release(username)
+
+    async def run(self, running, adopt, release):
+        """Background task: heartbeat and rebalance every heartbeat_interval seconds."""
+        while True:
+            try:
+                await self.renew_leases(release)
+                await self.heartbeat()
+                await self.rebalance(running, adopt, release)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error during placement: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def leave(self):
+        """
+        Give up the heartbeat and the sync leases, so the other instances
+        take over the bots right away. The sync loops must have stopped.
+        """
+        await get_redis().zadd(INSTANCES_KEY, {self.instance_ip: 0})
+        await self.leases.release_all()
+
+    def get_stats(self):
+        return {
+            "instance": self.instance_ip,
+            "instances": self.ring.nodes,
+            "expired": self.expired,
+            "vnodes": self.vnodes,
+            "rebalances": self.rebalances,
+            "moved": self.moved,
+            "leases": len(self.leases),
+            "leases_lost": self.leases.lost,
+        }
@@ -0,0 +1,31 @@
+import asyncio
+import weakref
+import redis.asyncio as redis
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD, REDIS_MAX_CONNECTIONS
+
+# Connections belong to the event loop that opened them. The service runs a
+# single loop, so this is one client, but the test client starts a loop per
+# request.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis() -> redis.Redis:
+    """Shared async Redis client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        pool = redis.ConnectionPool(
+            host=REDIS_URL,
+            port=REDIS_PORT,
+            password=REDIS_PASSWORD,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            decode_responses=True,
+        )
+        client = _clients[loop] = redis.Redis(connection_pool=pool)
+    return client
+
+
+async def close_redis():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
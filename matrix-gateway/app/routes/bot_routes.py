@@ -1,17 +1,13 @@
-from fastapi import APIRouter
-import httpx
+from fastapi import APIRouter, Query
 from pydantic import BaseModel
-from app.config import REDIS_URL, INSTANCE_IP
-from app.clients import create_client, get_client_from_pool, start_sync
-import redis
-import json
-from fastapi import HTTPException
+from app.clients import create_client, start_sync, client_pool, placement, leases, sync_scheduler
+from app.config import INSTANCE_IP
+from app import bot_registry
+from app.utils.gateway_com import forwarder
+from app.event_dedup import deduplicator
 
 router = APIRouter()
 
-# Redis client
-redis_client = redis.StrictRedis(host=REDIS_URL, port=6379, password='yourpassword', decode_responses=True)
-
 class BotCredentials(BaseModel):
     username: str
     password: str
@@ -19,71 +15,95 @@ class BotCredentials(BaseModel):
 class RemoveBotRequest(BaseModel):
     username: str
 
-async def creator_exists(creator_ip):
-    url = f"http://{creator_ip}:8000"  # Ensure INSTANCE_IP is defined and valid
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            status_code = response.status_code
-            print(f"Status code: {status_code}")
-            return status_code == 200  # Return True if status code is 200, otherwise False
-    except httpx.RequestError as e:
-        print(f"Error while making request: {e}")
-        return False  # Return False in case of any request error
-
-def fetch_creator_ip(username):
-    print("Fetch creator ip")
-    client_data = redis_client.get(username)
-    if not client_data:
-        raise HTTPException(status_code=404, detail="Client not found in Redis")
-
-    print("JSON loads")
-    client_data = json.loads(client_data)
-    return client_data.get("instance_ip", "No IP found")
-
 @router.post("/add")
 async def add_bot(credentials: BotCredentials):
     print("Enter /add function")
-    # Check if the bot already exists in Redis
+    # Syncing on this instance, no need to ask Redis
+    if client_pool.is_pinned(credentials.username):
+        return {"message": "Bot already exists"}
+    # Check if the bot already exists in Redis, one read instead of exists + get
     print("start check")
-    if redis_client.exists(credentials.username):
+    client_data = await bot_registry.get_bot(credentials.username)
+    if client_data:
         print("Already in redis")
-        creator_ip = fetch_creator_ip(credentials.username)
-        print(f"creator ip = {creator_ip}")
-        alive = False
-        if creator_ip != "No IP found":
-            alive = await creator_exists(creator_ip)
-        print(f"alive = {alive}")
-        if alive:
+        # Synced somewhere while an instance holds its lease
+        holder = await leases.holder(credentials.username)
+        print(f"lease holder = {holder}")
+        if holder:
+            return {"message": "Bot already exists"}
+        elif not await bot_registry.unregister_bot(credentials.username, expected=client_data):
+            # Registered again by another instance while we checked the lease
             return {"message": "Bot already exists"}
-        else:
-            redis_client.delete(credentials.username)
     print("Credentials have username")
-    # Create and start syncing the bot
+    # Create the bot, it is synced by the instance the ring places it on
     client = await create_client(credentials.username, credentials.password)
     print("Client is created")
-    await start_sync(client)
-    print("Client is started in sync")
+    owner = placement.owner(credentials.username)
+    if owner == INSTANCE_IP:
+        if await leases.acquire(credentials.username) is None:
+            # Another instance took the bot over in the meantime
+            return {"message": "Bot already exists"}
+        # The lease is re-entrant, the placement loop may have adopted the bot meanwhile
+        if client_pool.is_pinned(credentials.username):
+            return {"message": f"Bot {credentials.username} added"}
+        await start_sync(client)
+        print("Client is started in sync")
+    else:
+        await bot_registry.assign_bot(credentials.username, owner, from_instance=INSTANCE_IP)
+        print(f"Client is handed over to {owner}")
     return {"message": f"Bot {credentials.username} added"}
 
 @router.get("/")
-async def list_bots():
-    # List all bots stored in Redis
-    bot_keys = redis_client.keys("*")
-    return {"bots": bot_keys}
+async def list_bots(
+    cursor: str = "",
+    count: int = Query(100, ge=1, le=1000),
+    instance: str = None,
+):
+    # One page of the registered bots, pass next_cursor back for the next page
+    bots, next_cursor = await bot_registry.list_bots(cursor, count, instance)
+    return {"bots": bots, "next_cursor": next_cursor}
+
+@router.get("/instance")
+async def list_instance_bots(cursor: str = "", count: int = Query(100, ge=1, le=1000)):
+    # One page of the bots registered by this instance
+    bots, next_cursor = await bot_registry.list_bots(cursor, count, INSTANCE_IP)
+    return {"instance": INSTANCE_IP, "bots": bots, "next_cursor": next_cursor}
 
 @router.post("/remove")
 async def remove_bot(payload: RemoveBotRequest):
     username = payload.username
 
-    # Check if the bot exists in Redis
-    if not redis_client.exists(username):
+    # Take the live client out of the pool, this also stops its sync loop
+    client = client_pool.pop(username, None)
+    await sync_scheduler.stop(username)
+
+    if client is not None:
+        await client.close()
+    await leases.release(username)
+
+    # Remove the bot from the registry, removing nothing means it did not exist
+    deleted = await bot_registry.unregister_bot(username)
+    await sync_scheduler.delete_state(username)
+    if client is None and not deleted:
         return {"message": "Bot not found"}
+    return {"message": f"Bot {username} removed"}
+
+@router.get("/pool")
+async def pool_stats():
+    # Live clients of this instance
+    return client_pool.get_stats()
+
+@router.get("/placement")
+async def placement_stats():
+    # Instances on the ring and the bots moved between them
+    return placement.get_stats()
 
-    # Retrieve the client from Redis and close it
-    client = await get_client_from_pool(username)
-    await client.close()
+@router.get("/sync")
+async def sync_stats():
+    # Sync loops of this instance
+    return sync_scheduler.get_stats()
 
-    # Remove the bot from Redis
-    redis_client.delete(username)
-    return {"message": f"Bot {username} removed"}
\ No newline at end of file
+@router.get("/forwarding")
+async def forwarding_stats():
+    # Chat messages forwarded to the API gateway, and the duplicates skipped
+    return {**forwarder.get_stats(), "deduplication": deduplicator.get_stats()}
@@ -1,38 +1,44 @@
+from typing import Optional
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from app.config import REDIS_URL
-from app.clients import get_client_from_pool
-import redis
+from app.clients import get_client, send_queue
+from app.send_queue import QueueFull
 
 router = APIRouter()
 
-# Redis client
-redis_client = redis.StrictRedis(host=REDIS_URL, port=6379, password='yourpassword', decode_responses=True)
-
 # Define a request model
 class MessageRequest(BaseModel):
     username: str
     room_id: str
     message: str
+    # Sending the same txn_id again does not send the message twice
+    txn_id: Optional[str] = None
 
-@router.post("/send")
+@router.post("/send", status_code=202)
 async def send_message(payload: MessageRequest):
-    username = payload.username
-    room_id = payload.room_id
-    message = payload.message
-
-    # Check if the bot exists in Redis
-    if not redis_client.exists(username):
+    # Live client from the pool, only rehydrated from Redis on a miss
+    client = await get_client(payload.username)
+    if client is None:
         raise HTTPException(status_code=404, detail="Bot not found")
 
-    # Retrieve the bot's client and send the message
+    # Sent in the background, GET /messages/status/{txn_id} tells when it is delivered
     try:
-        client = await get_client_from_pool(username)
-        await client.room_send(
-            room_id=room_id,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": message},
-        )
-        return {"message": f"Message sent to {room_id}"}
+        delivery = await send_queue.submit(payload.username, payload.room_id, payload.message, payload.txn_id)
+    except QueueFull as e:
+        return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": "1"})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send message: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to queue message: {e}")
+    return {"message": f"Message queued for {payload.room_id}", **delivery}
+
+@router.get("/status/{txn_id}")
+async def message_status(txn_id: str):
+    delivery = await send_queue.status(txn_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return delivery
+
+@router.get("/stats")
+async def send_stats():
+    # Messages waiting, sent, failed and rate-limited on this instance
+    return send_queue.get_stats()
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+from nio import RoomSendError, RoomSendResponse
+from app.config import (
+    SEND_BOT_RATE,
+    SEND_BOT_BURST,
+    SEND_ROOM_RATE,
+    SEND_ROOM_BURST,
+    SEND_MAX_PENDING,
+    SEND_MAX_ATTEMPTS,
+    SEND_BACKOFF_BASE,
+    SEND_BACKOFF_MAX,
+    SEND_STATUS_TTL,
+)
+from app.redis_client import get_redis
+
+# send:txn:{txn_id} holds the delivery status of a message as JSON, shared
+# by the instances and kept for SEND_STATUS_TTL seconds
+SEND_STATUS_PREFIX = "send:txn:"
+
+# Delay when the homeserver rate-limits without saying for how long
+DEFAULT_RETRY_AFTER = 1.0
+
+# Store a new delivery unless the transaction ID is known and did not fail,
+# returns the stored delivery in that case
+SUBMIT = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['status'] ~= 'failed' then
+    return current
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+"""
+
+
+def status_key(txn_id: str) -> str:
+    return f"{SEND_STATUS_PREFIX}{txn_id}"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    """rate tokens per second, at most burst of them saved up."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token can be taken."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Hand out no tokens for the next seconds, and start empty after that."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and time.monotonic() >= self.blocked_until
+
+
+class SendQueue:
+    """
+    Sends the outgoing messages of the bots in the background.
+
+    Every room of a bot has its own queue, worked off in order by one task,
+    so messages to a room keep their order while other rooms go ahead. A
+    message is sent once both the bucket of its bot and the bucket of its
+    room have a token. When the homeserver answers M_LIMIT_EXCEEDED, the bot
+    gets no tokens for retry_after_ms and the message is retried. Other
+    failures are retried after an exponential backoff with full jitter. A
+    message fails after max_attempts failed attempts, rate-limited ones
+    included, so one room cannot hold up its queue forever.
+
+    Every message has a transaction ID, used as the Matrix txnId so a
+    retried send is not delivered twice. Submitting a transaction ID again
+    returns its status instead of queueing the message again, unless its
+    delivery failed: then it is queued for a new try.
+
+    send(username, room_id, message, txn_id) does the actual send and
+    returns the nio response.
+    """
+
+    def __init__(
+        self,
+        send,
+        bot_rate=SEND_BOT_RATE,
+        bot_burst=SEND_BOT_BURST,
+        room_rate=SEND_ROOM_RATE,
+        room_burst=SEND_ROOM_BURST,
+        max_pending=SEND_MAX_PENDING,
+        max_attempts=SEND_MAX_ATTEMPTS,
+        backoff_base=SEND_BACKOFF_BASE,
+        backoff_max=SEND_BACKOFF_MAX,
+        status_ttl=SEND_STATUS_TTL,
+    ):
+        self.send = send
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.status_ttl = status_ttl
+        self._queues = {}  # (username, room_id) -> deque of deliveries
+        self._workers = {}  # (username, room_id) -> task working off the queue
+        self._bot_buckets = {}  # username -> TokenBucket
+        self._room_buckets = {}  # (username, room_id) -> TokenBucket
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    async def submit(self, username: str, room_id: str, message: str, txn_id: str = None) -> dict:
+        """
+        Queue a message, returns its delivery status.
+
+        Raises QueueFull when max_pending messages are already waiting.
+        """
+        if self.pending >= self.max_pending:
+            raise QueueFull(f"{self.pending} messages are waiting to be sent")
+        delivery = {
+            "txn_id": txn_id or uuid.uuid4().hex,
+            "username": username,
+            "room_id": room_id,
+            "status": "queued",
+            "attempts": 0,
+        }
+        # The first submit of a transaction ID wins, on any instance
+        existing = await get_redis().eval(
+            SUBMIT, 1, status_key(delivery["txn_id"]), json.dumps(delivery), self.status_ttl,
+        )
+        if existing:
+            return json.loads(existing)
+
+        key = (username, room_id)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._workers[key] = asyncio.create_task(self._work(key, queue))
+        queue.append((delivery, message))
+        self.pending += 1
+        return delivery
+
+    async def status(self, txn_id: str):
+        """Delivery status of a message, or None if it is unknown (or expired)."""
+        delivery = await get_redis().get(status_key(txn_id))
+        return json.loads(delivery) if delivery else None
+
+    async def _update(self, delivery, status, **fields):
+        delivery.update(status=status, **fields)
+        try:
+            await get_redis().set(status_key(delivery["txn_id"]), json.dumps(delivery), ex=self.status_ttl)
+        except Exception as e:
+            print(f"Could not store the status of message {delivery['txn_id']}: {e}")
+
+    def _bot_bucket(self, username):
+        bucket = self._bot_buckets.get(username)
+        if bucket is None:
+            bucket = self._bot_buckets[username] = TokenBucket(self.bot_rate, self.bot_burst)
+        return bucket
+
+    def _room_bucket(self, key):
+        bucket = self._room_buckets.get(key)
+        if bucket is None:
+            bucket = self._room_buckets[key] = TokenBucket(self.room_rate, self.room_burst)
+        return bucket
+
+    async def _acquire(self, username, key):
+        """Wait for a token of both the bot and the room."""
+        bot, room = self._bot_bucket(username), self._room_bucket(key)
+        while True:
+            delay = max(bot.delay(), room.delay())
+            if delay <= 0:
+                bot.take()
+                room.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _work(self, key, queue):
+        try:
+            while queue:
+                delivery, message = queue[0]
+                await self._deliver(key, delivery, message)
+                queue.popleft()
+                self.pending -= 1
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+            # A bucket that filled up again is the same as a new one
+            bucket = self._room_buckets.get(key)
+            if bucket is not None and bucket.full():
+                del self._room_buckets[key]
+
+    async def _deliver(self, key, delivery, message):
+        username, room_id = key
+        failures = 0
+        while True:
+            await self._acquire(username, key)
+            delivery["attempts"] += 1
+            try:
+                response = await self.send(username, room_id, message, delivery["txn_id"])
+            except asyncio.CancelledError:
+                raise
+            except LookupError as e:
+                # The bot is gone, retrying will not bring it back
+                self.failed += 1
+                await self._update(delivery, "failed", error=str(e))
+                return
+            except Exception as e:
+                response = e
+
+            if not isinstance(response, (RoomSendError, Exception)):
+                self.sent += 1
+                event_id = response.event_id if isinstance(response, RoomSendResponse) else None
+                await self._update(delivery, "sent", event_id=event_id)
+                return
+
+            limited = isinstance(response, RoomSendError) and response.status_code == "M_LIMIT_EXCEEDED"
+            if limited:
+                # Limited per user by the homeserver, so the whole bot waits
+                self.rate_limited += 1
+                retry_after = response.retry_after_ms / 1000 if response.retry_after_ms else DEFAULT_RETRY_AFTER
+                self._bot_bucket(username).block(retry_after)
+                error = "M_LIMIT_EXCEEDED"
+            else:
+                error = getattr(response, "message", None) or str(response)
+
+            failures += 1
+            if failures >= self.max_attempts:
+                self.failed += 1
+                await self._update(delivery, "failed", error=error)
+                print(f"Giving up on message {delivery['txn_id']} to {room_id}: {error}")
+                return
+            await self._update(delivery, "retrying", error=error)
+            if limited:
+                # The bucket of the bot makes it wait
+                continue
+            self.retries += 1
+            await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** failures)))
+
+    async def close(self):
+        """Stop sending, the messages still queued are marked as failed."""
+        workers = list(self._workers.values())
+        unsent = [delivery for queue in self._queues.values() for delivery, _ in queue]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for delivery in unsent:
+            await self._update(delivery, "failed", error="matrix-gateway shut down before sending")
+        self.pending = 0
+
+    def get_stats(self):
+        return {
+            "pending": self.pending,
+            "rooms": len(self._queues),
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+        }
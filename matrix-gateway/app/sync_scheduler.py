@@ -0,0 +1,203 @@
+import asyncio
+import random
+import weakref
+import aiohttp
+from nio import AsyncClient, SyncResponse
+from app.config import (
+    SYNC_MAX_CONCURRENT,
+    SYNC_MAX_CONNECTIONS,
+    SYNC_RESERVED_CONNECTIONS,
+    SYNC_TIMEOUT,
+    SYNC_MIN_TIMEOUT,
+    SYNC_BACKOFF_BASE,
+    SYNC_BACKOFF_MAX,
+)
+from app.sync_state import RedisSyncStateStore, snapshot_rooms, restore, fingerprint
+
+# Connections belong to the event loop that opened them, see app/redis_client.py
+_connectors = weakref.WeakKeyDictionary()
+
+
+def shared_connector() -> aiohttp.TCPConnector:
+    """Connection pool to the homeserver shared by all clients of the running event loop."""
+    loop = asyncio.get_running_loop()
+    connector = _connectors.get(loop)
+    if connector is None or connector.closed:
+        connector = _connectors[loop] = aiohttp.TCPConnector(limit=SYNC_MAX_CONNECTIONS)
+    return connector
+
+
+def attach(client: AsyncClient):
+    """
+    Let a client send its requests over the shared connection pool.
+
+    The client gets a session of its own that does not own the connector, so
+    closing the client leaves the connections of the other bots alone.
+    """
+    if client.client_session is None:
+        client.client_session = aiohttp.ClientSession(
+            connector=shared_connector(),
+            connector_owner=False,
+            timeout=aiohttp.ClientTimeout(total=client.config.request_timeout),
+        )
+
+
+class SyncScheduler:
+    """
+    Runs the sync loops of all bots of this instance.
+
+    At most max_concurrent long-polls are open at the same time, the other
+    bots wait for a slot. It is capped so that the shared connection pool
+    always keeps SYNC_RESERVED_CONNECTIONS free for sends and joins, which
+    would otherwise queue behind the long-polls. The long-poll timeout adapts to that: it is timeout
+    while every bot gets a slot, and shrinks (down to min_timeout) while bots
+    are waiting, so the slots rotate. Failed syncs are retried after an
+    exponential backoff with full jitter, so bots that failed together do not
+    retry together. After every sync the sync state (next_batch, and the
+    rooms when they changed) is saved to the store, and a (re)started bot is
+    restored from it, so it continues with an incremental sync.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        max_concurrent=SYNC_MAX_CONCURRENT,
+        timeout=SYNC_TIMEOUT,
+        min_timeout=SYNC_MIN_TIMEOUT,
+        backoff_base=SYNC_BACKOFF_BASE,
+        backoff_max=SYNC_BACKOFF_MAX,
+    ):
+        self.store = store if store is not None else RedisSyncStateStore()
+        self.max_concurrent = max(min(max_concurrent, SYNC_MAX_CONNECTIONS - SYNC_RESERVED_CONNECTIONS), 1)
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._tasks = {}  # username -> sync task
+        self._saved_rooms = {}  # username -> fingerprint of the rooms last saved
+        self.waiting = 0
+        self.syncs = 0
+        self.errors = 0
+
+    def __contains__(self, username):
+        return username in self._tasks
+
+    def long_poll_timeout(self) -> int:
+        """Long-poll timeout in ms for the next sync."""
+        if not self.waiting:
+            return self.timeout
+        share = self.max_concurrent / (self.max_concurrent + self.waiting)
+        return max(self.min_timeout, int(self.timeout * share))
+
+    def backoff(self, failures: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** failures))
+
+    def start(self, username: str, client: AsyncClient, on_first_sync=None) -> asyncio.Task:
+        """Start the sync loop of a bot, on_first_sync(client) runs after its first sync."""
+        task = self._tasks.get(username)
+        if task is not None and not task.done():
+            return task
+        task = asyncio.create_task(self._run(username, client, on_first_sync))
+        self._tasks[username] = task
+        task.add_done_callback(lambda done: self._forget(username, done))
+        return task
+
+    def _forget(self, username, task):
+        if self._tasks.get(username) is task:
+            del self._tasks[username]
+            self._saved_rooms.pop(username, None)
+
+    async def _sync(self, client, timeout, since):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await client.sync(timeout=timeout, since=since)
+        finally:
+            self._slots.release()
+
+    async def _run(self, username, client, on_first_sync):
+        attach(client)
+        await self.load_state(username, client)
+        since = client.next_batch or None
+        first_sync = True
+        failures = 0
+        while True:
+            # The first sync returns right away, like sync_forever
+            timeout = 0 if first_sync else self.long_poll_timeout()
+            try:
+                response = await self._sync(client, timeout, since)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                response = e
+            if not isinstance(response, SyncResponse):
+                failures += 1
+                self.errors += 1
+                delay = self.backoff(failures)
+                print(f"Sync of {username} failed ({response}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+            self.syncs += 1
+            since = None  # From now on the client continues from its own next_batch
+            await client.run_response_callbacks([response])
+            await self.save_state(username, client, response.next_batch)
+            if first_sync:
+                first_sync = False
+                if on_first_sync is not None:
+                    await on_first_sync(client)
+
+    async def load_state(self, username, client):
+        try:
+            state = await self.store.load(username)
+            restore(client, state)
+            if state.get("rooms") is not None:
+                self._saved_rooms[username] = fingerprint(state["rooms"])
+        except Exception as e:
+            print(f"Could not load the sync state of {username}: {e}")
+
+    async def save_state(self, username, client, next_batch):
+        try:
+            rooms = snapshot_rooms(client)
+            rooms_fingerprint = fingerprint(rooms)
+            changed = self._saved_rooms.get(username) != rooms_fingerprint
+            # Not written once the lease was lost, the next holder saves them
+            if await self.store.save(username, next_batch, rooms if changed else None):
+                self._saved_rooms[username] = rooms_fingerprint
+        except Exception as e:
+            print(f"Could not store the sync state of {username}: {e}")
+
+    async def delete_state(self, username):
+        """Forget the sync state of a bot that was removed."""
+        try:
+            await self.store.delete(username)
+        except Exception as e:
+            print(f"Could not delete the sync state of {username}: {e}")
+
+    async def stop(self, username):
+        task = self._tasks.pop(username, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def close(self):
+        for username in list(self._tasks):
+            await self.stop(username)
+        connector = _connectors.pop(asyncio.get_running_loop(), None)
+        if connector is not None:
+            await connector.close()
+
+    def get_stats(self):
+        return {
+            "syncing": len(self._tasks),
+            "max_concurrent": self.max_concurrent,
+            "waiting": self.waiting,
+            "long_poll_timeout": self.long_poll_timeout(),
+            "syncs": self.syncs,
+            "errors": self.errors,
+        }
@@ -0,0 +1,184 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+from urllib.parse import quote
+from nio import AsyncClient, MatrixRoom, MatrixInvitedRoom
+from app.config import SYNC_STATE_BACKEND, SYNC_STATE_DIR
+from app.redis_client import get_redis
+
+# Redis keys of the sync state of a bot, next_batch is written after every
+# sync, the rooms only when they changed
+SYNC_TOKEN_PREFIX = "sync:bot:"
+SYNC_ROOMS_PREFIX = "sync:rooms:"
+
+
+def sync_token_key(username: str) -> str:
+    return f"{SYNC_TOKEN_PREFIX}{username}"
+
+
+def sync_rooms_key(username: str) -> str:
+    return f"{SYNC_ROOMS_PREFIX}{username}"
+
+
+def snapshot_rooms(client: AsyncClient) -> dict:
+    """Joined and invited rooms of a client with their names and members."""
+    return {
+        "joined": {
+            room_id: {
+                "name": room.name,
+                "canonical_alias": room.canonical_alias,
+                "topic": room.topic,
+                "members": {user_id: user.display_name for user_id, user in room.users.items()},
+            }
+            for room_id, room in client.rooms.items()
+        },
+        "invited": {
+            room_id: {"name": room.name, "inviter": room.inviter}
+            for room_id, room in client.invited_rooms.items()
+        },
+    }
+
+
+def restore(client: AsyncClient, state: dict):
+    """Put a stored sync state back into a client, so its next sync is incremental."""
+    if state.get("next_batch"):
+        client.next_batch = state["next_batch"]
+    rooms = state.get("rooms") or {}
+    for room_id, stored in rooms.get("joined", {}).items():
+        room = client.rooms.get(room_id) or MatrixRoom(room_id, client.user_id)
+        room.name = stored.get("name")
+        room.canonical_alias = stored.get("canonical_alias")
+        room.topic = stored.get("topic")
+        for user_id, display_name in stored.get("members", {}).items():
+            room.add_member(user_id, display_name, None)
+        client.rooms[room_id] = room
+    for room_id, stored in rooms.get("invited", {}).items():
+        room = client.invited_rooms.get(room_id) or MatrixInvitedRoom(room_id, client.user_id)
+        room.name = stored.get("name")
+        room.inviter = stored.get("inviter")
+        client.invited_rooms[room_id] = room
+
+
+def fingerprint(rooms: dict) -> str:
+    return hashlib.sha1(json.dumps(rooms, sort_keys=True).encode()).hexdigest()
+
+
+class SyncStateStore(abc.ABC):
+    """
+    Where the sync state of the bots is kept: the next_batch token and the
+    rooms (joined rooms with their members, invited rooms).
+
+    load returns {"next_batch": ..., "rooms": ...}, with None for what is not
+    stored. save gets rooms=None when the rooms did not change since the
+    last save, and returns False when the state was not written.
+    """
+
+    @abc.abstractmethod
+    async def load(self, username: str) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def save(self, username: str, next_batch: str, rooms: dict = None) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, username: str):
+        ...
+
+
+class RedisSyncStateStore(SyncStateStore):
+    """
+    Sync state in Redis, shared by the instances so a moved bot resumes too.
+
+    With leases, a bot's state is only written while this instance holds its
+    lease (fenced on the lease token).
+    """
+
+    def __init__(self, leases=None):
+        self.leases = leases
+
+    async def load(self, username):
+        next_batch, rooms = await get_redis().mget(sync_token_key(username), sync_rooms_key(username))
+        return {"next_batch": next_batch, "rooms": json.loads(rooms) if rooms else None}
+
+    async def save(self, username, next_batch, rooms=None):
+        values = {sync_token_key(username): next_batch}
+        if rooms is not None:
+            values[sync_rooms_key(username)] = json.dumps(rooms)
+        if self.leases is None:
+            await get_redis().mset(values)
+            return True
+        # Only while this instance still holds the bot
+        return await self.leases.fenced_set(username, values)
+
+    async def delete(self, username):
+        await get_redis().delete(sync_token_key(username), sync_rooms_key(username))
+
+
+class FileSyncStateStore(SyncStateStore):
+    """
+    Sync state in local files, {directory}/{username}.next_batch and
+    {username}.rooms.json. Only resumes bots restarted on the same host (or
+    a shared volume). Files are replaced atomically, off the event loop.
+    """
+
+    def __init__(self, directory=SYNC_STATE_DIR):
+        self.directory = directory
+
+    def _path(self, username, suffix):
+        # Escaped, a username with a / must not leave the directory
+        return os.path.join(self.directory, f"{quote(username, safe='')}.{suffix}")
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, content):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def _load(self, username):
+        rooms = self._read(self._path(username, "rooms.json"))
+        return {
+            "next_batch": self._read(self._path(username, "next_batch")),
+            "rooms": json.loads(rooms) if rooms else None,
+        }
+
+    def _save(self, username, next_batch, rooms):
+        self._write(self._path(username, "next_batch"), next_batch)
+        if rooms is not None:
+            self._write(self._path(username, "rooms.json"), json.dumps(rooms))
+
+    def _delete(self, username):
+        for suffix in ("next_batch", "rooms.json"):
+            try:
+                os.remove(self._path(username, suffix))
+            except FileNotFoundError:
+                pass
+
+    async def load(self, username):
+        return await asyncio.to_thread(self._load, username)
+
+    async def save(self, username, next_batch, rooms=None):
+        await asyncio.to_thread(self._save, username, next_batch, rooms)
+        return True
+
+    async def delete(self, username):
+        await asyncio.to_thread(self._delete, username)
+
+
+def make_store(backend=SYNC_STATE_BACKEND, leases=None) -> SyncStateStore:
+    """Sync state store configured by SYNC_STATE_BACKEND: redis or file."""
+    if backend == "redis":
+        return RedisSyncStateStore(leases)
+    if backend == "file":
+        return FileSyncStateStore()
+    raise ValueError(f"Unknown sync state backend: {backend}")
@@ -1,12 +1,11 @@
-from app.config import API_GATEWAY_URL
+from app.config import LOG_EVENTS
 from nio import MatrixRoom, RoomMessageText
-from .gateway_com import send_to_gateway
-import json
-import httpx
+from app.event_dedup import deduplicator
+from .gateway_com import forwarder
 
 async def message_listener(room, event):
-    print(f"Event: {event}, Room: {room}")
-    print(f"Event type: {type(event).__name__}, Room type: {type(room).__name__}")
+    if LOG_EVENTS:
+        print(f"Event: {event}, Room: {room}")
 
     if not isinstance(event, RoomMessageText):
         print("Skipping: event is not RoomMessageText")
@@ -24,6 +23,12 @@ async def message_listener(room, event):
         print("Skipping: sender and receiver are the same")
         return
 
+    # Sync retries, re-joined rooms and a bot moving between instances can
+    # deliver the same event again
+    if await deduplicator.is_duplicate(receiver, event.event_id):
+        print(f"Skipping: event {event.event_id} was already forwarded")
+        return
+
     payload = {
         "room_id": room.room_id,
         "room_name": room.display_name,
@@ -31,7 +36,15 @@ async def message_listener(room, event):
         "receiver": receiver,
         "message": event.body,
         "timestamp": event.server_timestamp,
+        "event_id": event.event_id,
     }
-    print(f"Payload to be sent: {payload}")
 
-    await send_to_gateway("/bots/chat_message", payload)
+    # Sent to the gateway in a batch with the other messages of this moment,
+    # in the order the events were received
+    forwarded = False
+    try:
+        forwarded = await forwarder.forward(payload)
+    finally:
+        if not forwarded:
+            # Dropped, so a redelivery of the event must not be skipped
+            await deduplicator.release(receiver, event.event_id)
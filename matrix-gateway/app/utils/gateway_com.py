@@ -1,5 +1,54 @@
+import asyncio
+import random
+import weakref
 import httpx
-from app.config import API_GATEWAY_URL
+from app.config import (
+    API_GATEWAY_URL,
+    GATEWAY_HTTP2,
+    GATEWAY_MAX_CONNECTIONS,
+    FORWARD_BATCH_SIZE,
+    FORWARD_FLUSH_INTERVAL,
+    FORWARD_MAX_PENDING,
+    FORWARD_ENQUEUE_TIMEOUT,
+    FORWARD_RETRIES,
+    FORWARD_TRANSPORT,
+)
+from app.event_dedup import deduplicator as event_deduplicator
+from app.utils.nats_com import nats_publisher
+
+CHAT_MESSAGE_BATCH_PATH = "/bots/chat_message/batch"
+CHAT_MESSAGE_PATH = "/bots/chat_message"
+
+# Connections belong to the event loop that opened them, see app/redis_client.py
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    HTTP client to the API gateway shared by the running event loop.
+
+    Keeps its connections alive between requests. With GATEWAY_HTTP2 it
+    speaks HTTP/2 to gateways that offer it (over TLS), and HTTP/1.1 to the
+    others.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            http2=GATEWAY_HTTP2,
+            limits=httpx.Limits(
+                max_connections=GATEWAY_MAX_CONNECTIONS,
+                max_keepalive_connections=GATEWAY_MAX_CONNECTIONS,
+            ),
+        )
+    return client
+
+
+async def close_http_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
 
 async def send_to_gateway(extension, payload):
     """
@@ -17,7 +66,174 @@ async def send_to_gateway(extension, payload):
         httpx.HTTPStatusError: If the API response indicates an HTTP error.
     """
     url = f"{API_GATEWAY_URL}{extension}"
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=payload)
-        response.raise_for_status()  # Raise for HTTP errors
-        return response.json()
+    response = await get_http_client().post(url, json=payload)
+    response.raise_for_status()  # Raise for HTTP errors
+    return response.json()
+
+
+class ChatForwarder:
+    """
+    Forwards the chat messages of all bots to the API gateway in batches.
+
+    Messages wait in a bounded queue until batch_size of them are collected
+    or the oldest waited flush_interval seconds, and then go out in one POST
+    to /bots/chat_message/batch. When the queue is full, forward() waits
+    for room (back-pressure on the sync loop of the bot) and drops the
+    message after enqueue_timeout seconds. A failed batch is retried with
+    jittered backoff, a gateway without the batch endpoint gets the messages
+    one by one. A batch that still failed releases the deduplication claims
+    of its events, so their redelivery by the homeserver is forwarded again.
+
+    With transport "nats" a batch is published straight to chat.messages
+    instead, and only goes through the gateway while NATS is unreachable.
+    """
+
+    def __init__(
+        self,
+        batch_size=FORWARD_BATCH_SIZE,
+        flush_interval=FORWARD_FLUSH_INTERVAL,
+        max_pending=FORWARD_MAX_PENDING,
+        enqueue_timeout=FORWARD_ENQUEUE_TIMEOUT,
+        retries=FORWARD_RETRIES,
+        transport=FORWARD_TRANSPORT,
+        publisher=nats_publisher,
+        deduplicator=event_deduplicator,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.transport = transport
+        self.publisher = publisher
+        self.deduplicator = deduplicator
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self.forwarded = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.published = 0
+        self.fallbacks = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = loop.create_task(self._run())
+
+    async def forward(self, payload: dict) -> bool:
+        """Queue a chat message, returns False if it was dropped because the queue stayed full."""
+        self._ensure_started()
+        try:
+            await asyncio.wait_for(self._queue.put(payload), self.enqueue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            print(f"Dropped a chat message, {self._queue.qsize()} messages are waiting for the gateway")
+            return False
+
+    async def _collect(self):
+        """Wait for a first message, then take more until the batch is full or flush_interval passed."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._send(batch)
+                self.forwarded += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"Error forwarding {len(batch)} chat messages to the gateway: {e}")
+                await self._release(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _release(self, batch):
+        for payload in batch:
+            await self.deduplicator.release(payload.get("receiver"), payload.get("event_id"))
+
+    async def _send(self, batch):
+        if self.transport == "nats":
+            try:
+                if await self.publisher.connect():
+                    rejected = await self.publisher.publish_chat_messages(batch)
+                    self.batches += 1
+                    self.published += len(batch) - len(rejected)
+                    if rejected:
+                        print(f"Rejected {len(rejected)} chat messages: {rejected}")
+                    return
+            except Exception as e:
+                print(f"Error publishing {len(batch)} chat messages to NATS: {e}")
+            self.fallbacks += 1
+        await self._post(batch)
+
+    async def _post(self, batch):
+        url = f"{API_GATEWAY_URL}{CHAT_MESSAGE_BATCH_PATH}"
+        for attempt in range(self.retries + 1):
+            try:
+                response = await get_http_client().post(url, json={"messages": batch})
+                if response.status_code in (404, 405):
+                    # Gateway without the batch endpoint
+                    for payload in batch:
+                        await send_to_gateway(CHAT_MESSAGE_PATH, payload)
+                    return
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    self.batches += 1
+                    rejected = response.json().get("rejected", [])
+                    if rejected:
+                        print(f"Gateway rejected {len(rejected)} chat messages: {rejected}")
+                    return
+                error = httpx.HTTPStatusError(
+                    f"Gateway returned {response.status_code}", request=response.request, response=response,
+                )
+            except httpx.RequestError as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        raise error
+
+    async def flush(self):
+        """Wait until all queued messages were sent (or failed)."""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._loop = None
+
+    def get_stats(self):
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "forwarded": self.forwarded,
+            "batches": self.batches,
+            "messages_per_batch": self.forwarded / self.batches if self.batches else 0.0,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "transport": self.transport,
+            "published_to_nats": self.published,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# Chat messages of all bots of this instance
+forwarder = ChatForwarder()
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from nats.aio.client import Client as NATS
+from app.config import NATS_URL, NATS_CONNECT_RETRY_INTERVAL
+from app.utils import event_codec
+
+CHAT_MESSAGES_SUBJECT = "chat.messages"
+CONNECT_TIMEOUT = 5
+
+
+class NatsPublisher:
+    """
+    Publishes events straight to NATS, without the API gateway in between.
+
+    Connects lazily. After a failed connect the next attempt waits at least
+    retry_interval seconds, so a missing NATS server costs the callers one
+    check per batch. Once connected, the client reconnects by itself.
+    """
+
+    def __init__(self, servers=NATS_URL, retry_interval=NATS_CONNECT_RETRY_INTERVAL):
+        self.servers = [server.strip() for server in servers.split(",")]
+        self.retry_interval = retry_interval
+        self.nc = None
+        self._loop = None
+        self._next_attempt = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self.nc is not None and self.nc.is_connected and self._loop is asyncio.get_running_loop()
+
+    async def connect(self) -> bool:
+        """Connect unless already connected, returns whether the client is usable."""
+        if self.connected:
+            return True
+        if time.monotonic() < self._next_attempt:
+            return False
+        nc = NATS()
+        try:
+            # Reconnects forever once connected, so the first connect gets a deadline of its own
+            await asyncio.wait_for(
+                nc.connect(servers=self.servers, connect_timeout=2, max_reconnect_attempts=-1),
+                CONNECT_TIMEOUT,
+            )
+        except (Exception, asyncio.TimeoutError) as e:
+            self._next_attempt = time.monotonic() + self.retry_interval
+            print(f"Could not connect to NATS ({e}), retrying in {self.retry_interval}s")
+            return False
+        self.nc = nc
+        self._loop = asyncio.get_running_loop()
+        print("Connected to NATS.")
+        return True
+
+    async def publish_chat_messages(self, payloads):
+        """
+        Encode and publish chat messages on chat.messages, one flush for all.
+
+        Returns the messages that failed validation as (index, error), like
+        the rejected list of the gateway's batch endpoint. Raises if the
+        messages could not be handed to the server.
+        """
+        encoded, rejected = [], []
+        for index, payload in enumerate(payloads):
+            try:
+                encoded.append(event_codec.encode(CHAT_MESSAGES_SUBJECT, payload))
+            except event_codec.EventValidationError as e:
+                rejected.append({"index": index, "error": str(e)})
+        for data in encoded:
+            await self.nc.publish(CHAT_MESSAGES_SUBJECT, data)
+        # Round trip to the server, so a lost connection shows up here
+        await self.nc.flush(timeout=2)
+        return rejected
+
+    async def close(self):
+        if self.nc is not None and self._loop is asyncio.get_running_loop():
+            try:
+                await self.nc.drain()
+            except Exception as e:
+                print(f"Error closing the NATS connection: {e}")
+        self.nc = None
+        self._loop = None
+
+
+# Used by the chat forwarder with FORWARD_TRANSPORT=nats
+nats_publisher = NatsPublisher()
@@ -0,0 +1,121 @@
+"""
+Latency of an inbound chat message from the bot callback to NATS.
+
+Subscribes to chat.messages and forwards messages over each path, measuring
+the time from forward() to the message arriving on NATS:
+
+- http-single: one POST per message to /bots/chat_message (the old path)
+- http-batch: ChatForwarder over /bots/chat_message/batch
+- nats: ChatForwarder publishing straight to NATS (FORWARD_TRANSPORT=nats)
+
+The http paths need a running api-gateway (API_GATEWAY_URL) connected to the
+same NATS server (NATS_URL); they are skipped when it is not reachable.
+
+    python benchmarks/bench_forward_latency.py [messages] [rate per second]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import nats
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import API_GATEWAY_URL, NATS_URL
+from app.utils import event_codec
+from app.utils.gateway_com import ChatForwarder, send_to_gateway, close_http_client, CHAT_MESSAGE_PATH
+from app.utils.nats_com import NatsPublisher
+
+
+def chat_message(run, i):
+    return {
+        "room_id": "!bench:matrix.org",
+        "room_name": "Benchmark",
+        "sender": "@bench:matrix.org",
+        "receiver": "bench-bot",
+        "message": json.dumps({"run": run, "i": i}),
+        "timestamp": int(time.time() * 1000),
+    }
+
+
+async def measure(path, messages, rate):
+    sent = {}
+    latencies = []
+    received = asyncio.Event()
+
+    async def on_message(msg):
+        try:
+            marker = json.loads(event_codec.decode("chat.messages", msg.data)["message"])
+        except (event_codec.EventValidationError, ValueError, TypeError):
+            return
+        if marker.get("run") == path and marker["i"] in sent:
+            latencies.append(time.perf_counter() - sent.pop(marker["i"]))
+            if len(latencies) == messages:
+                received.set()
+
+    nc = await nats.connect(NATS_URL)
+    await nc.subscribe("chat.messages", cb=on_message)
+    await nc.flush()
+
+    publisher = NatsPublisher(NATS_URL)
+    forwarder = ChatForwarder(transport="nats" if path == "nats" else "http", publisher=publisher)
+    pending = []
+    for i in range(messages):
+        sent[i] = time.perf_counter()
+        if path == "http-single":
+            pending.append(asyncio.create_task(send_to_gateway(CHAT_MESSAGE_PATH, chat_message(path, i))))
+        else:
+            await forwarder.forward(chat_message(path, i))
+        await asyncio.sleep(1 / rate)
+
+    await asyncio.gather(*pending, return_exceptions=True)
+    try:
+        await asyncio.wait_for(received.wait(), 10)
+    except asyncio.TimeoutError:
+        pass
+    await forwarder.close()
+    await publisher.close()
+    await nc.close()
+    return latencies
+
+
+def report(path, messages, latencies):
+    if not latencies:
+        print(f"{path:<12} nothing arrived on NATS")
+        return
+    latencies = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{path:<12} {len(latencies)}/{messages} arrived, "
+        f"p50 {statistics.median(latencies):.2f}ms p95 {p95:.2f}ms p99 {p99:.2f}ms max {latencies[-1]:.2f}ms"
+    )
+
+
+async def gateway_reachable():
+    try:
+        await send_to_gateway("/bots/chat_message/batch", {"messages": []})
+        return True
+    except Exception:
+        return False
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 500
+    paths = ["nats"]
+    if API_GATEWAY_URL and await gateway_reachable():
+        paths = ["http-single", "http-batch", "nats"]
+    else:
+        print(f"api-gateway at {API_GATEWAY_URL} is not reachable, only measuring the nats path")
+
+    print(f"{messages} messages at {rate:.0f}/s")
+    for path in paths:
+        report(path, messages, await measure(path, messages, rate))
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+Event loop stall caused by the bot registry checks in Redis.
+
+Compares the old add-bot check (exists + get + delete with the blocking
+redis-py client, called from async handlers) with the shared redis.asyncio
+pool, once with the same three commands and once with the single get plus
+the compare-and-delete script used by /bots/add now.
+
+Needs the Redis of the service (REDIS_URL, REDIS_PORT, REDIS_PASSWORD).
+
+    python benchmarks/bench_redis_stall.py [checks] [concurrency]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import redis
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app.redis_client import get_redis, close_redis
+from app.bot_registry import bot_key, get_bot, unregister_bot
+
+TICK = 0.001
+CLIENT_DATA = json.dumps({"user_id": "@bench:matrix.org", "instance_ip": "bench-instance"})
+
+sync_redis = redis.StrictRedis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+async def blocking_check(username):
+    key = bot_key(username)
+    if sync_redis.exists(key):
+        json.loads(sync_redis.get(key))
+        sync_redis.delete(key)
+
+
+async def async_check(username):
+    key = bot_key(username)
+    redis_client = get_redis()
+    if await redis_client.exists(key):
+        json.loads(await redis_client.get(key))
+        await redis_client.delete(key)
+
+
+async def async_atomic_check(username):
+    client_data = await get_bot(username)
+    if client_data:
+        json.loads(client_data)
+        await unregister_bot(username, expected=client_data)
+
+
+async def measure(check, checks, concurrency):
+    sync_redis.mset({bot_key(f"bench-{i}"): CLIENT_DATA for i in range(checks)})
+    stalls = []
+    done = asyncio.Event()
+
+    async def monitor():
+        # Any time a 1 ms sleep takes longer was spent blocking the loop
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            stalls.append(max(0.0, time.perf_counter() - started - TICK))
+
+    async def worker(keys):
+        for key in keys:
+            await check(key)
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.sleep(TICK)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker([f"bench-{i}" for i in range(n, checks, concurrency)]) for n in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor_task
+    return elapsed, stalls
+
+
+async def main():
+    checks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    runs = {
+        "blocking exists/get/delete": blocking_check,
+        "async exists/get/delete": async_check,
+        "async get + compare-and-delete": async_atomic_check,
+    }
+    print(f"{checks} add-bot checks, {concurrency} concurrent")
+    for name, check in runs.items():
+        elapsed, stalls = await measure(check, checks, concurrency)
+        stalls.sort()
+        print(
+            f"{name:<32} {checks / elapsed:8.0f} checks/s"
+            f"  loop stall: max {stalls[-1] * 1000:7.2f} ms"
+            f"  p99 {stalls[int(len(stalls) * 0.99) - 1] * 1000:6.2f} ms"
+            f"  mean {statistics.mean(stalls) * 1000:5.2f} ms"
+        )
+    await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
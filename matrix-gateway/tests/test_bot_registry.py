@@ -0,0 +1,98 @@
+import json
+import pytest
+import redis
+from fastapi.testclient import TestClient
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app.main import app
+from app import bot_registry
+from app.bot_registry import bot_key, instance_index, register_bot, get_bot, unregister_bot, list_bots
+
+client = TestClient(app)
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """A registry of its own per test, under a separate prefix."""
+    monkeypatch.setattr(bot_registry, "BOT_PREFIX", "test-bot:")
+    monkeypatch.setattr(bot_registry, "BOTS_INDEX", "test-bots:index")
+    monkeypatch.setattr(bot_registry, "INSTANCE_INDEX_PREFIX", "test-bots:instance:")
+    yield
+    keys = list(sync_redis.scan_iter("test-bot*")) + ["legacy-bot", "not-a-bot"]
+    sync_redis.delete(*keys)
+
+
+def bot(instance_ip):
+    return {"user_id": "@bot:matrix.org", "access_token": "token", "instance_ip": instance_ip}
+
+
+@pytest.mark.asyncio
+async def test_bots_are_indexed_per_instance():
+    await register_bot("alice", bot("instance-a"))
+    await register_bot("bob", bot("instance-b"))
+
+    assert sync_redis.exists(bot_key("alice"))
+    assert (await list_bots())[0] == ["alice", "bob"]
+    assert (await list_bots(instance_ip="instance-a"))[0] == ["alice"]
+
+    # Registered again by another instance, it moves to that index
+    await register_bot("alice", bot("instance-b"))
+    assert (await list_bots(instance_ip="instance-a"))[0] == []
+    assert (await list_bots(instance_ip="instance-b"))[0] == ["alice", "bob"]
+
+
+@pytest.mark.asyncio
+async def test_unregister_removes_the_index_entries():
+    await register_bot("alice", bot("instance-a"))
+    stored = await get_bot("alice")
+
+    assert not await unregister_bot("alice", expected=json.dumps(bot("other")))
+    assert await unregister_bot("alice", expected=stored)
+    assert not await unregister_bot("alice")
+
+    assert await get_bot("alice") is None
+    assert not sync_redis.exists(bot_registry.BOTS_INDEX, instance_index("instance-a"))
+
+
+@pytest.mark.asyncio
+async def test_list_bots_pages():
+    usernames = [f"bot{i:02}" for i in range(25)]
+    for username in usernames:
+        await register_bot(username, bot("instance-a"))
+
+    listed, cursor = [], ""
+    while cursor is not None:
+        page, cursor = await list_bots(cursor, count=10)
+        assert len(page) <= 10
+        listed += page
+
+    assert listed == usernames
+
+
+def test_list_endpoints():
+    sync_redis.zadd(bot_registry.BOTS_INDEX, {"alice": 0, "bob": 0, "carol": 0})
+    sync_redis.zadd(instance_index("unknown-instance"), {"bob": 0})
+
+    response = client.get("/bots/", params={"count": 2})
+    assert response.json() == {"bots": ["alice", "bob"], "next_cursor": "bob"}
+    response = client.get("/bots/", params={"count": 2, "cursor": "bob"})
+    assert response.json() == {"bots": ["carol"], "next_cursor": None}
+
+    response = client.get("/bots/instance")
+    assert response.json()["bots"] == ["bob"]
+    assert client.get("/bots/", params={"count": 0}).status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_keys():
+    sync_redis.set("legacy-bot", json.dumps(bot("instance-a")))
+    sync_redis.set("not-a-bot", "something else")
+
+    assert await bot_registry.migrate_legacy_keys() == 1
+
+    assert not sync_redis.exists("legacy-bot")
+    assert sync_redis.get("not-a-bot") == "something else"
+    assert json.loads(await get_bot("legacy-bot")) == bot("instance-a")
+    assert (await list_bots(instance_ip="instance-a"))[0] == ["legacy-bot"]
@@ -1,19 +1,21 @@
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 from app.main import app
+from app.client_pool import ClientPool
+from app.clients import sync_scheduler
 
 # Create a test client for FastAPI
 client = TestClient(app)
 
 # Mock for client_pool
-mock_client_pool = {}
+mock_client_pool = ClientPool()
 
 
 @pytest.fixture
 def setup_mock_client_pool():
     """
-    Fixture to patch the client_pool with a mock dictionary for each test.
+    Fixture to patch the client_pool with a separate pool for each test.
     Ensures that operations in the application modify mock_client_pool.
     """
     with patch("app.clients.client_pool", mock_client_pool):
@@ -38,6 +40,26 @@ async def test_add_bot(mock_start_sync, mock_create_client, setup_mock_client_po
     mock_start_sync.assert_called_once()
 
 
+@pytest.mark.asyncio
+@patch("app.routes.bot_routes.create_client", new_callable=AsyncMock)
+@patch("app.routes.bot_routes.start_sync", new_callable=AsyncMock)
+async def test_add_bot_adopted_while_taking_the_lease(mock_start_sync, mock_create_client, setup_mock_client_pool):
+    """The placement loop started the bot while /bots/add took its lease, it is not started twice."""
+    mock_client_pool.clear()
+
+    async def acquire(username):
+        mock_client_pool[username] = AsyncMock()
+        mock_client_pool.pin(username, MagicMock())
+        return 1
+
+    with patch("app.routes.bot_routes.leases.acquire", side_effect=acquire):
+        response = client.post("/bots/add", json={"username": "bot-adopted", "password": "pass1"})
+
+    assert response.json() == {"message": "Bot bot-adopted added"}
+    mock_start_sync.assert_not_called()
+    mock_client_pool.clear()
+
+
 @pytest.mark.asyncio
 async def test_remove_bot_success(setup_mock_client_pool):
     """
@@ -66,6 +88,17 @@ async def test_remove_bot_success(setup_mock_client_pool):
     mock_client.close.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_remove_bot_deletes_its_sync_state(setup_mock_client_pool):
+    mock_client_pool["bot1"] = AsyncMock()
+
+    with patch.object(sync_scheduler, "store", AsyncMock()) as store:
+        response = client.post("/bots/remove", json={"username": "bot1"})
+
+    assert response.status_code == 200
+    store.delete.assert_awaited_once_with("bot1")
+
+
 @pytest.mark.asyncio
 async def test_remove_bot_not_found(setup_mock_client_pool):
     """
@@ -91,9 +124,10 @@ async def test_add_bot_already_exists(mock_start_sync, mock_create_client, setup
     Test attempting to add a bot that already exists in the client pool.
     Ensures that no new client is created or started and the appropriate message is returned.
     """
-    # Mock adding a bot to the client pool
+    # Mock adding a bot to the client pool, syncing on this instance
     mock_client = AsyncMock()
     mock_client_pool["bot1"] = mock_client
+    mock_client_pool.pin("bot1", MagicMock())
 
     # Attempt to add the same bot again
     response = client.post("/bots/add", json={"username": "bot1", "password": "pass1"})
@@ -0,0 +1,87 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import pytest
+from app.client_pool import ClientPool
+from app.clients import get_client
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_client_is_evicted_and_closed():
+    pool = ClientPool(max_size=2)
+    first, second, third = AsyncMock(), AsyncMock(), AsyncMock()
+    pool["first"] = first
+    pool["second"] = second
+
+    # Using first makes second the least recently used
+    assert pool.get("first") is first
+    pool["third"] = third
+    await asyncio.sleep(0)
+
+    assert "second" not in pool
+    assert pool.keys() == ["first", "third"]
+    second.close.assert_awaited_once()
+    assert pool.get_stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pinned_clients_are_never_evicted():
+    pool = ClientPool(max_size=1)
+    syncing, sending = AsyncMock(), AsyncMock()
+    pool["syncing"] = syncing
+    pool.pin("syncing", MagicMock())
+    pool["sending"] = sending
+    pool["other"] = AsyncMock()
+    await asyncio.sleep(0)
+
+    assert "syncing" in pool
+    assert "sending" not in pool
+    syncing.close.assert_not_called()
+
+    # Idle eviction leaves pinned clients alone as well
+    pool.idle_timeout = 0
+    assert await pool.evict_idle() == 1
+    assert pool.keys() == ["syncing"]
+
+
+@pytest.mark.asyncio
+async def test_removing_a_pinned_client_stops_its_sync():
+    pool = ClientPool()
+    sync_task = MagicMock()
+    pool["bot"] = AsyncMock()
+    pool.pin("bot", sync_task)
+
+    pool.pop("bot")
+
+    sync_task.cancel.assert_called_once()
+    assert not pool.is_pinned("bot")
+
+
+@pytest.mark.asyncio
+async def test_idle_clients_are_evicted():
+    pool = ClientPool(idle_timeout=60)
+    idle, busy = AsyncMock(), AsyncMock()
+    pool["idle"] = idle
+    pool["busy"] = busy
+
+    # Last used two minutes ago
+    pool._last_used["idle"] -= 120
+
+    assert await pool.evict_idle() == 1
+
+    assert pool.keys() == ["busy"]
+    idle.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_get_client_only_reads_redis_on_a_miss():
+    pool = ClientPool()
+    rehydrated = AsyncMock()
+
+    with patch("app.clients.client_pool", pool), \
+            patch("app.clients.get_client_from_pool", AsyncMock(return_value=rehydrated)) as from_redis:
+        assert await get_client("bot") is rehydrated
+        assert await get_client("bot") is rehydrated
+
+    from_redis.assert_awaited_once_with("bot")
+    assert pool.get_stats()["hits"] == 1
+    assert pool.get_stats()["misses"] == 1
@@ -15,13 +15,16 @@ from nio import AsyncClient, InviteEvent, RoomMessageText
 
 @pytest.mark.asyncio
 @patch("app.clients.HOMESERVER_URL", "http://your-homeserver-url")
+@patch("app.clients.register_bot", new_callable=AsyncMock)
 @patch("app.clients.AsyncClient")
 @patch("app.clients.on_invite_event")
 @patch("app.clients.message_listener")
-async def test_create_client(mock_message_listener, mock_on_invite_event, mock_async_client):
+async def test_create_client(mock_message_listener, mock_on_invite_event, mock_async_client, mock_register_bot):
     # Mock the AsyncClient instance
     mock_client_instance = AsyncMock()
     mock_client_instance.user_id = "bot_user"
+    mock_client_instance.device_id = "DEVICE"
+    mock_client_instance.access_token = "test_token"
     mock_async_client.return_value = mock_client_instance
 
     # Mock the login response
@@ -40,6 +43,13 @@ async def test_create_client(mock_message_listener, mock_on_invite_event, mock_a
     # Verify client is added to the client_pool
     assert client_pool["bot_user"] == client
 
+    # Verify the bot is registered with its session
+    mock_register_bot.assert_awaited_once()
+    username_arg, client_data = mock_register_bot.await_args.args
+    assert username_arg == "bot_user"
+    assert client_data["device_id"] == "DEVICE"
+    assert client_data["access_token"] == "test_token"
+
     # Verify the callbacks are registered
     mock_client_instance.add_event_callback.assert_any_call(mock_on_invite_event, InviteEvent)
     mock_client_instance.add_event_callback.assert_any_call(mock_message_listener, RoomMessageText)
@@ -53,11 +63,13 @@ async def test_start_sync(mock_process_pending_invites):
     client = AsyncMock()
     client.user_id = "bot_user"
 
-    with patch("asyncio.create_task", return_value=MagicMock()) as mock_create_task:
+    with patch("app.clients.sync_scheduler.start", return_value=MagicMock()) as mock_start:
         await start_sync(client)
 
-        mock_create_task.assert_called_once()
-        mock_process_pending_invites.assert_awaited_once_with(client)
+        # Pending invites are processed after the first sync
+        mock_start.assert_called_once_with("bot_user", client, on_first_sync=mock_process_pending_invites)
+        assert client_pool.is_pinned("bot_user")
+    client_pool.pop("bot_user")
 
 
 @pytest.mark.asyncio
@@ -145,11 +157,14 @@ async def test_on_invite_event_join_failure():
 
 @pytest.mark.asyncio
 @patch("app.clients.HOMESERVER_URL", "http://your-homeserver-url")
+@patch("app.clients.register_bot", new_callable=AsyncMock)
 @patch("app.clients.AsyncClient")
-async def test_create_client_callbacks_and_client_pool(mock_async_client):
+async def test_create_client_callbacks_and_client_pool(mock_async_client, mock_register_bot):
     # Mock AsyncClient instance
     mock_client_instance = AsyncMock()
     mock_client_instance.user_id = "bot_user"
+    mock_client_instance.device_id = "DEVICE"
+    mock_client_instance.access_token = "test_token"
     mock_async_client.return_value = mock_client_instance
 
     # Mock the login response
@@ -1,8 +1,28 @@
 from unittest.mock import AsyncMock, patch
 import pytest
+import redis
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import event_dedup
+from app.event_dedup import EventDeduplicator
+from app.utils import event_callbacks
 from app.utils.event_callbacks import message_listener
 from nio import RoomMessageText, MatrixRoom
 
+# Blocking client to clean up the claimed events
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def deduplicator(monkeypatch):
+    """Every test starts with no events forwarded."""
+    monkeypatch.setattr(event_dedup, "DEDUP_PREFIX", "test-dedup:event:")
+    fresh = EventDeduplicator()
+    monkeypatch.setattr(event_callbacks, "deduplicator", fresh)
+    yield fresh
+    keys = list(sync_redis.scan_iter("test-dedup:event:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
 
 class MockRoom(MatrixRoom):
     def __init__(self, room_id="!room123:matrix.org", own_user_id="@bot123:matrix.org"):
@@ -14,7 +34,8 @@ class MockRoom(MatrixRoom):
 
 
 class MockEvent(RoomMessageText):
-    def __init__(self, sender="@user456:matrix.org", body="Hello, bot!", timestamp=1695742940000):
+    def __init__(self, sender="@user456:matrix.org", body="Hello, bot!", timestamp=1695742940000,
+                 event_id="$event12345:matrix.org"):
         source = {
             "content": {
                 "body": body,
@@ -22,7 +43,7 @@ class MockEvent(RoomMessageText):
             },
             "sender": sender,
             "origin_server_ts": timestamp,
-            "event_id": "$event12345:matrix.org",  # Add a mock event_id
+            "event_id": event_id,
         }
         super().__init__(
             body=body,
@@ -33,20 +54,19 @@ class MockEvent(RoomMessageText):
         self.server_timestamp = timestamp
 
 
-@patch("app.utils.event_callbacks.send_to_gateway", new_callable=AsyncMock)
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
 @pytest.mark.asyncio
-async def test_message_listener_valid_event(mock_send_to_gateway):
+async def test_message_listener_valid_event(mock_forward):
     """Test message_listener with a valid event."""
-    # Mock return value of send_to_gateway
-    mock_send_to_gateway.return_value = {"status": "success"}
+    # Mock return value of forward
+    mock_forward.return_value = True
 
     room = MockRoom()
     event = MockEvent()
 
     await message_listener(room, event)
 
-    mock_send_to_gateway.assert_called_once_with(
-        "/chat_message",
+    mock_forward.assert_called_once_with(
         {
             "room_id": "!room123:matrix.org",
             "room_name": "Test Room",
@@ -54,41 +74,85 @@ async def test_message_listener_valid_event(mock_send_to_gateway):
             "receiver": "@bot123:matrix.org",
             "message": "Hello, bot!",
             "timestamp": 1695742940000,
+            "event_id": "$event12345:matrix.org",
         }
     )
 
 
-@patch("app.utils.event_callbacks.send_to_gateway", new_callable=AsyncMock)
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
 @pytest.mark.asyncio
-async def test_message_listener_same_sender_receiver(mock_send_to_gateway):
+async def test_message_listener_same_sender_receiver(mock_forward):
     """Test message_listener skips when sender and receiver are the same."""
     room = MockRoom()
     event = MockEvent(sender="@bot123:matrix.org")  # Same as room's own_user_id
 
     await message_listener(room, event)
 
-    mock_send_to_gateway.assert_not_called()
+    mock_forward.assert_not_called()
 
 
-@patch("app.utils.event_callbacks.send_to_gateway", new_callable=AsyncMock)
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
 @pytest.mark.asyncio
-async def test_message_listener_invalid_event_type(mock_send_to_gateway):
+async def test_message_listener_invalid_event_type(mock_forward):
     """Test message_listener skips when event is not RoomMessageText."""
     room = MockRoom()
     event = object()  # Invalid event type
 
     await message_listener(room, event)
 
-    mock_send_to_gateway.assert_not_called()
+    mock_forward.assert_not_called()
 
 
-@patch("app.utils.event_callbacks.send_to_gateway", new_callable=AsyncMock)
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
 @pytest.mark.asyncio
-async def test_message_listener_invalid_room_type(mock_send_to_gateway):
+async def test_message_listener_invalid_room_type(mock_forward):
     """Test message_listener skips when room is not MatrixRoom."""
     room = object()  # Invalid room type
     event = MockEvent()
 
     await message_listener(room, event)
 
-    mock_send_to_gateway.assert_not_called()
+    mock_forward.assert_not_called()
+
+
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
+@pytest.mark.asyncio
+async def test_message_listener_skips_duplicate_events(mock_forward, deduplicator):
+    """The same event received twice, for example after a sync retry, is forwarded once."""
+    room = MockRoom()
+
+    await message_listener(room, MockEvent(body="first"))
+    await message_listener(room, MockEvent(body="first"))
+    await message_listener(room, MockEvent(body="second", event_id="$event67890:matrix.org"))
+
+    assert [call.args[0]["message"] for call in mock_forward.await_args_list] == ["first", "second"]
+    assert deduplicator.get_stats()["duplicates"] == 1
+
+
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
+@pytest.mark.asyncio
+async def test_message_listener_releases_events_it_could_not_forward(mock_forward, deduplicator):
+    """A message dropped by the forwarder is forwarded when the event comes again."""
+    room = MockRoom()
+    mock_forward.return_value = False
+    await message_listener(room, MockEvent())
+
+    mock_forward.return_value = True
+    await message_listener(room, MockEvent())
+
+    assert mock_forward.await_count == 2
+    assert deduplicator.get_stats()["duplicates"] == 0
+
+
+@patch("app.utils.event_callbacks.forwarder.forward", new_callable=AsyncMock)
+@pytest.mark.asyncio
+async def test_message_listener_releases_events_when_forward_raises(mock_forward, deduplicator):
+    room = MockRoom()
+    mock_forward.side_effect = RuntimeError("forwarder stopped")
+    with pytest.raises(RuntimeError):
+        await message_listener(room, MockEvent())
+
+    mock_forward.side_effect = None
+    await message_listener(room, MockEvent())
+
+    assert mock_forward.await_count == 2
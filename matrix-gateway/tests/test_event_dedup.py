@@ -0,0 +1,88 @@
+from unittest.mock import patch
+import pytest
+import redis
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import event_dedup
+from app.event_dedup import EventDeduplicator, dedup_key
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def dedup_keys(monkeypatch):
+    monkeypatch.setattr(event_dedup, "DEDUP_PREFIX", "test-dedup:event:")
+    yield
+    keys = list(sync_redis.scan_iter("test-dedup:event:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+@pytest.mark.asyncio
+async def test_repeats_are_caught_locally():
+    dedup = EventDeduplicator(window=60)
+
+    assert await dedup.is_duplicate("@bot:matrix.org", "$1") is False
+    assert await dedup.is_duplicate("@bot:matrix.org", "$1") is True
+
+    assert dedup.get_stats()["local_hits"] == 1
+    assert 0 < sync_redis.ttl(dedup_key("@bot:matrix.org", "$1")) <= 60
+
+
+@pytest.mark.asyncio
+async def test_other_instance_does_not_forward_the_event_again():
+    first, second = EventDeduplicator(), EventDeduplicator()
+
+    assert await first.is_duplicate("@bot:matrix.org", "$1") is False
+    assert await second.is_duplicate("@bot:matrix.org", "$1") is True
+
+
+@pytest.mark.asyncio
+async def test_each_bot_gets_the_event():
+    dedup = EventDeduplicator()
+
+    assert await dedup.is_duplicate("@bot1:matrix.org", "$1") is False
+    assert await dedup.is_duplicate("@bot2:matrix.org", "$1") is False
+
+
+@pytest.mark.asyncio
+async def test_lru_is_bounded():
+    dedup = EventDeduplicator(lru_size=2)
+
+    for event_id in ("$1", "$2", "$3"):
+        await dedup.is_duplicate("@bot:matrix.org", event_id)
+
+    assert dedup.get_stats()["remembered"] == 2
+    # Evicted locally, Redis still knows it
+    assert await dedup.is_duplicate("@bot:matrix.org", "$1") is True
+    assert dedup.get_stats()["local_hits"] == 0
+
+
+@pytest.mark.asyncio
+async def test_events_are_forwarded_without_redis():
+    dedup = EventDeduplicator()
+
+    with patch.object(event_dedup, "get_redis", side_effect=ConnectionError("Redis is down")):
+        assert await dedup.is_duplicate("@bot:matrix.org", "$1") is False
+        assert await dedup.is_duplicate("@bot:matrix.org", "$1") is True
+
+
+@pytest.mark.asyncio
+async def test_window_under_a_second_still_expires():
+    dedup = EventDeduplicator(window=0.5)
+
+    assert await dedup.is_duplicate("@bot:matrix.org", "$1") is False
+    assert 0 < sync_redis.pttl(dedup_key("@bot:matrix.org", "$1")) <= 500
+
+
+@pytest.mark.asyncio
+async def test_released_event_can_be_claimed_again():
+    first, second = EventDeduplicator(), EventDeduplicator()
+    await first.is_duplicate("@bot:matrix.org", "$1")
+
+    await first.release("@bot:matrix.org", "$1")
+
+    assert sync_redis.exists(dedup_key("@bot:matrix.org", "$1")) == 0
+    assert await second.is_duplicate("@bot:matrix.org", "$1") is False
+    assert await first.is_duplicate("@bot:matrix.org", "$1") is True
+    assert first.get_stats()["local_hits"] == 0
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import httpx
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.utils import gateway_com
+from app.utils.gateway_com import ChatForwarder
+
+
+def message(i):
+    return {"room_id": "!room:matrix.org", "message": f"message {i}"}
+
+
+class FakeGateway:
+    """Answers the requests of the shared HTTP client."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append((request.url.path, json.loads(request.content)))
+        status = self.statuses.pop(0) if self.statuses else 200
+        return httpx.Response(status, json={"accepted": 1, "rejected": []})
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    fake = FakeGateway()
+    client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+    monkeypatch.setattr(gateway_com, "get_http_client", lambda: client)
+    monkeypatch.setattr(gateway_com, "API_GATEWAY_URL", "http://api-gateway:5000")
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_messages_are_sent_in_batches(gateway):
+    forwarder = ChatForwarder(batch_size=10, flush_interval=0.05)
+
+    for i in range(25):
+        await forwarder.forward(message(i))
+    await forwarder.close()
+
+    paths = {path for path, _ in gateway.requests}
+    sizes = [len(body["messages"]) for _, body in gateway.requests]
+    assert paths == {"/bots/chat_message/batch"}
+    assert sizes == [10, 10, 5]
+    assert [m for _, body in gateway.requests for m in body["messages"]] == [message(i) for i in range(25)]
+    assert forwarder.get_stats()["forwarded"] == 25
+
+
+@pytest.mark.asyncio
+async def test_failed_batches_are_retried(gateway):
+    gateway.statuses = [503, 200]
+    forwarder = ChatForwarder(flush_interval=0.01, retries=2)
+
+    await forwarder.forward(message(0))
+    await forwarder.close()
+
+    assert len(gateway.requests) == 2
+    assert forwarder.get_stats()["failed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_batches_release_their_events(gateway):
+    gateway.statuses = [503, 503]
+    deduplicator = AsyncMock()
+    forwarder = ChatForwarder(flush_interval=0.01, retries=1, deduplicator=deduplicator)
+
+    await forwarder.forward({**message(0), "receiver": "@bot:matrix.org", "event_id": "$event0"})
+    await forwarder.close()
+
+    assert forwarder.get_stats()["failed"] == 1
+    # The homeserver delivers the event again, it must not be skipped then
+    deduplicator.release.assert_awaited_once_with("@bot:matrix.org", "$event0")
+
+
+@pytest.mark.asyncio
+async def test_gateway_without_the_batch_endpoint(gateway):
+    gateway.statuses = [404]
+    forwarder = ChatForwarder(flush_interval=0.01)
+
+    await forwarder.forward(message(0))
+    await forwarder.forward(message(1))
+    await forwarder.close()
+
+    assert [path for path, _ in gateway.requests] == [
+        "/bots/chat_message/batch", "/bots/chat_message", "/bots/chat_message",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_after_the_timeout():
+    forwarder = ChatForwarder(batch_size=1, max_pending=2, enqueue_timeout=0.01)
+    blocked = asyncio.Event()
+
+    async def send(batch):
+        await blocked.wait()
+
+    with patch.object(forwarder, "_send", send):
+        results = [await forwarder.forward(message(i)) for i in range(5)]
+
+    # One batch is taken by the sender, two wait in the queue
+    assert results.count(False) == 2
+    assert forwarder.get_stats()["dropped"] == 2
+    blocked.set()
+    await forwarder.close()
+
+
+class FakePublisher:
+    def __init__(self, reachable=True):
+        self.reachable = reachable
+        self.batches = []
+
+    async def connect(self):
+        return self.reachable
+
+    async def publish_chat_messages(self, payloads):
+        self.batches.append(payloads)
+        return []
+
+
+@pytest.mark.asyncio
+async def test_nats_transport_publishes_without_the_gateway(gateway):
+    publisher = FakePublisher()
+    forwarder = ChatForwarder(flush_interval=0.01, transport="nats", publisher=publisher)
+
+    await forwarder.forward(message(0))
+    await forwarder.forward(message(1))
+    await forwarder.close()
+
+    assert publisher.batches == [[message(0), message(1)]]
+    assert gateway.requests == []
+    assert forwarder.get_stats()["published_to_nats"] == 2
+
+
+@pytest.mark.asyncio
+async def test_nats_transport_falls_back_to_the_gateway(gateway):
+    forwarder = ChatForwarder(flush_interval=0.01, transport="nats", publisher=FakePublisher(reachable=False))
+
+    await forwarder.forward(message(0))
+    await forwarder.close()
+
+    assert [path for path, _ in gateway.requests] == ["/bots/chat_message/batch"]
+    assert forwarder.get_stats()["fallbacks"] == 1
@@ -0,0 +1,105 @@
+from unittest.mock import AsyncMock, patch
+import asyncio
+import pytest
+import redis
+from fastapi.testclient import TestClient
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app.main import app
+from app import leases as leases_module
+from app.bot_registry import bot_key
+from app.leases import LeaseManager, lease_key
+from app.placement import Placement
+
+client = TestClient(app)
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def lease_keys(monkeypatch):
+    """Leases of their own per test."""
+    monkeypatch.setattr(leases_module, "LEASE_PREFIX", "test-lease:")
+    monkeypatch.setattr(leases_module, "FENCE_PREFIX", "test-fence:")
+    yield
+    keys = list(sync_redis.scan_iter("test-lease:*")) + list(sync_redis.scan_iter("test-fence:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+@pytest.mark.asyncio
+async def test_only_one_instance_holds_a_lease():
+    first, second = LeaseManager("10.0.0.1", ttl=60), LeaseManager("10.0.0.2", ttl=60)
+
+    token = await first.acquire("bot")
+    assert token is not None
+    assert await second.acquire("bot") is None
+    assert await second.holder("bot") == "10.0.0.1"
+    assert first.holds("bot") and not second.holds("bot")
+
+    # Released, the next holder gets a higher fencing token
+    await first.release("bot")
+    assert await second.acquire("bot") > token
+    assert await first.holder("bot") == "10.0.0.2"
+
+
+@pytest.mark.asyncio
+async def test_renew_reports_lost_leases():
+    first, second = LeaseManager("10.0.0.1", ttl=60), LeaseManager("10.0.0.2", ttl=60)
+    await first.acquire("kept")
+    await first.acquire("taken")
+    assert await first.renew() == []
+
+    # The lease expired and was taken over by another instance
+    sync_redis.delete(lease_key("taken"))
+    await second.acquire("taken")
+
+    assert await first.renew() == ["taken"]
+    assert not first.holds("taken")
+    assert sync_redis.pttl(lease_key("kept")) > 50000
+
+    # Releasing a lost lease leaves the new holder alone
+    await first.release("taken")
+    assert await first.holder("taken") == "10.0.0.2"
+
+
+@pytest.mark.asyncio
+async def test_release_while_renewing(monkeypatch):
+    monkeypatch.setattr(leases_module, "RENEW_BATCH", 1)
+    manager = LeaseManager("10.0.0.1", ttl=60)
+    for username in ("first", "second", "third"):
+        await manager.acquire(username)
+
+    # The release runs while the first batch is renewed
+    lost, _ = await asyncio.gather(manager.renew(), manager.release("second"))
+
+    assert lost == []
+    assert manager.lost == 0
+    assert manager.holds("first") and manager.holds("third")
+    assert not manager.holds("second")
+    assert await manager.holder("second") is None
+
+
+@pytest.mark.asyncio
+async def test_bots_stop_when_the_lease_cannot_be_renewed():
+    placement = Placement("10.0.0.1", leases=LeaseManager("10.0.0.1", ttl=0.01))
+    await placement.leases.acquire("bot")
+    release = AsyncMock()
+    await asyncio.sleep(0.02)
+
+    with patch.object(placement.leases, "renew", AsyncMock(side_effect=ConnectionError("Redis is down"))):
+        await placement.renew_leases(release)
+
+    release.assert_awaited_once_with("bot")
+
+
+@patch("app.routes.bot_routes.create_client", new_callable=AsyncMock)
+def test_add_bot_when_another_instance_holds_the_lease(mock_create_client):
+    sync_redis.set(bot_key("bot-leased"), '{"instance_ip": "10.0.0.2"}')
+    sync_redis.set(lease_key("bot-leased"), "10.0.0.2:1")
+
+    response = client.post("/bots/add", json={"username": "bot-leased", "password": "pass"})
+
+    assert response.json() == {"message": "Bot already exists"}
+    mock_create_client.assert_not_called()
+    sync_redis.delete(bot_key("bot-leased"))
@@ -0,0 +1,40 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.utils import event_codec, nats_com
+from app.utils.nats_com import NatsPublisher
+
+
+def chat_message(text):
+    return {
+        "room_id": "!room:matrix.org",
+        "room_name": "Room",
+        "sender": "@alice:matrix.org",
+        "receiver": "bot",
+        "message": text,
+        "timestamp": 1704715200000,
+    }
+
+
+@pytest.mark.asyncio
+async def test_publish_chat_messages_encodes_and_flushes_once():
+    publisher = NatsPublisher()
+    publisher.nc = MagicMock(publish=AsyncMock(), flush=AsyncMock())
+
+    rejected = await publisher.publish_chat_messages([chat_message("hi"), {"message": "no room"}, chat_message("bye")])
+
+    assert [r["index"] for r in rejected] == [1]
+    published = [call.args for call in publisher.nc.publish.await_args_list]
+    assert [subject for subject, _ in published] == ["chat.messages", "chat.messages"]
+    assert event_codec.decode("chat.messages", published[1][1]) == chat_message("bye")
+    publisher.nc.flush.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_server_is_not_retried_right_away(monkeypatch):
+    publisher = NatsPublisher(servers="nats://127.0.0.1:1", retry_interval=60)
+    monkeypatch.setattr(nats_com, "CONNECT_TIMEOUT", 0.5)
+
+    assert await publisher.connect() is False
+    assert publisher.connected is False
+    # Within the retry interval no new connect is attempted
+    assert await publisher.connect() is False
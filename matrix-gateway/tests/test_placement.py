@@ -0,0 +1,130 @@
+from collections import Counter
+import pytest
+import redis
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import bot_registry, leases as leases_module, placement as placement_module
+from app.bot_registry import register_bot, list_bots
+from app.placement import HashRing, Placement
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+USERNAMES = [f"bot{i}" for i in range(3000)]
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """A registry and instance set of their own per test."""
+    monkeypatch.setattr(bot_registry, "BOT_PREFIX", "test-placement-bot:")
+    monkeypatch.setattr(bot_registry, "BOTS_INDEX", "test-placement:index")
+    monkeypatch.setattr(bot_registry, "INSTANCE_INDEX_PREFIX", "test-placement:instance:")
+    monkeypatch.setattr(placement_module, "INSTANCES_KEY", "test-placement:instances")
+    yield
+    keys = list(sync_redis.scan_iter("test-placement*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+class FakeInstance:
+    """The sync loops of an instance, started and stopped by the placement."""
+
+    def __init__(self, instance_ip):
+        self.placement = Placement(instance_ip, heartbeat_ttl=60)
+        self.syncing = set()
+
+    def running(self):
+        return list(self.syncing)
+
+    async def adopt(self, username):
+        self.syncing.add(username)
+
+    async def release(self, username):
+        self.syncing.discard(username)
+
+    async def tick(self):
+        await self.placement.heartbeat()
+        return await self.placement.rebalance(self.running, self.adopt, self.release)
+
+
+def test_ring_spreads_bots_evenly():
+    ring = HashRing(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    counts = Counter(ring.node_for(username) for username in USERNAMES)
+
+    assert len(counts) == 3
+    assert all(700 < count < 1300 for count in counts.values())
+
+
+def test_ring_only_moves_bots_to_a_joining_instance():
+    before = HashRing(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    after = HashRing(["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"])
+    moved = [username for username in USERNAMES if before.node_for(username) != after.node_for(username)]
+
+    assert all(after.node_for(username) == "10.0.0.4" for username in moved)
+    assert 450 < len(moved) < 1050
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_lease():
+    first, second = Placement("10.0.0.1", heartbeat_ttl=60), Placement("10.0.0.2", heartbeat_ttl=60)
+    await first.heartbeat()
+
+    assert await second.heartbeat() == ["10.0.0.1", "10.0.0.2"]
+    assert second.expired == []
+
+    await first.leave()
+    assert await second.heartbeat() == ["10.0.0.2"]
+    assert second.expired == ["10.0.0.1"]
+
+
+@pytest.mark.asyncio
+async def test_leaving_releases_the_sync_leases(monkeypatch):
+    monkeypatch.setattr(leases_module, "LEASE_PREFIX", "test-placement-lease:")
+    monkeypatch.setattr(leases_module, "FENCE_PREFIX", "test-placement-fence:")
+    first, second = Placement("10.0.0.1", heartbeat_ttl=60), Placement("10.0.0.2", heartbeat_ttl=60)
+    await first.leases.acquire("bot")
+
+    await first.leave()
+
+    assert len(first.leases) == 0
+    # Taken over right away, not after the lease expired
+    assert await second.leases.acquire("bot") is not None
+
+
+@pytest.mark.asyncio
+async def test_unchanged_instances_are_not_reported(capsys):
+    # Renewed last, so Redis lists 10.0.0.1 after 10.0.0.2
+    second, first = Placement("10.0.0.2", heartbeat_ttl=60), Placement("10.0.0.1", heartbeat_ttl=60)
+    await second.heartbeat()
+    await first.heartbeat()
+    capsys.readouterr()
+
+    assert await first.heartbeat() == ["10.0.0.1", "10.0.0.2"]
+    assert "Instances changed" not in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_bots_move_to_a_joining_instance_and_back_when_it_dies():
+    first, second = FakeInstance("10.0.0.1"), FakeInstance("10.0.0.2")
+    usernames = USERNAMES[:40]
+    for username in usernames:
+        await register_bot(username, {"access_token": "token", "instance_ip": "10.0.0.1"})
+
+    await first.tick()
+    assert first.syncing == set(usernames)
+
+    # The second instance joins, the first hands over the bots the ring places there
+    await second.tick()
+    assert await first.tick() > 0
+    await second.tick()
+    assert second.syncing
+    assert first.syncing.isdisjoint(second.syncing)
+    assert first.syncing | second.syncing == set(usernames)
+    assert (await list_bots(count=100, instance_ip="10.0.0.2"))[0] == sorted(second.syncing)
+
+    # The second instance dies, the first takes all bots back and forgets it
+    await second.placement.leave()
+    await first.tick()
+    assert first.syncing == set(usernames)
+    assert (await list_bots(count=100, instance_ip="10.0.0.2"))[0] == []
+    await first.tick()
+    assert first.placement.expired == []
@@ -0,0 +1,40 @@
+from unittest.mock import AsyncMock, patch
+import json
+import pytest
+import redis
+from fastapi.testclient import TestClient
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app.main import app
+from app.bot_registry import bot_key, register_bot
+from app.redis_client import get_redis
+
+client = TestClient(app)
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_clients_are_shared_per_event_loop():
+    assert get_redis() is get_redis()
+    assert await get_redis().ping()
+
+
+@patch("app.routes.bot_routes.create_client", new_callable=AsyncMock)
+@patch("app.routes.bot_routes.start_sync", new_callable=AsyncMock)
+def test_add_bot_does_not_delete_a_bot_registered_meanwhile(mock_start_sync, mock_create_client):
+    fresh = {"instance_ip": "other-instance"}
+
+    async def holder(username):
+        # Another instance registers the bot while the lease is checked
+        await register_bot("bot-race", fresh)
+        return None
+
+    sync_redis.set(bot_key("bot-race"), json.dumps({"instance_ip": "dead-instance"}))
+    with patch("app.routes.bot_routes.leases.holder", holder):
+        response = client.post("/bots/add", json={"username": "bot-race", "password": "pass"})
+
+    assert response.json() == {"message": "Bot already exists"}
+    assert json.loads(sync_redis.get(bot_key("bot-race"))) == fresh
+    sync_redis.delete(bot_key("bot-race"), "bots:index", "bots:instance:other-instance")
+    mock_create_client.assert_not_called()
@@ -1,8 +1,13 @@
+import time
 import pytest
+import redis
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch
 from fastapi import FastAPI
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import send_queue as send_queue_module
 from app.routes.message_routes import router
+from nio import RoomSendError, RoomSendResponse
 
 # Setup test app
 app = FastAPI()
@@ -10,39 +15,63 @@ app.include_router(router)
 
 mock_client_pool = {}
 
+# Blocking client to clean up the delivery statuses
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
 @pytest.fixture
-def client():
-    # Patch the client pool to mock its functionality
-    with patch("app.clients.client_pool", mock_client_pool):
-        yield TestClient(app)
-
-# Todo: FIX TEST
-# @pytest.mark.asyncio
-# async def test_send_message_success(client):
-#     # Mock a bot client
-#     mock_client = AsyncMock()
-#     mock_client_pool["test_bot"] = mock_client
-
-#     # Send a request to the endpoint
-#     response = client.post(
-#         "/send",
-#         json={
-#             "username": "test_bot",
-#             "room_id": "test_room",
-#             "message": "Hello, world!"
-#         }
-#     )
-
-#     # Assert response
-#     assert response.status_code == 200, f"Unexpected status code: {response.status_code}"
-#     assert response.json() == {"message": "Message sent to test_room"}
-
-#     # Verify that room_send was called correctly
-#     mock_client.room_send.assert_called_once_with(
-#         room_id="test_room",
-#         message_type="m.room.message",
-#         content={"msgtype": "m.text", "body": "Hello, world!"},
-#     )
+def client(monkeypatch):
+    monkeypatch.setattr(send_queue_module, "SEND_STATUS_PREFIX", "test-send:txn:")
+    # Patch the client pool to mock its functionality, the context keeps the
+    # event loop of the background sends running between requests
+    with patch("app.clients.client_pool", mock_client_pool), TestClient(app) as test_client:
+        yield test_client
+    keys = list(sync_redis.scan_iter("test-send:txn:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+def wait_for_delivery(client, txn_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        delivery = client.get(f"/status/{txn_id}").json()
+        if delivery["status"] in ("sent", "failed"):
+            return delivery
+        time.sleep(0.01)
+    raise AssertionError(f"Message {txn_id} was not delivered")
+
+@pytest.mark.asyncio
+async def test_send_message_success(client):
+    # Mock a bot client
+    mock_client = AsyncMock()
+    mock_client.room_send.return_value = RoomSendResponse("$event", "test_room")
+    mock_client_pool["test_bot"] = mock_client
+
+    # Send a request to the endpoint
+    response = client.post(
+        "/send",
+        json={
+            "username": "test_bot",
+            "room_id": "test_room",
+            "message": "Hello, world!",
+            "txn_id": "txn-1"
+        }
+    )
+
+    # Assert response
+    assert response.status_code == 202, f"Unexpected status code: {response.status_code}"
+    assert response.json()["message"] == "Message queued for test_room"
+    assert response.json()["txn_id"] == "txn-1"
+
+    delivery = wait_for_delivery(client, "txn-1")
+    assert delivery["status"] == "sent"
+    assert delivery["event_id"] == "$event"
+
+    # Verify that room_send was called correctly
+    mock_client.room_send.assert_called_once_with(
+        room_id="test_room",
+        message_type="m.room.message",
+        content={"msgtype": "m.text", "body": "Hello, world!"},
+        tx_id="txn-1",
+    )
 
 @pytest.mark.asyncio
 async def test_send_message_bot_not_found(client):
@@ -62,3 +91,52 @@ async def test_send_message_bot_not_found(client):
     # Assert response
     assert response.status_code == 404, f"Unexpected status code: {response.status_code}"
     assert response.json() == {"detail": "Bot not found"}
+
+
+@pytest.mark.asyncio
+async def test_send_message_retries_with_new_token(client):
+    # The pooled client has a token that was replaced by a new login
+    stale_client = AsyncMock()
+    stale_client.room_send.return_value = RoomSendError("Unknown token", "M_UNKNOWN_TOKEN")
+    fresh_client = AsyncMock()
+    mock_client_pool.clear()
+    mock_client_pool["test_bot"] = stale_client
+
+    with patch("app.clients.get_client_from_pool", AsyncMock(return_value=fresh_client)):
+        response = client.post(
+            "/send",
+            json={
+                "username": "test_bot",
+                "room_id": "test_room",
+                "message": "Hello, world!"
+            }
+        )
+        assert response.status_code == 202
+        delivery = wait_for_delivery(client, response.json()["txn_id"])
+
+    assert delivery["status"] == "sent"
+    stale_client.close.assert_awaited_once()
+    fresh_client.room_send.assert_awaited_once()
+    assert mock_client_pool["test_bot"] is fresh_client
+
+
+@pytest.mark.asyncio
+async def test_same_txn_id_is_sent_once(client):
+    mock_client = AsyncMock()
+    mock_client_pool.clear()
+    mock_client_pool["test_bot"] = mock_client
+    request = {"username": "test_bot", "room_id": "test_room", "message": "Hi", "txn_id": "txn-2"}
+
+    client.post("/send", json=request)
+    wait_for_delivery(client, "txn-2")
+    response = client.post("/send", json=request)
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "sent"
+    mock_client.room_send.assert_awaited_once()
+
+
+def test_unknown_status(client):
+    response = client.get("/status/no-such-txn")
+
+    assert response.status_code == 404
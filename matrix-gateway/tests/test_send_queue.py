@@ -0,0 +1,182 @@
+import asyncio
+import time
+import pytest
+import redis
+from nio import RoomSendError, RoomSendResponse
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import send_queue as send_queue_module
+from app.send_queue import SendQueue, TokenBucket, QueueFull
+
+# Blocking client to clean up the delivery statuses
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def status_keys(monkeypatch):
+    monkeypatch.setattr(send_queue_module, "SEND_STATUS_PREFIX", "test-send:txn:")
+    yield
+    keys = list(sync_redis.scan_iter("test-send:txn:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+class FakeHomeserver:
+    """Records the sends, answers with the queued responses first."""
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.sends = []
+
+    async def send(self, username, room_id, message, txn_id):
+        self.sends.append((time.monotonic(), room_id, message, txn_id))
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return RoomSendResponse(f"$event-{len(self.sends)}", room_id)
+
+
+async def wait_until_done(queue):
+    while queue.pending:
+        await asyncio.sleep(0.005)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    bucket.take()
+    bucket.take()
+
+    assert bucket.delay() == pytest.approx(0.1, abs=0.02)
+    bucket.block(1)
+    assert bucket.delay() == pytest.approx(1, abs=0.02)
+
+
+@pytest.mark.asyncio
+async def test_messages_to_a_room_keep_their_order():
+    homeserver = FakeHomeserver([RoomSendError("busy", "M_UNKNOWN")])
+    queue = SendQueue(homeserver.send, backoff_base=0.001)
+
+    for i in range(5):
+        await queue.submit("bot", "!room", f"message {i}")
+    await wait_until_done(queue)
+
+    # The failed first message is retried before the second one is sent
+    assert [message for _, _, message, _ in homeserver.sends] == ["message 0"] + [f"message {i}" for i in range(5)]
+    assert queue.get_stats()["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_room_bucket_spaces_the_messages():
+    homeserver = FakeHomeserver()
+    queue = SendQueue(homeserver.send, room_rate=20, room_burst=1)
+
+    for i in range(3):
+        await queue.submit("bot", "!room", f"message {i}")
+    await wait_until_done(queue)
+
+    times = [sent for sent, _, _, _ in homeserver.sends]
+    assert times[2] - times[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_retry_after_ms_is_honoured():
+    limited = RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", retry_after_ms=100)
+    homeserver = FakeHomeserver([limited])
+    queue = SendQueue(homeserver.send)
+
+    delivery = await queue.submit("bot", "!room", "hello")
+    await wait_until_done(queue)
+
+    first, second = homeserver.sends
+    assert second[0] - first[0] >= 0.09
+    # The same transaction id on the retry, so the homeserver can deduplicate it
+    assert first[3] == second[3] == delivery["txn_id"]
+    status = await queue.status(delivery["txn_id"])
+    assert status["status"] == "sent"
+    assert status["attempts"] == 2
+    assert queue.get_stats()["rate_limited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts():
+    homeserver = FakeHomeserver([ConnectionError("down")] * 3)
+    queue = SendQueue(homeserver.send, max_attempts=3, backoff_base=0.001)
+
+    delivery = await queue.submit("bot", "!room", "hello")
+    await wait_until_done(queue)
+
+    status = await queue.status(delivery["txn_id"])
+    assert status["status"] == "failed"
+    assert status["error"] == "down"
+    assert len(homeserver.sends) == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limits_count_against_max_attempts():
+    limited = RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", retry_after_ms=1)
+    homeserver = FakeHomeserver([limited] * 5)
+    queue = SendQueue(homeserver.send, max_attempts=3)
+
+    delivery = await queue.submit("bot", "!room", "hello")
+    await wait_until_done(queue)
+
+    status = await queue.status(delivery["txn_id"])
+    assert status["status"] == "failed"
+    assert status["error"] == "M_LIMIT_EXCEEDED"
+    assert len(homeserver.sends) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_transaction_can_be_submitted_again():
+    homeserver = FakeHomeserver([ConnectionError("down")])
+    queue = SendQueue(homeserver.send, max_attempts=1)
+
+    await queue.submit("bot", "!room", "hello", txn_id="event-1")
+    await wait_until_done(queue)
+    assert (await queue.status("event-1"))["status"] == "failed"
+
+    # Redelivered by NATS, the message gets a new try
+    delivery = await queue.submit("bot", "!room", "hello", txn_id="event-1")
+    assert delivery["status"] == "queued"
+    await wait_until_done(queue)
+    assert (await queue.status("event-1"))["status"] == "sent"
+
+    # Delivered, submitting it again does not send it twice
+    delivery = await queue.submit("bot", "!room", "hello", txn_id="event-1")
+    assert delivery["status"] == "sent"
+    assert len(homeserver.sends) == 2
+
+
+@pytest.mark.asyncio
+async def test_full_queue_refuses_messages():
+    blocked = asyncio.Event()
+
+    async def send(*args):
+        await blocked.wait()
+
+    queue = SendQueue(send, max_pending=1)
+    await queue.submit("bot", "!room", "first")
+
+    with pytest.raises(QueueFull):
+        await queue.submit("bot", "!room", "second")
+    blocked.set()
+    await wait_until_done(queue)
+
+
+@pytest.mark.asyncio
+async def test_close_marks_unsent_messages_as_failed():
+    async def send(*args):
+        await asyncio.Event().wait()
+
+    queue = SendQueue(send)
+    first = await queue.submit("bot", "!room", "first")
+    second = await queue.submit("bot", "!room", "second")
+    await asyncio.sleep(0.01)
+
+    await queue.close()
+
+    for delivery in (first, second):
+        assert (await queue.status(delivery["txn_id"]))["status"] == "failed"
+    assert queue.get_stats()["pending"] == 0
@@ -1,6 +1,9 @@
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
 import pytest
-from app.clients import start_sync
+from nio import MatrixInvitedRoom, SyncResponse
+from app.clients import start_sync, client_pool
+
 
 @patch("app.clients.AsyncClient")
 @pytest.mark.asyncio
@@ -8,18 +11,35 @@ async def test_start_sync(mock_client_class):
     # Mock the AsyncClient instance
     mock_client = AsyncMock()
     mock_client_class.return_value = mock_client
+    mock_client.user_id = "@sync_bot:matrix.org"
+
+    # One sync, then the long-poll never returns
+    responses = [MagicMock(spec=SyncResponse, next_batch="s1")]
+
+    async def sync(**kwargs):
+        if not responses:
+            await asyncio.Event().wait()
+        return responses.pop()
 
-    # Mock `sync_forever` to prevent it from running indefinitely
-    mock_client.sync_forever = AsyncMock()
+    mock_client.sync = AsyncMock(side_effect=sync)
 
     # Mock `invited_rooms` to simulate pending invites
+    mock_client.rooms = {}
     mock_client.invited_rooms = {
-        "!room123:matrix.org": "Room 123",
-        "!room456:matrix.org": "Room 456"
+        "!room123:matrix.org": MatrixInvitedRoom("!room123:matrix.org", "@sync_bot:matrix.org"),
+        "!room456:matrix.org": MatrixInvitedRoom("!room456:matrix.org", "@sync_bot:matrix.org"),
     }
 
     # Call start_sync
     await start_sync(mock_client)
+    for _ in range(20):
+        if mock_client.join.await_count == 2:
+            break
+        await asyncio.sleep(0.01)
 
-    # Verify `sync_forever` was called
-    mock_client.sync_forever.assert_called_once_with(timeout=30000)
+    # The first sync returns right away, the invites are joined after it
+    assert mock_client.sync.call_args_list[0].kwargs["timeout"] == 0
+    mock_client.join.assert_any_await("!room123:matrix.org")
+    mock_client.join.assert_any_await("!room456:matrix.org")
+    assert client_pool.is_pinned("sync_bot")
+    client_pool.pop("sync_bot")
@@ -0,0 +1,163 @@
+from unittest.mock import AsyncMock, MagicMock
+import asyncio
+import pytest
+import redis
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from nio import AsyncClient, RoomSendResponse, SyncResponse
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import sync_scheduler as sync_scheduler_module
+from app import sync_state
+from app.sync_scheduler import SyncScheduler, attach
+from app.sync_state import sync_token_key
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def sync_tokens(monkeypatch):
+    """Sync tokens of their own per test."""
+    monkeypatch.setattr(sync_state, "SYNC_TOKEN_PREFIX", "test-sync:")
+    monkeypatch.setattr(sync_state, "SYNC_ROOMS_PREFIX", "test-sync:rooms:")
+    yield
+    keys = list(sync_redis.scan_iter("test-sync:*"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+def synced(next_batch):
+    return MagicMock(spec=SyncResponse, next_batch=next_batch)
+
+
+def fake_client(*responses):
+    """Client returning the responses, and then long-polling forever."""
+    responses = list(responses)
+
+    async def sync(**kwargs):
+        if not responses:
+            await asyncio.Event().wait()
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = AsyncMock(next_batch="", rooms={}, invited_rooms={})
+    client.sync = AsyncMock(side_effect=sync)
+    return client
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_sync_resumes_from_the_stored_token():
+    sync_redis.set(sync_token_key("bot"), "s1")
+    scheduler = SyncScheduler()
+    client = fake_client(synced("s2"), synced("s3"))
+    on_first_sync = AsyncMock()
+
+    scheduler.start("bot", client, on_first_sync=on_first_sync)
+    await wait_for(lambda: client.sync.await_count == 3)
+
+    first, second = client.sync.call_args_list[:2]
+    assert first.kwargs == {"timeout": 0, "since": "s1"}
+    assert second.kwargs == {"timeout": scheduler.timeout, "since": None}
+    on_first_sync.assert_awaited_once_with(client)
+    assert sync_redis.get(sync_token_key("bot")) == "s3"
+    await scheduler.close()
+    assert "bot" not in scheduler
+
+
+@pytest.mark.asyncio
+async def test_failed_syncs_back_off_with_jitter():
+    scheduler = SyncScheduler(backoff_base=0.001, backoff_max=0.004)
+    client = fake_client(ConnectionError("homeserver unavailable"), synced("s1"))
+
+    scheduler.start("bot", client)
+    await wait_for(lambda: scheduler.syncs == 1)
+
+    assert scheduler.errors == 1
+    assert all(0 <= scheduler.backoff(failures) <= 0.004 for failures in range(1, 10))
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_syncs_are_capped_and_shorten_the_timeout():
+    scheduler = SyncScheduler(max_concurrent=2, timeout=30000, min_timeout=5000)
+    clients = [fake_client() for _ in range(5)]
+
+    for i, client in enumerate(clients):
+        scheduler.start(f"bot{i}", client)
+    await wait_for(lambda: scheduler.waiting == 3)
+
+    assert sum(client.sync.await_count for client in clients) == 2
+    assert scheduler.long_poll_timeout() == 12000
+    scheduler.waiting = 100
+    assert scheduler.long_poll_timeout() == 5000
+    scheduler.waiting = 3
+    await scheduler.close()
+    assert scheduler.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_clients_share_the_connections():
+    first, second = AsyncClient("http://localhost:8008", "first"), AsyncClient("http://localhost:8008", "second")
+    attach(first)
+    attach(second)
+
+    assert first.client_session.connector is second.client_session.connector
+    await first.close()
+    assert not second.client_session.connector.closed
+    await second.close()
+    await SyncScheduler().close()
+
+
+@pytest.mark.asyncio
+async def test_sends_are_not_queued_behind_the_long_polls(monkeypatch):
+    monkeypatch.setattr(sync_scheduler_module, "SYNC_MAX_CONNECTIONS", 3)
+    monkeypatch.setattr(sync_scheduler_module, "SYNC_RESERVED_CONNECTIONS", 1)
+    long_polls = []
+    done = asyncio.Event()
+
+    # Homeserver whose long-polls only return at the end of the test
+    async def sync(request):
+        long_polls.append(request)
+        await done.wait()
+        return web.json_response({})
+
+    async def send(request):
+        return web.json_response({"event_id": "$sent"})
+
+    homeserver = web.Application()
+    homeserver.router.add_get("/_matrix/client/r0/sync", sync)
+    homeserver.router.add_put("/_matrix/client/r0/rooms/{room}/send/{type}/{txn}", send)
+    server = TestServer(homeserver)
+    await server.start_server()
+
+    # Asked for more long-polls than the pool can take next to the reserve
+    scheduler = SyncScheduler(max_concurrent=5)
+    clients = []
+    for i in range(4):
+        client = AsyncClient(str(server.make_url("")), f"@bot{i}:localhost")
+        client.access_token = "token"
+        clients.append(client)
+        scheduler.start(f"bot{i}", client)
+    await wait_for(lambda: len(long_polls) == 2)
+
+    assert scheduler.max_concurrent == 2
+    response = await asyncio.wait_for(
+        clients[0].room_send("!room:localhost", "m.room.message", {"msgtype": "m.text", "body": "hi"}),
+        timeout=2,
+    )
+    assert isinstance(response, RoomSendResponse)
+
+    done.set()
+    await scheduler.close()
+    for client in clients:
+        await client.close()
+    await server.close()
@@ -0,0 +1,149 @@
+from unittest.mock import AsyncMock
+import pytest
+import redis
+from nio import AsyncClient
+from app.config import REDIS_URL, REDIS_PORT, REDIS_PASSWORD
+from app import sync_state
+from app.leases import LeaseManager
+from app.sync_scheduler import SyncScheduler
+from app.sync_state import (
+    SyncStateStore,
+    RedisSyncStateStore,
+    FileSyncStateStore,
+    make_store,
+    snapshot_rooms,
+    restore,
+    sync_token_key,
+    sync_rooms_key,
+)
+
+# Blocking client to set up and check the keys from outside the app
+sync_redis = redis.Redis(host=REDIS_URL, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+
+ROOMS = {
+    "joined": {
+        "!room:matrix.org": {
+            "name": "Support",
+            "canonical_alias": "#support:matrix.org",
+            "topic": None,
+            "members": {"@alice:matrix.org": "Alice", "@bot:matrix.org": None},
+        },
+    },
+    "invited": {"!invite:matrix.org": {"name": None, "inviter": "@alice:matrix.org"}},
+}
+
+
+@pytest.fixture(autouse=True)
+def sync_keys(monkeypatch):
+    """Sync state keys of their own per test."""
+    monkeypatch.setattr(sync_state, "SYNC_TOKEN_PREFIX", "test-sync-state:")
+    monkeypatch.setattr(sync_state, "SYNC_ROOMS_PREFIX", "test-sync-state:rooms:")
+    yield
+    keys = list(sync_redis.scan_iter("test-sync-state:*")) + list(sync_redis.scan_iter("lease:bot:fenced-bot"))
+    if keys:
+        sync_redis.delete(*keys)
+
+
+@pytest.fixture(params=["redis", "file"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FileSyncStateStore(str(tmp_path))
+    return RedisSyncStateStore()
+
+
+def test_restore_gives_back_the_snapshot():
+    client = AsyncClient("http://localhost:8008", "@bot:matrix.org")
+    restore(client, {"next_batch": "s1", "rooms": ROOMS})
+
+    assert client.next_batch == "s1"
+    assert client.rooms["!room:matrix.org"].display_name == "Support"
+    assert client.invited_rooms["!invite:matrix.org"].inviter == "@alice:matrix.org"
+    assert snapshot_rooms(client) == ROOMS
+
+
+@pytest.mark.asyncio
+async def test_store_keeps_the_rooms_when_only_the_token_changes(store):
+    assert await store.load("bot") == {"next_batch": None, "rooms": None}
+
+    await store.save("bot", "s1", ROOMS)
+    await store.save("bot", "s2")
+
+    assert await store.load("bot") == {"next_batch": "s2", "rooms": ROOMS}
+    await store.delete("bot")
+    assert await store.load("bot") == {"next_batch": None, "rooms": None}
+
+
+@pytest.mark.asyncio
+async def test_redis_store_only_writes_under_the_lease():
+    leases = LeaseManager("10.0.0.1", ttl=60)
+    store = RedisSyncStateStore(leases)
+
+    assert await store.save("fenced-bot", "s1", ROOMS) is False
+    assert not sync_redis.exists(sync_token_key("fenced-bot"), sync_rooms_key("fenced-bot"))
+
+    await leases.acquire("fenced-bot")
+    assert await store.save("fenced-bot", "s2", ROOMS) is True
+    assert await store.load("fenced-bot") == {"next_batch": "s2", "rooms": ROOMS}
+    await leases.release("fenced-bot")
+
+
+@pytest.mark.asyncio
+async def test_scheduler_saves_the_rooms_only_when_they_changed():
+    store = AsyncMock()
+    scheduler = SyncScheduler(store)
+    client = AsyncClient("http://localhost:8008", "@bot:matrix.org")
+    restore(client, {"rooms": ROOMS})
+
+    await scheduler.save_state("bot", client, "s1")
+    await scheduler.save_state("bot", client, "s2")
+    client.rooms["!room:matrix.org"].add_member("@carol:matrix.org", "Carol", None)
+    await scheduler.save_state("bot", client, "s3")
+
+    saved_rooms = [call.args[2] for call in store.save.call_args_list]
+    assert saved_rooms[0] == ROOMS
+    assert saved_rooms[1] is None
+    assert "@carol:matrix.org" in saved_rooms[2]["joined"]["!room:matrix.org"]["members"]
+
+
+@pytest.mark.asyncio
+async def test_rooms_are_saved_again_when_the_lease_write_failed():
+    store = AsyncMock()
+    store.save.return_value = False
+    scheduler = SyncScheduler(store)
+    client = AsyncClient("http://localhost:8008", "@bot:matrix.org")
+    restore(client, {"rooms": ROOMS})
+
+    await scheduler.save_state("bot", client, "s1")
+    store.save.return_value = True
+    await scheduler.save_state("bot", client, "s2")
+
+    assert [call.args[2] for call in store.save.call_args_list] == [ROOMS, ROOMS]
+
+
+@pytest.mark.asyncio
+async def test_file_store_escapes_the_username(tmp_path):
+    store = FileSyncStateStore(str(tmp_path / "state"))
+
+    await store.save("../escaped", "s1")
+
+    assert [path.name for path in (tmp_path / "state").iterdir()] == ["..%2Fescaped.next_batch"]
+    assert not (tmp_path / "escaped.next_batch").exists()
+    assert (await store.load("../escaped"))["next_batch"] == "s1"
+
+
+def test_make_store():
+    assert isinstance(make_store("redis"), RedisSyncStateStore)
+    assert isinstance(make_store("file"), FileSyncStateStore)
+    with pytest.raises(ValueError):
+        make_store("memcached")
+
+
+def test_store_must_implement_every_method():
+    class TokenOnlyStore(SyncStateStore):
+        async def load(self, username):
+            return {"next_batch": None, "rooms": None}
+
+    with pytest.raises(TypeError):
+        SyncStateStore()
+    with pytest.raises(TypeError, match="delete"):
+        TokenOnlyStore()
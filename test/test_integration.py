@@ -34,7 +34,7 @@ async def test_bots_connection_gateway_to_nats():
     await asyncio.sleep(1)
 
     assert len(messages) == 1
-    message_data = eval(messages[0])
+    message_data = json.loads(messages[0])
     
     assert message_data["platform"] == "Matrix"
     assert message_data["event_type"] == "post"
@@ -74,7 +74,7 @@ async def test_bots_chat_massage_gateway_to_nats():
     await asyncio.sleep(1)
 
     assert len(messages) == 1
-    received_payload = eval(messages[0])
+    received_payload = json.loads(messages[0])
 
     assert received_payload["room_id"] == payload["room_id"]
     assert received_payload["room_name"] == payload["room_name"]
@@ -184,7 +184,7 @@ async def test_full_flow_login():
     await asyncio.sleep(1)
 
     assert len(messages) == 1
-    message_data = eval(messages[0])
+    message_data = json.loads(messages[0])
     
     assert message_data["platform"] == "Matrix"
     assert message_data["event_type"] == "post"
@@ -241,7 +241,7 @@ async def test_full_flow_message():
     await asyncio.sleep(1)
 
     assert len(messages) == 1
-    message_data = eval(messages[0])
+    message_data = json.loads(messages[0])
     
     assert message_data["room_id"] == payload["room_id"]
     assert message_data["room_name"] == payload["room_name"]
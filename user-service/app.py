@@ -1,10 +1,19 @@
-from flask import Flask
+from flask import Flask, jsonify
 from routes import user_routes
+from database import close_db, get_pool_stats
 
 app = Flask(__name__)
 
 # Register the user routes blueprint
 app.register_blueprint(user_routes)
+# Every request gets one session, returned to the pool when the request ends
+app.teardown_appcontext(close_db)
+
+
+@app.route("/metrics/db", methods=["GET"])
+def db_metrics():
+    return jsonify(get_pool_stats()), 200
+
 
 if __name__ == "__main__":
     app.run(debug=True, port=5002, host="0.0.0.0")
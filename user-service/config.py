@@ -22,3 +22,9 @@ class Config:
     POSTGRES_DB = os.getenv('POSTGRES_DB', 'auth_db')
     POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'postgres')
     POSTGRES_PORT = os.getenv('POSTGRES_PORT', 5432)
+    # Connection pool of the database engine, see database.py
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
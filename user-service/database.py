@@ -1,15 +1,72 @@
-from sqlalchemy import create_engine
+import threading
+from flask import g
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from config import Config
 
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+
+# Counted by the pool events below, the pool itself knows what is checked out
+_stats_lock = threading.Lock()
+_counts = {"checkouts": 0, "connections_opened": 0, "connections_closed": 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _counts[name] += 1
+
+
+engine = create_engine(
+    Config.SQLALCHEMY_DATABASE_URI,
+    poolclass=QueuePool,
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+    pool_timeout=Config.DB_POOL_TIMEOUT,
+    pool_recycle=Config.DB_POOL_RECYCLE,
+    pool_pre_ping=Config.DB_POOL_PRE_PING,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-# Dependency to create and close database sessions
+@event.listens_for(engine, "connect")
+def _connection_opened(dbapi_connection, connection_record):
+    _count("connections_opened")
+
+
+@event.listens_for(engine, "close")
+def _connection_closed(dbapi_connection, connection_record):
+    _count("connections_closed")
+
+
+@event.listens_for(engine, "checkout")
+def _connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    _count("checkouts")
+
+
+# Session of the current request, closed by close_db when the request ends
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
+    if "db" not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+# Registered with app.teardown_appcontext, returns the connection to the pool
+def close_db(exception=None):
+    db = g.pop("db", None)
+    if db is not None:
         db.close()
+
+
+def get_pool_stats():
+    pool = engine.pool
+    with _stats_lock:
+        counts = dict(_counts)
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "connections_open": counts["connections_opened"] - counts["connections_closed"],
+        **counts,
+    }
@@ -4,7 +4,7 @@ from database import get_db
 
 
 def get_user_profile(user_id):
-    db = next(get_db())
+    db = get_db()
     try:
         user = get_user_by_id(db, user_id)
         if not user:
@@ -24,7 +24,7 @@ def get_user_profile(user_id):
 
 
 def update_user_profile(user_id, data):
-    db = next(get_db())
+    db = get_db()
     user = get_user_by_id(db, user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -45,7 +45,7 @@ def update_user_profile(user_id, data):
 
 
 def delete_user_profile(user_id):
-    db = next(get_db())
+    db = get_db()
     user = get_user_by_id(db, user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404